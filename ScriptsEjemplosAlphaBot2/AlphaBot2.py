@@ -1,9 +1,17 @@
-import RPi.GPIO as GPIO
 import time
+import threading
+import GPIOBackend
+from GPIOBackend import HIGH, LOW
+
+# Direction pin levels of one wheel, indexed by "runs forward", and of both
+# as DIRECTIONS[right forward][left forward], built once so apply() does not
+# allocate them on every control step.
+WHEEL = ((LOW,HIGH),(HIGH,LOW))
+DIRECTIONS = tuple(tuple(WHEEL[right] + WHEEL[left] for left in (0,1)) for right in (0,1))
 
 class AlphaBot2(object):
 	
-	def __init__(self,ain1=12,ain2=13,ena=6,bin1=20,bin2=21,enb=26):
+	def __init__(self,ain1=12,ain2=13,ena=6,bin1=20,bin2=21,enb=26,gpio=None):
 		self.AIN1 = ain1
 		self.AIN2 = ain2
 		self.BIN1 = bin1
@@ -12,89 +20,202 @@ class AlphaBot2(object):
 		self.ENB = enb
 		self.PA  = 50
 		self.PB  = 50
+		# GPIOBackend.py; the direction pins are one group so every
+		# direction change is a single write
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.DIRECTION = (self.AIN1,self.AIN2,self.BIN1,self.BIN2)
+
+		# Last value written to each direction pin and PWM channel, so only
+		# real changes reach the hardware.  The control loop, the motor
+		# controller and the watchdog all drive the motors from their own
+		# threads, so every command runs under lock from the shadow check
+		# to the last hardware write; the _ methods expect it held.  (No
+		# "with": on this hot path it costs an allocation per call.)
+		self.lock = threading.Lock()
+		self.pins = {}
+		self.duty = {}
+		self.writes = 0
+		self.suppressed = 0
+		self._changedPins = []
+		self._changedValues = []
 
-		GPIO.setmode(GPIO.BCM)
-		GPIO.setwarnings(False)
-		GPIO.setup(self.AIN1,GPIO.OUT)
-		GPIO.setup(self.AIN2,GPIO.OUT)
-		GPIO.setup(self.BIN1,GPIO.OUT)
-		GPIO.setup(self.BIN2,GPIO.OUT)
-		GPIO.setup(self.ENA,GPIO.OUT)
-		GPIO.setup(self.ENB,GPIO.OUT)
-		self.PWMA = GPIO.PWM(self.ENA,500)
-		self.PWMB = GPIO.PWM(self.ENB,500)
+		self.gpio.setup(self.DIRECTION,GPIOBackend.OUT)
+		self.gpio.setup((self.ENA,self.ENB),GPIOBackend.OUT)
+		self.PWMA = self.gpio.PWM(self.ENA,500)
+		self.PWMB = self.gpio.PWM(self.ENB,500)
 		self.PWMA.start(self.PA)
 		self.PWMB.start(self.PB)
+		self.duty[self.ENA] = self.PA
+		self.duty[self.ENB] = self.PB
 		self.stop()
 
+	def output(self, pin, value):
+		self.lock.acquire()
+		try:
+			self._output(pin,value)
+		finally:
+			self.lock.release()
+
+	def outputs(self, pins, values):
+		"output() for several pins, the ones that change written together"
+		self.lock.acquire()
+		try:
+			self._outputs(pins,values)
+		finally:
+			self.lock.release()
+
+	def dutyCycle(self, pwm, pin, value):
+		self.lock.acquire()
+		try:
+			self._dutyCycle(pwm,pin,value)
+		finally:
+			self.lock.release()
+
+	def _output(self, pin, value):
+		if self.pins.get(pin) == value:
+			self.suppressed += 1
+			return
+		self.gpio.output(pin,value)
+		self.pins[pin] = value
+		self.writes += 1
+
+	def _outputs(self, pins, values):
+		changedPins = self._changedPins
+		changedValues = self._changedValues
+		del changedPins[:]
+		del changedValues[:]
+		i = 0
+		while i < len(pins):
+			if self.pins.get(pins[i]) == values[i]:
+				self.suppressed += 1
+			else:
+				changedPins.append(pins[i])
+				changedValues.append(values[i])
+			i += 1
+		if len(changedPins) == 1:
+			self.gpio.output(changedPins[0],changedValues[0])
+		elif changedPins:
+			self.gpio.outputs(changedPins,changedValues)
+		# the shadow only follows a write that happened
+		i = 0
+		while i < len(changedPins):
+			self.pins[changedPins[i]] = changedValues[i]
+			self.writes += 1
+			i += 1
+
+	def _dutyCycle(self, pwm, pin, value):
+		if self.duty.get(pin) == value:
+			self.suppressed += 1
+			return
+		pwm.ChangeDutyCycle(value)
+		self.duty[pin] = value
+		self.writes += 1
+
+	# Forget the shadow state, e.g. after something else drove the pins.
+	def invalidate(self):
+		self.lock.acquire()
+		try:
+			self.pins.clear()
+			self.duty.clear()
+		finally:
+			self.lock.release()
+
+	def resync(self):
+		"Writes the shadow state out again, whatever the hardware holds now"
+		self.lock.acquire()
+		try:
+			pins = dict(self.pins)
+			duty = dict(self.duty)
+			self.pins.clear()
+			self.duty.clear()
+			self._outputs(tuple(pins),tuple(pins.values()))
+			for pin, value in duty.items():
+				self._dutyCycle(self.PWMA if pin == self.ENA else self.PWMB,pin,value)
+		finally:
+			self.lock.release()
+
+	def resetCounters(self):
+		self.writes = 0
+		self.suppressed = 0
+
+	def drive(self, dutyA, dutyB, levels):
+		"Both duty cycles and the four direction pins as one command"
+		self.lock.acquire()
+		try:
+			self._dutyCycle(self.PWMA,self.ENA,dutyA)
+			self._dutyCycle(self.PWMB,self.ENB,dutyB)
+			self._outputs(self.DIRECTION,levels)
+		finally:
+			self.lock.release()
+
 	def forward(self):
-		self.PWMA.ChangeDutyCycle(self.PA)
-		self.PWMB.ChangeDutyCycle(self.PB)
-		GPIO.output(self.AIN1,GPIO.LOW)
-		GPIO.output(self.AIN2,GPIO.HIGH)
-		GPIO.output(self.BIN1,GPIO.LOW)
-		GPIO.output(self.BIN2,GPIO.HIGH)
-
-
-	def stop(self):
-		self.PWMA.ChangeDutyCycle(0)
-		self.PWMB.ChangeDutyCycle(0)
-		GPIO.output(self.AIN1,GPIO.LOW)
-		GPIO.output(self.AIN2,GPIO.LOW)
-		GPIO.output(self.BIN1,GPIO.LOW)
-		GPIO.output(self.BIN2,GPIO.LOW)
+		self.drive(self.PA,self.PB,(LOW,HIGH,LOW,HIGH))
+
+
+	def stop(self, force=False):
+		"force writes every pin and duty cycle even if the shadow says they are already off"
+		self.lock.acquire()
+		try:
+			if force:
+				self.pins.clear()
+				self.duty.clear()
+			self._dutyCycle(self.PWMA,self.ENA,0)
+			self._dutyCycle(self.PWMB,self.ENB,0)
+			self._outputs(self.DIRECTION,(LOW,LOW,LOW,LOW))
+		finally:
+			self.lock.release()
 
 	def backward(self):
-		self.PWMA.ChangeDutyCycle(self.PA)
-		self.PWMB.ChangeDutyCycle(self.PB)
-		GPIO.output(self.AIN1,GPIO.HIGH)
-		GPIO.output(self.AIN2,GPIO.LOW)
-		GPIO.output(self.BIN1,GPIO.HIGH)
-		GPIO.output(self.BIN2,GPIO.LOW)
+		self.drive(self.PA,self.PB,(HIGH,LOW,HIGH,LOW))
 
 		
 	def left(self):
-		self.PWMA.ChangeDutyCycle(30)
-		self.PWMB.ChangeDutyCycle(30)
-		GPIO.output(self.AIN1,GPIO.HIGH)
-		GPIO.output(self.AIN2,GPIO.LOW)
-		GPIO.output(self.BIN1,GPIO.LOW)
-		GPIO.output(self.BIN2,GPIO.HIGH)
+		self.drive(30,30,(HIGH,LOW,LOW,HIGH))
 
 
 	def right(self):
-		self.PWMA.ChangeDutyCycle(30)
-		self.PWMB.ChangeDutyCycle(30)
-		GPIO.output(self.AIN1,GPIO.LOW)
-		GPIO.output(self.AIN2,GPIO.HIGH)
-		GPIO.output(self.BIN1,GPIO.HIGH)
-		GPIO.output(self.BIN2,GPIO.LOW)
+		self.drive(30,30,(LOW,HIGH,HIGH,LOW))
 		
 	def setPWMA(self,value):
 		self.PA = value
-		self.PWMA.ChangeDutyCycle(self.PA)
+		self.dutyCycle(self.PWMA,self.ENA,self.PA)
 
 	def setPWMB(self,value):
 		self.PB = value
-		self.PWMB.ChangeDutyCycle(self.PB)	
+		self.dutyCycle(self.PWMB,self.ENB,self.PB)	
 		
 	def setMotor(self, left, right):
-		if((right >= 0) and (right <= 100)):
-			GPIO.output(self.AIN1,GPIO.HIGH)
-			GPIO.output(self.AIN2,GPIO.LOW)
-			self.PWMA.ChangeDutyCycle(right)
-		elif((right < 0) and (right >= -100)):
-			GPIO.output(self.AIN1,GPIO.LOW)
-			GPIO.output(self.AIN2,GPIO.HIGH)
-			self.PWMA.ChangeDutyCycle(0 - right)
-		if((left >= 0) and (left <= 100)):
-			GPIO.output(self.BIN1,GPIO.HIGH)
-			GPIO.output(self.BIN2,GPIO.LOW)
-			self.PWMB.ChangeDutyCycle(left)
-		elif((left < 0) and (left >= -100)):
-			GPIO.output(self.BIN1,GPIO.LOW)
-			GPIO.output(self.BIN2,GPIO.HIGH)
-			self.PWMB.ChangeDutyCycle(0 - left)
+		if((right < -100) or (right > 100)):
+			right = None
+		if((left < -100) or (left > 100)):
+			left = None
+		self.apply(left, right)
+
+	"""
+	Commits both channels together, same sign convention as setMotor
+	(right drives channel A, left channel B).  Values are clamped to
+	+-100; None leaves that channel untouched.  Direction pins are set
+	before the duty cycles so a wheel never spins the wrong way.
+	"""
+	def apply(self, left, right):
+		if right is not None:
+			right = max(-100, min(100, right))
+		if left is not None:
+			left = max(-100, min(100, left))
+		self.lock.acquire()
+		try:
+			if right is not None and left is not None:
+				self._outputs(self.DIRECTION,DIRECTIONS[right >= 0][left >= 0])
+			elif right is not None:
+				self._outputs(self.DIRECTION[:2],WHEEL[right >= 0])
+			elif left is not None:
+				self._outputs(self.DIRECTION[2:],WHEEL[left >= 0])
+			if right is not None:
+				self._dutyCycle(self.PWMA,self.ENA,abs(right))
+			if left is not None:
+				self._dutyCycle(self.PWMB,self.ENB,abs(left))
+		finally:
+			self.lock.release()
 
 if __name__=='__main__':
 
@@ -104,4 +225,4 @@ if __name__=='__main__':
 		while True:
 			time.sleep(1)
 	except KeyboardInterrupt:
-		GPIO.cleanup()
+		Ab.gpio.cleanup()
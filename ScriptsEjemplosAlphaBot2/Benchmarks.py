@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import itertools
+import tracemalloc
+import argparse
+import Simulator
+
+# taken before Simulator.install() swaps the time functions
+REAL_TIME = time.perf_counter
+
+BASELINE = 'benchmarks.json'
+
+# calls the counts are averaged over: a multiple of every argument cycle below
+COUNTED_CALLS = 600
+
+# shorter timing budgets give runs of a few calls, too noisy even to report
+MIN_SECONDS = 0.2
+
+# how much slower than the baseline a path may time before it fails, and
+# how many more times it is timed before that counts
+TIME_THRESHOLD = 0.5
+TIME_RETRIES = 3
+
+# metric: (threshold option, absolute slack).  Paths that depend on the
+# simulated robot (LineFollower.step) vary by a fraction of an operation.
+METRICS = {
+	'time_us': ('time', 0.0),
+	'gpio_ops': ('count', 0.5),
+	'i2c_transactions': ('count', 0.5),
+	'i2c_bytes': ('count', 0.5),
+	'alloc_bytes': ('alloc', 16.0),
+	'retained_blocks': ('count', 0.5),
+}
+
+"""
+Microbenchmarks for the hardware hot paths.
+
+Every path runs against the recording stand-ins of Simulator.py (RPi.GPIO,
+smbus via FakeSMBus, the TLC1543 and motor models), so the numbers are
+repeatable on any machine and the operation counts are exact.  For each
+case the suite reports, per call:
+
+	time_us           best-of-repeat wall time, the stand-ins included: a
+	                  simulated GPIO call costs about what a real one does,
+	                  so a path that saves operations may not time faster
+	                  here (TLC1543.read against AnalogRead)
+	gpio_ops          GPIO.output/input/PWM calls
+	i2c_transactions  SMBus calls, i2c_bytes the payload they carry
+	alloc_bytes       peak transient Python allocation (tracemalloc)
+	retained_blocks   blocks still alive afterwards, i.e. leaks
+
+	python3 Benchmarks.py --save       record benchmarks.json
+	python3 Benchmarks.py              compare, exit 1 on a regression
+
+Any increase in the counts fails, and allocation may grow by
+--alloc-threshold.  time_us may grow by --time-threshold, 50% by default,
+which leaves room for the run to run noise of a quiet machine.  Wall time
+only means something against a baseline saved on the same host and
+Python, so it is not gated against one from elsewhere; on a loaded or
+noisy machine --no-time-gate still reports it but leaves it out of the
+exit status.
+"""
+
+def cases(sim):
+	"(name, callable) for every benchmarked path, built once the simulator is installed"
+	from TRSensors import TRSensor
+	from TLC1543 import TLC1543
+	from AlphaBot2 import AlphaBot2
+	from PCA9685 import PCA9685
+	from ControlLoop import PID, LineFollower
+	from TraceRecorder import TraceRecorder
+
+	TR = TRSensor()
+	# sweep the sensor bar across the line like calibrate() on the robot
+	y = sim.robot.y
+	for offset in range(-8, 9):
+		sim.robot.y = y + offset*0.5
+		TR.calibrate()
+	sim.robot.y = y
+	pipelined = TRSensor(adc = TLC1543())
+	pipelined.calibratedMin[:] = TR.calibratedMin
+	pipelined.calibratedMax[:] = TR.calibratedMax
+
+	Ab = AlphaBot2()
+	speeds = itertools.cycle([(20, 30), (-20, 30), (20, -30)]).__next__
+	duties = itertools.cycle([20, 40]).__next__
+
+	pwm = PCA9685(0x40, bus = sim.bus)
+	pwm.setPWMFreq(50)
+	pulses = itertools.cycle([1000, 1500, 2000]).__next__
+
+	pid = PID.fromLegacy()
+	errors = itertools.cycle([-300, -100, 0, 150, 400]).__next__
+
+	follower = LineFollower(TR, Ab)
+	traced = LineFollower(TR, Ab)
+	traced.recorder = TraceRecorder(os.devnull, traced)
+
+	return [
+		('TRSensor.AnalogRead', TR.AnalogRead),
+		('TLC1543.read', lambda: pipelined.AnalogRead()),
+		('TRSensor.readCalibrated', TR.readCalibrated),
+		('TRSensor.readLine', TR.readLine),
+		('AlphaBot2.setMotor', lambda: Ab.setMotor(*speeds())),
+		('AlphaBot2.setMotor same', lambda: Ab.setMotor(25, 25)),
+		('AlphaBot2.setPWMA', lambda: Ab.setPWMA(duties())),
+		('PCA9685.setPWM', lambda: pwm.setPWM(0, 0, pulses())),
+		('PCA9685.setServoPulse', lambda: pwm.setServoPulse(1, pulses())),
+		('PID.update', lambda: pid.update(errors(), 0.005)),
+		('LineFollower.step', lambda: follower.step(0.005)),
+		('LineFollower.step traced', lambda: traced.step(0.005)),
+	]
+
+def timeCall(fn, seconds = 0.5, repeat = 10):
+	"Best-of-repeat time of one call of fn in us"
+	for i in range(0, 10):
+		fn()
+	# size a run so that repeat runs take about seconds
+	number = 1
+	while True:
+		start = REAL_TIME()
+		for i in range(0, number):
+			fn()
+		elapsed = REAL_TIME() - start
+		if elapsed * repeat >= seconds or number >= 1 << 20:
+			break
+		number *= 2 if elapsed == 0 else max(2, min(10, int(seconds / repeat / elapsed) + 1))
+	enabled = gc.isenabled()
+	gc.disable()
+	try:
+		best = None
+		for r in range(0, repeat):
+			start = REAL_TIME()
+			for i in range(0, number):
+				fn()
+			elapsed = REAL_TIME() - start
+			best = elapsed if best is None else min(best, elapsed)
+	finally:
+		if enabled:
+			gc.enable()
+	return best / number * 1e6
+
+def measure(sim, fn, seconds = 0.5, repeat = 10):
+	"Per-call figures for fn"
+	best = timeCall(fn, seconds, repeat)
+	ops = sim.gpio.ops
+	transactions = sim.bus.transactions
+	sent = sim.bus.bytes
+	for i in range(0, COUNTED_CALLS):
+		fn()
+	result = {
+		'time_us': best,
+		'gpio_ops': float(sim.gpio.ops - ops) / COUNTED_CALLS,
+		'i2c_transactions': float(sim.bus.transactions - transactions) / COUNTED_CALLS,
+		'i2c_bytes': float(sim.bus.bytes - sent) / COUNTED_CALLS,
+	}
+
+	calls = 200
+	gc.collect()
+	blocks = sys.getallocatedblocks()
+	for i in range(0, calls):
+		fn()
+	gc.collect()
+	result['retained_blocks'] = max(0.0, float(sys.getallocatedblocks() - blocks) / calls)
+
+	tracemalloc.start()
+	try:
+		peak = 0
+		for i in range(0, calls):
+			tracemalloc.reset_peak()
+			before = tracemalloc.get_traced_memory()[0]
+			fn()
+			peak += tracemalloc.get_traced_memory()[1] - before
+	finally:
+		tracemalloc.stop()
+	result['alloc_bytes'] = float(peak) / calls
+	return result
+
+def compare(results, baseline, thresholds):
+	"Regression messages for every metric worse than the baseline by more than its threshold"
+	failures = []
+	for name, base in sorted(baseline.items()):
+		now = results.get(name)
+		if now is None:
+			continue
+		for metric, (kind, slack) in sorted(METRICS.items()):
+			if metric not in base or thresholds.get(kind) is None:
+				continue
+			limit = base[metric] * (1 + thresholds[kind]) + slack
+			if now[metric] > limit + 1e-9:
+				failures.append('%s: %s %.3f > %.3f (baseline %.3f)' % (name, metric, now[metric], limit, base[metric]))
+	return failures
+
+def report(results, baseline = None):
+	print('%-26s %10s %8s %6s %7s %10s %8s' % ('case', 'time_us', 'gpio', 'i2c', 'bytes', 'alloc_B', 'retained'))
+	for name, r in results.items():
+		line = '%-26s %10.2f %8.1f %6.1f %7.1f %10.1f %8.2f' % (name, r['time_us'], r['gpio_ops'],
+			r['i2c_transactions'], r['i2c_bytes'], r['alloc_bytes'], r['retained_blocks'])
+		if baseline and name in baseline and baseline[name]['time_us']:
+			line += '  %+.0f%%' % ((r['time_us'] / baseline[name]['time_us'] - 1) * 100)
+		print(line)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'AlphaBot2 hot path microbenchmarks')
+	parser.add_argument('--baseline', default = BASELINE)
+	parser.add_argument('--save', action = 'store_true', help = 'write the results as the new baseline')
+	parser.add_argument('--only', action = 'append', default = [], help = 'run only cases containing this text')
+	parser.add_argument('--seconds', type = float, default = 0.5,
+		help = 'timing budget per case, at least %g' % MIN_SECONDS)
+	parser.add_argument('--time-threshold', type = float, default = TIME_THRESHOLD,
+		help = 'fail when time_us grows by more than this fraction')
+	parser.add_argument('--no-time-gate', action = 'store_true',
+		help = 'report time_us without failing on it, e.g. on a busy machine')
+	parser.add_argument('--count-threshold', type = float, default = 0.0)
+	parser.add_argument('--alloc-threshold', type = float, default = 0.25)
+	args = parser.parse_args()
+	if args.seconds < MIN_SECONDS:
+		parser.error('--seconds must be at least %g' % MIN_SECONDS)
+
+	host = {'python': platform.python_version(), 'machine': platform.machine(), 'node': platform.node()}
+	try:
+		with open(args.baseline) as f:
+			saved = json.load(f)
+		baseline = saved['cases']
+	except (IOError, ValueError, KeyError):
+		saved = baseline = None
+	timeGate = {'time': args.time_threshold}
+	if args.save or baseline is None or args.no_time_gate:
+		timeGate['time'] = None
+	elif any(saved.get(key) != value for key, value in host.items()):
+		print('time not gated: the baseline is from %s, Python %s' % (saved.get('node', 'another host'),
+			saved.get('python')))
+		timeGate['time'] = None
+
+	sim = Simulator.Simulation().install()
+	# everything runs on this thread: the clock needs no ticker, and its
+	# wake-ups would only add noise to the timings
+	sim.clock.stop()
+	results = {}
+	try:
+		for name, fn in cases(sim):
+			if args.only and not any(text in name for text in args.only):
+				continue
+			result = results[name] = measure(sim, fn, args.seconds)
+			# one slow run on a shared machine is noise, a slower path
+			# stays slower however often it is timed
+			retries = 0
+			while retries < TIME_RETRIES and timeGate['time'] is not None and compare({name: result}, baseline, timeGate):
+				result['time_us'] = min(result['time_us'], timeCall(fn, args.seconds))
+				retries += 1
+	finally:
+		sim.uninstall()
+	report(results, baseline)
+
+	if args.save:
+		with open(args.baseline, 'w') as f:
+			record = dict(host)
+			record['cases'] = results
+			json.dump(record, f, indent = 1, sort_keys = True)
+		print('saved %s' % args.baseline)
+	elif baseline is not None:
+		failures = compare(results, baseline, {'time': timeGate['time'],
+			'count': args.count_threshold, 'alloc': args.alloc_threshold})
+		for failure in failures:
+			print('REGRESSION ' + failure)
+		sys.exit(1 if failures else 0)
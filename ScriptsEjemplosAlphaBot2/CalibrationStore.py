@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import json
+import time
+import socket
+
+# next to this module, so the scripts find the same profiles whatever
+# directory they are started from; ALPHABOT_CALIBRATION overrides it
+ENVIRONMENT = 'ALPHABOT_CALIBRATION'
+PROFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration.json')
+
+"""
+Line sensor calibration profiles on disk, one per robot and surface:
+
+	{"<robot>": {"<surface>": {"min": [...], "max": [...], "time": ...}}}
+
+min and max are TRSensor.calibratedMin/calibratedMax as calibrate() leaves
+them, i.e. the raw readings that map to 0 and to 1000.  robot defaults to
+the host name, so several robots can share one file.  The file is small and
+is rewritten atomically, a power cut never leaves half a profile behind.
+"""
+class CalibrationStore(object):
+
+	def __init__(self, path = None, robot = None):
+		self.path = path or os.environ.get(ENVIRONMENT) or PROFILES
+		self.robot = robot or socket.gethostname()
+
+	def _read(self):
+		try:
+			with open(self.path) as f:
+				profiles = json.load(f)
+		except (IOError, ValueError):
+			return {}
+		return profiles if isinstance(profiles, dict) else {}
+
+	def load(self, surface = 'default'):
+		"(calibratedMin, calibratedMax) or None when there is no such profile"
+		profile = self._read().get(self.robot, {}).get(surface)
+		if not profile:
+			return None
+		return list(profile['min']), list(profile['max'])
+
+	def save(self, calibratedMin, calibratedMax, surface = 'default'):
+		profiles = self._read()
+		profiles.setdefault(self.robot, {})[surface] = {
+			'min': [int(round(v)) for v in calibratedMin],
+			'max': [int(round(v)) for v in calibratedMax],
+			'time': time.time(),
+		}
+		temporary = self.path + '.tmp'
+		with open(temporary, 'w') as f:
+			json.dump(profiles, f, indent = 1, sort_keys = True)
+		os.replace(temporary, self.path)
+
+	def surfaces(self):
+		return sorted(self._read().get(self.robot, {}))
+
+"""
+Keeps a TRSensor calibrated while it drives.
+
+Each sensor has two levels, the reading calibratedMin stands for (0) and
+the one calibratedMax stands for (1000).  Every sample moves the level it is
+nearest to by an exponential average that forgets with halfLife samples, so
+a slow change of ambient light is followed without stopping to spin the
+robot.  What is not a plain level is left out:
+
+  - readings farther than outlier * span from both levels (glare, the edge
+    of the line half under the sensor, a speck of dust)
+  - whole frames with more than maxLine sensors on the line level, the
+    robot is lifted or over a black area rather than over a line
+  - sensors whose levels are less than minSpan apart, which calibrate()
+    never saw cross the line
+
+Every interval samples, the bounds of the sensors whose levels moved by
+threshold counts or more are staged with TR.stageCalibration(); the
+sampler builds their lookup tables a piece per sample, so the rebuild
+(about 0.2ms a sensor) never lands on one frame, and then swaps them in.
+"""
+class OnlineCalibrator(object):
+
+	def __init__(self, TR, halfLife = 2000, outlier = 0.35, maxLine = None,
+			minSpan = 100, interval = 200, threshold = 4):
+		self.TR = TR
+		self.alpha = 1 - 0.5 ** (1.0 / halfLife)
+		self.outlier = outlier
+		self.maxLine = maxLine if maxLine is not None else TR.numSensors // 2
+		self.minSpan = minSpan
+		self.interval = interval
+		self.threshold = threshold
+		self._nearest = [None] * TR.numSensors
+		self.reset()
+
+	def reset(self):
+		"Starts again from TR's current calibration"
+		self.zero = [float(v) for v in self.TR.calibratedMin]
+		self.full = [float(v) for v in self.TR.calibratedMax]
+		self.samples = 0
+		self.rejected = 0
+		self.rejectedFrames = 0
+		self.updates = 0
+		self._published = 0
+		self._staged = (list(self.TR.calibratedMin), list(self.TR.calibratedMax))
+
+	def update(self, raw):
+		"Feeds one AnalogRead sample"
+		zero = self.zero
+		full = self.full
+		nearest = self._nearest
+		lines = 0
+		for i in range(0, len(raw)):
+			nearest[i] = None
+			span = abs(full[i] - zero[i])
+			if span < self.minSpan:
+				continue
+			r = raw[i]
+			toZero = abs(r - zero[i])
+			toFull = abs(r - full[i])
+			if min(toZero, toFull) > self.outlier * span:
+				self.rejected += 1
+			elif toZero <= toFull:
+				nearest[i] = zero
+			else:
+				nearest[i] = full
+				lines += 1
+		if lines > self.maxLine:
+			self.rejectedFrames += 1
+			return
+		alpha = self.alpha
+		for i in range(0, len(raw)):
+			level = nearest[i]
+			if level is not None:
+				level[i] += alpha * (raw[i] - level[i])
+		self.samples += 1
+		if self.samples - self._published >= self.interval:
+			self.publish()
+
+	def publish(self):
+		"Stages the levels of the sensors that moved far enough into TR"
+		self._published = self.samples
+		zero = list(self._staged[0])
+		full = list(self._staged[1])
+		threshold = self.threshold
+		moved = False
+		for i in range(0, len(zero)):
+			for bounds, level in ((zero, self.zero[i]), (full, self.full[i])):
+				level = int(round(level))
+				if abs(level - bounds[i]) >= threshold:
+					bounds[i] = level
+					moved = True
+		if not moved:
+			return False
+		self._staged = (zero, full)
+		self.TR.stageCalibration(zero, full)
+		self.updates += 1
+		return True
+
+if __name__ == '__main__':
+	import random
+	import tempfile
+
+	class Bar(object):
+		numSensors = 5
+		calibratedMin = [880, 879, 877, 877, 879]
+		calibratedMax = [881, 63, 64, 63, 880]
+
+		def stageCalibration(self, calibratedMin, calibratedMax):
+			self.calibratedMin[:] = calibratedMin
+			self.calibratedMax[:] = calibratedMax
+
+	store = CalibrationStore(os.path.join(tempfile.mkdtemp(), PROFILES), robot = 'alphabot')
+	store.save(Bar.calibratedMin, Bar.calibratedMax, 'desk')
+	start = time.perf_counter()
+	profile = store.load('desk')
+	print('load: %.0f us %s' % ((time.perf_counter() - start) * 1e6, profile))
+
+	# the room gets 15% darker while the middle sensor follows the line
+	bar = Bar()
+	online = OnlineCalibrator(bar)
+	for n in range(0, 20000):
+		gain = 1 - 0.15 * n / 20000.0
+		raw = [int(random.gauss(880, 4) * gain) for i in range(0, 5)]
+		raw[2] = int(random.gauss(64, 4) * gain)
+		if n % 500 == 0:
+			# lifted: every sensor sees the void
+			raw = [40] * 5
+		online.update(raw)
+	print('min %s max %s updates %d rejected %d frames %d' % (bar.calibratedMin,
+		bar.calibratedMax, online.updates, online.rejected, online.rejectedFrames))
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import json
+import time
+import threading
+import Telemetry
+
+# Line_Follow.py's gains were tuned per iteration; this is the loop period
+# they are assumed to have been tuned at.
+LEGACY_PERIOD = 0.01
+
+# written by PIDTuner.py, next to this module like CalibrationStore's
+# profiles; ALPHABOT_GAINS overrides it
+GAINS_ENVIRONMENT = 'ALPHABOT_GAINS'
+GAINS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gains.json')
+
+def gainsPath(path = None):
+	return path or os.environ.get(GAINS_ENVIRONMENT) or GAINS
+
+"""
+The tuned {'kp', 'ki', 'kd', 'maximum'} from PIDTuner.py's output, or None
+if it has not been run; build the loop with
+PID(gains['kp'], gains['ki'], gains['kd'], gains['maximum']).  Says which
+file it used, so a run on the legacy gains shows.
+"""
+def loadGains(path = None):
+	path = gainsPath(path)
+	try:
+		with open(path) as f:
+			gains = json.load(f)['chosen']
+	except (IOError, ValueError, KeyError):
+		print('no tuned gains in %s, using the legacy ones' % path)
+		return None
+	print('gains from %s: kp=%g ki=%g kd=%g maximum=%g' % (path, gains['kp'], gains['ki'], gains['kd'], gains['maximum']))
+	return gains
+
+"""
+PID with gains in per-second units, so its output does not change with the
+loop rate.  The integral is clamped to what can still move the output
+(anti-windup) and is not accumulated while the output is saturated in the
+same direction.
+"""
+class PID(object):
+
+	def __init__(self, kp, ki, kd, limit, integralLimit = None):
+		self.kp = kp
+		self.ki = ki
+		self.kd = kd
+		self.limit = limit
+		if integralLimit is None and ki != 0:
+			integralLimit = limit / abs(ki)
+		self.integralLimit = integralLimit
+		self.reset()
+
+	"""
+	Gains equivalent to Line_Follow.py's
+	proportional/30 + integral/10000 + derivative*2
+	when that loop runs every period seconds.
+	"""
+	@classmethod
+	def fromLegacy(cls, kp = 1/30.0, ki = 1/10000.0, kd = 2.0, limit = 35, period = LEGACY_PERIOD):
+		return cls(kp, ki / period, kd * period, limit)
+
+	def reset(self):
+		self.integral = 0.0
+		self.last_error = None
+		self.proportional = 0.0
+		self.derivative = 0.0
+		self.output = 0.0
+
+	def update(self, error, dt):
+		if self.last_error is None:
+			self.last_error = error
+		self.proportional = error
+		self.derivative = (error - self.last_error) / dt
+		self.last_error = error
+		integral = self.integral + error * dt
+		if self.integralLimit is not None:
+			integral = max(-self.integralLimit, min(self.integralLimit, integral))
+		output = self.kp * error + self.ki * integral + self.kd * self.derivative
+		# conditional integration: keep the old integral if the new one
+		# would only push further into saturation
+		if (output > self.limit and error > 0) or (output < -self.limit and error < 0):
+			integral = self.integral
+			output = self.kp * error + self.ki * integral + self.kd * self.derivative
+		self.integral = integral
+		self.output = max(-self.limit, min(self.limit, output))
+		return self.output
+
+"""
+Runs step(dt) every period seconds against time.perf_counter() deadlines.
+
+When a step overruns its slot the policy decides what happens next:
+  'skip'     the missed slots are dropped and the next step gets the real
+             elapsed time as dt
+  'catchup'  up to maxCatchup missed steps run back to back with the
+             nominal dt, then the schedule is resynchronised
+
+With Instruments every step and its wake-up lateness also go into their
+histograms, and every overrun counts as a deadline_miss.
+"""
+class ControlLoop(object):
+
+	def __init__(self, step, period = 0.005, policy = 'skip', maxCatchup = 3, instruments = None):
+		if policy not in ('skip', 'catchup'):
+			raise ValueError("policy must be 'skip' or 'catchup'")
+		self.step = step
+		self.period = period
+		self.policy = policy
+		self.maxCatchup = maxCatchup
+		self.instruments = instruments
+		self.running = False
+		self._thread = None
+		self.resetStats()
+
+	def resetStats(self):
+		self.iterations = 0
+		self.overruns = 0
+		self.skipped = 0
+		self.stepMin = None
+		self.stepMax = 0.0
+		self.stepTotal = 0.0
+		self.lateMax = 0.0
+
+	def stats(self):
+		return {
+			'iterations': self.iterations,
+			'overruns': self.overruns,
+			'skipped': self.skipped,
+			'period': self.period,
+			'step_min': self.stepMin or 0.0,
+			'step_max': self.stepMax,
+			'step_mean': self.stepTotal / self.iterations if self.iterations else 0.0,
+			'late_max': self.lateMax,
+		}
+
+	def run(self):
+		"Runs in the calling thread until stop()"
+		self.running = True
+		period = self.period
+		inst = self.instruments
+		clock = time.perf_counter
+		deadline = clock()
+		dt = period
+		behind = 0
+		while self.running:
+			start = clock()
+			late = start - deadline
+			if late > self.lateMax:
+				self.lateMax = late
+			self.step(dt)
+			end = clock()
+			elapsed = end - start
+			self.iterations += 1
+			self.stepTotal += elapsed
+			if self.stepMin is None or elapsed < self.stepMin:
+				self.stepMin = elapsed
+			if elapsed > self.stepMax:
+				self.stepMax = elapsed
+			if inst is not None:
+				inst.step.record(int(elapsed * 1e9))
+				inst.late.record(int(late * 1e9) if late > 0 else 0)
+			deadline += period
+			if end > deadline:
+				self.overruns += 1
+				if inst is not None:
+					inst.count('deadline_miss')
+				missed = int((end - deadline) / period) + 1
+				if self.policy == 'catchup' and behind < self.maxCatchup:
+					behind += 1
+					dt = period
+					continue
+				# resynchronise on the grid after the missed slots
+				self.skipped += missed
+				deadline += missed * period
+				dt = period * (missed + 1) if self.policy == 'skip' else period
+			else:
+				dt = period
+			behind = 0
+			delay = deadline - clock()
+			if delay > 0:
+				time.sleep(delay)
+
+	def start(self):
+		self._thread = threading.Thread(target=self.run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		self.running = False
+		if self._thread is not None and self._thread is not threading.current_thread():
+			self._thread.join()
+		self._thread = None
+
+"""
+The Line_Follow.py control law as a ControlLoop step: reads the newest
+position (from the TRSensor sampler when it is running), runs the PID on
+the offset from the centre and drives AlphaBot2.setPWMA/setPWMB.  With a
+Telemetry channel every iteration is also recorded there, with a
+TraceRecorder (TraceRecorder.py) it is appended to a binary trace, with
+Instruments the read, compute and actuate phases are timed.  clock gives
+the step times (time.perf_counter); a replay passes the recorded ones.
+
+With a LineEstimator (LineEstimator.py) the PID gets the estimated position
+at the time of the step instead of the last reading, so the loop may run
+faster than the sampler and keeps steering for a while when the line is
+lost.
+"""
+class LineFollower(object):
+
+	def __init__(self, TR, Ab, maximum = 35, pid = None, telemetry = None, instruments = None, estimator = None,
+			recorder = None, clock = None):
+		self.TR = TR
+		self.Ab = Ab
+		self.maximum = maximum
+		self.pid = pid or PID.fromLegacy(limit = maximum)
+		self.center = (TR.numSensors - 1)*1000/2
+		self.position = self.center
+		self.sensors = [0]*TR.numSensors
+		self.power_difference = 0.0
+		self.lastSeq = 0
+		self.fresh = False
+		self.timestamp = 0.0
+		self.raw = None
+		self.telemetry = telemetry
+		self.instruments = instruments
+		self.estimator = estimator
+		self.estimate = self.position
+		self.recorder = recorder
+		self.clock = clock if clock is not None else time.perf_counter
+		self.now = 0.0
+		self.offTrack = False
+
+	def read(self):
+		if self.TR.samples is not None:
+			frame = self.TR.latest()
+			if frame is None:
+				return False
+			self.fresh = frame[0] != self.lastSeq
+			self.lastSeq,self.timestamp = frame[0],frame[1]
+			self.position,self.sensors,self.raw = frame[2],frame[3],frame[4]
+		else:
+			self.position,self.sensors = self.TR.readLine()
+			self.raw = self.TR.last_raw
+			self.fresh = True
+			self.timestamp = self.clock()
+		return True
+
+	def step(self, dt):
+		inst = self.instruments
+		if inst is not None:
+			clock = time.perf_counter_ns
+			start = clock()
+		if not self.read():
+			return
+		if inst is not None:
+			now = clock()
+			inst.read.record(now - start)
+			start = now
+		if self.estimator is not None or self.recorder is not None:
+			self.now = self.clock()
+		self.offTrack = min(self.sensors) > 900
+		if self.offTrack:
+			# off the track (robot lifted or on a black area): stop
+			self.Ab.setPWMA(0)
+			self.Ab.setPWMB(0)
+			self.record(dt)
+			return
+		# The difference between the two motor power settings, m1 - m2.
+		# Positive turns the robot to the right, negative to the left, and
+		# the magnitude sets the sharpness of the turn.
+		self.pid.limit = self.maximum
+		position = self.position
+		estimator = self.estimator
+		if estimator is not None:
+			if self.fresh:
+				estimator.update(self.timestamp, position, self.sensors)
+			position = self.estimate = estimator.predict(self.now)
+		power_difference = self.pid.update(position - self.center, dt)
+		self.power_difference = power_difference
+		if estimator is not None:
+			estimator.command(power_difference, self.maximum)
+		if inst is not None:
+			now = clock()
+			inst.compute.record(now - start)
+			start = now
+		if (power_difference < 0):
+			self.Ab.setPWMA(self.maximum + power_difference)
+			self.Ab.setPWMB(self.maximum)
+		else:
+			self.Ab.setPWMA(self.maximum)
+			self.Ab.setPWMB(self.maximum - power_difference)
+		if inst is not None:
+			inst.actuate.record(clock() - start)
+		self.record(dt)
+
+	def record(self, dt):
+		if self.recorder is not None:
+			self.recorder.step(self, dt)
+		if self.telemetry is None:
+			return
+		frame = self.telemetry.frame
+		frame[Telemetry.POSITION] = self.position
+		n = len(self.sensors)
+		frame[Telemetry.CAL:Telemetry.CAL + n] = self.sensors
+		if self.raw is not None:
+			frame[Telemetry.RAW:Telemetry.RAW + n] = self.raw
+		pid = self.pid
+		frame[Telemetry.PROPORTIONAL] = pid.proportional
+		frame[Telemetry.INTEGRAL] = pid.integral
+		frame[Telemetry.DERIVATIVE] = pid.derivative
+		frame[Telemetry.OUTPUT] = pid.output
+		frame[Telemetry.DUTY_A] = self.Ab.PA
+		frame[Telemetry.DUTY_B] = self.Ab.PB
+		self.telemetry.commit()
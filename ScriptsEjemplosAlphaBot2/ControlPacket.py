@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import struct
+import time
+
+"""
+Fixed-size binary control packet for the UDP control channel.
+
+  offset size  field
+  0      1     version (1)
+  1      1     mode: MODE_XY (joystick x, y) or MODE_WHEELS (left, right)
+  2      4     sequence number, uint32, wraps around
+  6      4     sender timestamp in ms, uint32, wraps around
+  10     2     a: x or left, int16, -32767..32767 = -1.0..1.0
+  12     2     b: y or right, same scale
+
+All fields are big-endian (network order), 14 bytes in total.
+"""
+VERSION = 1
+MODE_XY = 0
+MODE_WHEELS = 1
+FORMAT = struct.Struct('!BBIIhh')
+SIZE = FORMAT.size
+SCALE = 32767
+
+def quantize(value):
+	return int(round(max(-1.0, min(1.0, value)) * SCALE))
+
+def pack(seq, a, b, mode = MODE_XY, timestamp = None):
+	if timestamp is None:
+		timestamp = int(time.monotonic() * 1000)
+	return FORMAT.pack(VERSION, mode, seq & 0xFFFFFFFF, timestamp & 0xFFFFFFFF, quantize(a), quantize(b))
+
+def unpack(data):
+	"Returns (mode, seq, timestamp, a, b) or None if the packet is malformed"
+	if len(data) != SIZE:
+		return None
+	version, mode, seq, timestamp, a, b = FORMAT.unpack(data)
+	if version != VERSION or mode not in (MODE_XY, MODE_WHEELS):
+		return None
+	return mode, seq, timestamp, a / float(SCALE), b / float(SCALE)
+
+"""
+Drops every packet that is not newer than the last one applied, using
+serial number arithmetic so the sequence can wrap.  After resetAfter seconds
+of silence any sequence number is accepted again, so a restarted sender
+does not have to continue the old sequence.
+"""
+class SequenceFilter(object):
+
+	def __init__(self, resetAfter = 1.0):
+		self.resetAfter = resetAfter
+		self.last = None
+		self.lastTime = 0.0
+		self.accepted = 0
+		self.stale = 0
+
+	def accept(self, seq, now = None):
+		if now is None:
+			now = time.monotonic()
+		if self.last is not None and now - self.lastTime < self.resetAfter:
+			delta = (seq - self.last) & 0xFFFFFFFF
+			if delta == 0 or delta >= 0x80000000:
+				self.stale += 1
+				return False
+		self.last = seq
+		self.lastTime = now
+		self.accepted += 1
+		return True
@@ -0,0 +1,376 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ============================================================================
+# In-memory stand-in for the libgpiod 2 Python bindings (import gpiod)
+# ============================================================================
+#
+# Enough of gpiod.request_lines() and its line requests for GPIOBackend.Gpiod:
+# set_value(s), get_value(s), reconfigure_lines(), edge events on the request
+# fd and release().  A line can only be held by one request at a time, as
+# with the kernel, and every level a line takes is kept in Chip.history, so a
+# glitch on a driven pin shows.  Inputs are driven from outside with
+# Chip.drive(), which queues edge events like the kernel does:
+#
+#   FakeGpiod.install()
+#   gpio = GPIOBackend.Gpiod('/dev/gpiochip0')
+#   gpio.setup(17, GPIOBackend.IN)
+#   gpio.add_event_detect(17, GPIOBackend.BOTH, callback=print)
+#   FakeGpiod.chip('/dev/gpiochip0').drive(17, 0)
+#
+# python3 FakeGpiod.py runs the Gpiod backend through setup, output, input,
+# PWM and edge events against it.  On a kernel with gpio-sim the same paths
+# can be run for real, see GPIOBackend.py.  python3 FakeGpiod.py --pwm-load
+# runs a 200Hz line follow loop and the 500Hz sampler in real time next to
+# the software motor PWM at several rates and prints what the PWM thread
+# costs them: loop overruns and the Instruments step/late/adc histograms.
+
+import os
+import sys
+import enum
+import errno
+import threading
+import collections
+
+class Direction(enum.Enum):
+	AS_IS = 1
+	INPUT = 2
+	OUTPUT = 3
+
+class Value(enum.Enum):
+	INACTIVE = 0
+	ACTIVE = 1
+
+class Bias(enum.Enum):
+	AS_IS = 1
+	UNKNOWN = 2
+	DISABLED = 3
+	PULL_UP = 4
+	PULL_DOWN = 5
+
+class Edge(enum.Enum):
+	NONE = 1
+	RISING = 2
+	FALLING = 3
+	BOTH = 4
+
+class RequestReleasedError(Exception):
+	pass
+
+class LineSettings(object):
+
+	def __init__(self, direction = Direction.AS_IS, edge_detection = Edge.NONE, bias = Bias.AS_IS,
+			output_value = Value.INACTIVE):
+		self.direction = direction
+		self.edge_detection = edge_detection
+		self.bias = bias
+		self.output_value = output_value
+
+# line_offset and the edge as in gpiod.EdgeEvent, event_type RISING or FALLING
+EdgeEvent = collections.namedtuple('EdgeEvent', 'event_type timestamp_ns line_offset')
+
+"""
+One GPIO chip: the level of every line, who holds it and every level change
+as (offset, level) in history.
+"""
+class Chip(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.levels = {}
+		self.external = {}
+		self.owners = {}
+		self.history = []
+		self.log = []
+		self.lock = threading.Lock()
+
+	def _set(self, offset, level):
+		if self.levels.get(offset) != level:
+			self.levels[offset] = level
+			self.history.append((offset, level))
+			return True
+		return False
+
+	def _settle(self, offset, settings):
+		"The level a line takes with settings: its output value, or what drives it"
+		if settings.direction == Direction.OUTPUT:
+			self._set(offset, 1 if settings.output_value == Value.ACTIVE else 0)
+		elif offset in self.external:
+			self._set(offset, self.external[offset])
+		elif settings.bias == Bias.PULL_UP:
+			self._set(offset, 1)
+		elif settings.bias == Bias.PULL_DOWN:
+			self._set(offset, 0)
+
+	def drive(self, offset, level):
+		"An outside level on an input line, e.g. a button or an echo pulse"
+		with self.lock:
+			self.external[offset] = level
+			request = self.owners.get(offset)
+			if request is None or request.config[offset].direction == Direction.OUTPUT:
+				self._set(offset, level)
+				return
+			if self._set(offset, level):
+				request._edge(offset, level)
+
+chips = {}
+
+def chip(path):
+	if path not in chips:
+		chips[path] = Chip(path)
+	return chips[path]
+
+def _offsets(config):
+	for key, settings in config.items():
+		for offset in (key if isinstance(key, (tuple, list)) else (key,)):
+			yield offset, settings if settings is not None else LineSettings()
+
+class LineRequest(object):
+
+	def __init__(self, chip, consumer, config):
+		self.chip = chip
+		self.consumer = consumer
+		self.config = {}
+		self.events = collections.deque()
+		self.fd, self._write = os.pipe()
+		self.released = False
+		with chip.lock:
+			offsets = [offset for offset, settings in _offsets(config)]
+			for offset in offsets:
+				if offset in chip.owners:
+					os.close(self.fd)
+					os.close(self._write)
+					raise OSError(errno.EBUSY, 'line %d is busy' % offset)
+			for offset, settings in _offsets(config):
+				chip.owners[offset] = self
+				self.config[offset] = settings
+				chip._settle(offset, settings)
+			chip.log.append(('request', tuple(sorted(self.config))))
+
+	@property
+	def offsets(self):
+		return sorted(self.config)
+
+	def _check(self, offsets):
+		if self.released:
+			raise RequestReleasedError()
+		for offset in offsets:
+			if offset not in self.config:
+				raise ValueError('line %d is not in this request' % offset)
+
+	def _edge(self, offset, level):
+		# with chip.lock held
+		edge = self.config[offset].edge_detection
+		if edge == Edge.BOTH or edge == (Edge.RISING if level else Edge.FALLING):
+			self.events.append(EdgeEvent(Edge.RISING if level else Edge.FALLING,
+				time_ns(), offset))
+			os.write(self._write, b'e')
+
+	def reconfigure_lines(self, config):
+		"Every line of the request takes its new settings, outputs their output_value"
+		chip = self.chip
+		with chip.lock:
+			self._check(offset for offset, settings in _offsets(config))
+			for offset, settings in _offsets(config):
+				self.config[offset] = settings
+				chip._settle(offset, settings)
+			chip.log.append(('reconfigure', tuple(sorted(self.config))))
+
+	def set_value(self, offset, value):
+		self.set_values({offset: value})
+
+	def set_values(self, values):
+		chip = self.chip
+		with chip.lock:
+			self._check(values)
+			for offset, value in values.items():
+				if self.config[offset].direction != Direction.OUTPUT:
+					raise OSError(errno.EPERM, 'line %d is not an output' % offset)
+				chip._set(offset, 1 if value == Value.ACTIVE else 0)
+			chip.log.append(('set', tuple(sorted(values))))
+
+	def get_value(self, offset):
+		return self.get_values([offset])[0]
+
+	def get_values(self, offsets = None):
+		chip = self.chip
+		offsets = self.offsets if offsets is None else list(offsets)
+		with chip.lock:
+			self._check(offsets)
+			chip.log.append(('get', tuple(offsets)))
+			return [Value.ACTIVE if chip.levels.get(offset, 0) else Value.INACTIVE for offset in offsets]
+
+	def read_edge_events(self, max_events = None):
+		"Blocks until there is an event, as the real one does"
+		os.read(self.fd, 1)
+		with self.chip.lock:
+			if self.released:
+				raise RequestReleasedError()
+			events = []
+			while self.events and (max_events is None or len(events) < max_events):
+				events.append(self.events.popleft())
+			# one byte was written per event
+			if len(events) > 1:
+				os.read(self.fd, len(events) - 1)
+			return events
+
+	def release(self):
+		chip = self.chip
+		with chip.lock:
+			if self.released:
+				return
+			self.released = True
+			for offset in self.config:
+				if chip.owners.get(offset) is self:
+					del chip.owners[offset]
+			chip.log.append(('release', tuple(sorted(self.config))))
+		os.close(self._write)
+		os.close(self.fd)
+
+def time_ns():
+	import time
+	return time.monotonic_ns()
+
+def request_lines(path, consumer = None, config = None, output_values = None, event_buffer_size = None):
+	return LineRequest(chip(path), consumer, config or {})
+
+def install():
+	"Makes import gpiod and gpiod.line find this module"
+	module = sys.modules[__name__]
+	sys.modules['gpiod'] = module
+	sys.modules['gpiod.line'] = module
+	return module
+
+class ConstantADC(object):
+	"TLC1543 stand-in for pwmLoad(): the line under the middle sensor"
+
+	def read(self, channels):
+		return [100, 300, 900, 300, 100][:len(channels)]
+
+def pwmLoad(frequency, seconds = 5.0):
+	"""
+	Loop overruns and Instruments with the motor PWM at frequency Hz (None:
+	no PWM thread at all), everything else as Line_Follow.py runs it.
+	"""
+	import time
+	import GPIOBackend
+	from AlphaBot2 import AlphaBot2
+	from TRSensors import TRSensor
+	from ControlLoop import ControlLoop, LineFollower
+	from Instrumentation import Instruments
+	path = '/dev/gpiochip-load-%s' % frequency
+	gpio = GPIOBackend.Gpiod(path, pwmLimit = frequency or 500)
+	Ab = AlphaBot2(gpio = gpio)
+	if frequency is None:
+		# steady enables: the duty cycles never reach the pins
+		Ab.PWMA.stop()
+		Ab.PWMB.stop()
+		Ab.PWMA.ChangeDutyCycle = Ab.PWMB.ChangeDutyCycle = lambda duty: None
+	TR = TRSensor(adc = ConstantADC(), gpio = gpio)
+	instruments = Instruments()
+	TR.startSampler(rate = 500, instruments = instruments)
+	follower = LineFollower(TR, Ab, instruments = instruments)
+	loop = ControlLoop(follower.step, 0.005, instruments = instruments)
+	Ab.forward()
+	time.sleep(0.2)
+	instruments.reset()
+	mark = len(chip(path).history)
+	loop.start()
+	time.sleep(seconds)
+	loop.stop()
+	toggles = len(chip(path).history) - mark
+	TR.stopSampler()
+	Ab.stop()
+	gpio.cleanup()
+	return loop.stats(), instruments, toggles / seconds
+
+if __name__ == '__main__' and '--pwm-load' in sys.argv:
+	install()
+	for frequency in (None, 100, 200, 500):
+		stats, instruments, writes = pwmLoad(frequency)
+		late = instruments.late
+		print('PWM %4s: %5.0f pin writes/s, %d/%d overruns, late p99 %.0fus max %.0fus, step p99 %.0fus, adc p99 %.0fus' % (
+			'off' if frequency is None else '%dHz' % frequency, writes, stats['overruns'], stats['iterations'],
+			late.percentile(0.99) / 1000.0, late.max / 1000.0, instruments.step.percentile(0.99) / 1000.0,
+			instruments.adc.percentile(0.99) / 1000.0))
+
+elif __name__ == '__main__':
+	import time
+	install()
+	import GPIOBackend
+	from GPIOBackend import OUT, IN, PUD_UP, BOTH, LOW, HIGH
+
+	PATH = '/dev/gpiochip0'
+	sim = chip(PATH)
+	gpio = GPIOBackend.Gpiod(PATH)
+
+	# setup: one group is one request, outputs start at their initial level
+	direction = (12, 13, 20, 21)
+	gpio.setup(direction, OUT, initial = LOW)
+	gpio.setup((6, 26), OUT)
+	assert len(set(gpio.requests[pin] for pin in direction)) == 1
+	assert [sim.levels[pin] for pin in direction + (6, 26)] == [0] * 6
+
+	# output/outputs: one set per request, inputs through one get
+	gpio.output(12, HIGH)
+	gpio.outputs(direction, (HIGH, LOW, LOW, HIGH))
+	gpio.outputs((12, 6), (LOW, HIGH))
+	assert [sim.levels[pin] for pin in direction + (6,)] == [0, 0, 0, 1, 1]
+	buttons = (7, 8, 9)
+	gpio.setup(buttons, IN, PUD_UP)
+	sim.drive(8, 0)
+	del sim.log[:]
+	assert gpio.inputs(buttons) == [1, 0, 1] and gpio.input(8) == 0
+	assert sim.log == [('get', buttons), ('get', (8,))], sim.log
+
+	# set up again, merged or in part: driven outputs keep their level
+	gpio.output(20, HIGH)
+	mark = len(sim.history)
+	gpio.setup(direction + (6, 26), OUT)
+	assert [sim.levels[pin] for pin in direction + (6, 26)] == [0, 0, 1, 1, 1, 0]
+	gpio.setup(13, OUT)
+	gpio.setup(12, OUT, initial = HIGH)
+	assert sim.history[mark:] == [(12, 1)], sim.history[mark:]
+
+	# edge events reach the callback from the watch thread, also after the
+	# request they came from was merged into another one
+	edges = []
+	gpio.setup(17, IN)
+	gpio.add_event_detect(17, BOTH, callback = edges.append)
+	sim.drive(17, 1)
+	sim.drive(17, 0)
+	deadline = time.monotonic() + 1.0
+	while len(edges) < 2 and time.monotonic() < deadline:
+		time.sleep(0.01)
+	assert edges == [17, 17], edges
+	gpio.setup((17, 27), IN)
+	gpio.add_event_detect(17, BOTH, callback = edges.append)
+	sim.drive(17, 1)
+	deadline = time.monotonic() + 1.0
+	while len(edges) < 3 and time.monotonic() < deadline:
+		time.sleep(0.01)
+	assert edges == [17] * 3, edges
+	gpio.remove_event_detect(17)
+	sim.drive(17, 0)
+	time.sleep(0.1)
+	assert len(edges) == 3
+
+	# PWM: a 50% and a 25% channel toggle in software, at 100Hz whatever
+	# they ask for, stop is low
+	a = gpio.PWM(6, 500)
+	b = gpio.PWM(26, 500)
+	a.start(50)
+	b.start(25)
+	mark = len(sim.history)
+	time.sleep(0.2)
+	toggles = sim.history[mark:]
+	for pin in (6, 26):
+		count = sum(1 for offset, level in toggles if offset == pin)
+		assert 20 < count < 60, (pin, count)
+	a.stop()
+	b.stop()
+	assert sim.levels[6] == 0 and sim.levels[26] == 0
+
+	gpio.cleanup()
+	assert not sim.owners, sim.owners
+	print('Gpiod: setup, outputs, inputs, merges, edge events and PWM ok (%d ioctls)' % gpio.syscalls)
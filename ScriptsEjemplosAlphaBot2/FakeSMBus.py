@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+# ============================================================================
+# In-memory stand-in for smbus.SMBus that counts bus transactions
+# ============================================================================
+#
+# Every device address gets 256 byte registers.  Block writes honour the
+# PCA9685 MODE1 auto-increment bit (0x20): with it set the register pointer
+# advances after each byte, without it every byte lands in the same register,
+# as on the real chip.  Use it to check how many I2C round trips a piece of
+# code costs without any hardware:
+#
+#   bus = SMBus(1)
+#   pwm = PCA9685(bus=bus)
+#   bus.reset()
+#   pwm.setPWMs({0: (0, 300), 1: (0, 300)})
+#   print(bus.transactions, bus.bytes)
+
+MODE1 = 0x00
+AI = 0x20
+
+class SMBus:
+
+  def __init__(self, bus=1):
+    self.busNumber = bus
+    self.devices = {}
+    self.log = []
+    self.logging = False
+    self.reset()
+
+  def reset(self):
+    "Clears the counters, keeps the register contents"
+    self.transactions = 0
+    self.bytes = 0
+    self.calls = {}
+    del self.log[:]
+
+  def registers(self, address):
+    if address not in self.devices:
+      self.devices[address] = bytearray(256)
+    return self.devices[address]
+
+  def _count(self, name, address, reg, payload):
+    self.transactions += 1
+    # device address + register pointer + payload
+    self.bytes += 2 + payload
+    self.calls[name] = self.calls.get(name, 0) + 1
+    if self.logging:
+      self.log.append((name, address, reg, payload))
+
+  def write_byte_data(self, address, reg, value):
+    self._count('write_byte_data', address, reg, 1)
+    self.registers(address)[reg] = value & 0xFF
+
+  def read_byte_data(self, address, reg):
+    self._count('read_byte_data', address, reg, 1)
+    return self.registers(address)[reg]
+
+  def write_i2c_block_data(self, address, reg, data):
+    if len(data) > 32:
+      raise ValueError("SMBus block transfers are limited to 32 bytes")
+    self._count('write_i2c_block_data', address, reg, len(data))
+    regs = self.registers(address)
+    increment = regs[MODE1] & AI
+    for value in data:
+      regs[reg] = value & 0xFF
+      if increment:
+        reg = (reg + 1) & 0xFF
+
+  def read_i2c_block_data(self, address, reg, length):
+    self._count('read_i2c_block_data', address, reg, length)
+    regs = self.registers(address)
+    increment = regs[MODE1] & AI
+    data = []
+    for i in range(0, length):
+      data.append(regs[reg])
+      if increment:
+        reg = (reg + 1) & 0xFF
+    return data
+
+  def close(self):
+    pass
@@ -0,0 +1,415 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import time
+import select
+import threading
+
+# same values as RPi.GPIO
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+# backend of default(): 'rpi', 'gpiod' or 'gpiod:/dev/gpiochipN'
+ENVIRONMENT = 'ALPHABOT_GPIO'
+CHIP = '/dev/gpiochip0'
+# highest frequency Gpiod's software PWM runs at, whatever PWM() asks for
+SOFT_PWM_LIMIT = 100
+
+"""
+Pin access for AlphaBot2, TRSensor, TLC1543, InputBus, UltrasonicRanger,
+IRReceiver and the SensorScheduler sources, which take one as gpio=None
+and otherwise use default().  Every backend has the RPi.GPIO calls the
+drivers use, on BCM numbers:
+
+	setup(pins, mode, pull = PUD_OFF, initial = None)   pins: one or a tuple
+	output(pin, value)      input(pin)
+	outputs(pins, values)   inputs(pins)     several pins at once
+	PWM(pin, frequency)     with start/ChangeDutyCycle/ChangeFrequency/stop
+	add_event_detect(pin, edge, callback)    remove_event_detect(pin)
+	cleanup()
+
+	RPiGPIO  RPi.GPIO, the default.  Its functions are bound as they are, so
+	         the bit-banged paths pay nothing for the indirection; outputs()
+	         and inputs() are a loop.
+	Gpiod    libgpiod 2 on the GPIO character device, for kernels where
+	         RPi.GPIO no longer works (and the Pi 5).  The pins given to one
+	         setup() are one line request, so outputs()/inputs() over them
+	         are a single ioctl: AlphaBot2 writes its four direction pins and
+	         InputBus reads all its inputs that way.  PWM is done in software
+	         by one thread for all channels, with the edges that fall
+	         together written together, at SOFT_PWM_LIMIT Hz at most: each
+	         edge is a wake-up holding the GIL, and at the 500Hz AlphaBot2
+	         asks for (2000 writes/s) the control loop's p99 wake-up
+	         lateness was several times that at 100Hz (python3 FakeGpiod.py
+	         --pwm-load).  ENA and ENB (GPIO6/26) have no hardware PWM.
+
+Every pin access is a system call with Gpiod, where RPi.GPIO writes the
+registers through /dev/gpiomem, so bit-banging the TLC1543 is slower on it;
+the SPI reader in TLC1543.py does not depend on the backend.
+
+The gpio-sim kernel module gives a Gpiod chip without a robot, e.g. with
+configfs:
+
+	modprobe gpio-sim
+	mkdir -p /sys/kernel/config/gpio-sim/alphabot/gpio-bank0
+	echo 28 > /sys/kernel/config/gpio-sim/alphabot/gpio-bank0/num_lines
+	echo 1 > /sys/kernel/config/gpio-sim/alphabot/live
+
+then ALPHABOT_GPIO=gpiod:/dev/gpiochipN with the chip it created; the
+inputs are driven through /sys/devices/platform/gpio-sim.*/gpiochipN/sim_gpio*/pull.
+Without either, python3 FakeGpiod.py checks Gpiod against an in-memory gpiod.
+"""
+
+def create(name = None):
+	"A new backend by name ('rpi', 'gpiod', 'gpiod:<chip>'), ALPHABOT_GPIO by default"
+	name = name or os.environ.get(ENVIRONMENT, 'rpi')
+	if name == 'rpi':
+		return RPiGPIO()
+	if name == 'gpiod' or name.startswith('gpiod:'):
+		return Gpiod(name[6:] or CHIP)
+	raise ValueError('unknown GPIO backend %s' % name)
+
+_default = None
+
+def default():
+	"The backend shared by everything in this process; a line can only be requested once"
+	global _default
+	if _default is None:
+		_default = create()
+	return _default
+
+class RPiGPIO(object):
+
+	def __init__(self):
+		import RPi.GPIO as GPIO
+		self.GPIO = GPIO
+		GPIO.setmode(GPIO.BCM)
+		GPIO.setwarnings(False)
+		self.output = GPIO.output
+		self.input = GPIO.input
+		self.PWM = GPIO.PWM
+		self.add_event_detect = GPIO.add_event_detect
+		self.remove_event_detect = GPIO.remove_event_detect
+
+	def setup(self, pins, mode, pull = PUD_OFF, initial = None):
+		GPIO = self.GPIO
+		for pin in (pins if isinstance(pins, (tuple, list)) else (pins,)):
+			if mode == OUT:
+				if initial is None:
+					GPIO.setup(pin,GPIO.OUT)
+				else:
+					GPIO.setup(pin,GPIO.OUT,initial=initial)
+			else:
+				GPIO.setup(pin,GPIO.IN,pull)
+
+	def outputs(self, pins, values):
+		output = self.output
+		i = 0
+		while i < len(pins):
+			output(pins[i],values[i])
+			i += 1
+
+	def inputs(self, pins):
+		input = self.input
+		return [input(pin) for pin in pins]
+
+	def cleanup(self):
+		self.GPIO.cleanup()
+
+"""
+RPi.GPIO's PWM object for Gpiod, driven by the backend's PWM thread.
+Duty cycles of 0 and 100 are a steady level and cost no wake-ups.
+"""
+class SoftPWM(object):
+
+	def __init__(self, backend, pin, frequency):
+		self.backend = backend
+		self.pin = pin
+		self.period = 1.0/min(frequency, backend.pwmLimit)
+		self.duty = 0.0
+		self.running = False
+
+	def start(self, duty):
+		self.running = True
+		self.ChangeDutyCycle(duty)
+
+	def ChangeDutyCycle(self, duty):
+		self.duty = max(0.0, min(100.0, duty))
+		self.backend._pwmChanged(self)
+
+	def ChangeFrequency(self, frequency):
+		self.period = 1.0/min(frequency, self.backend.pwmLimit)
+		self.backend._pwmChanged(self)
+
+	def stop(self):
+		self.running = False
+		self.backend._pwmChanged(self)
+
+class Gpiod(object):
+
+	def __init__(self, chip = CHIP, consumer = 'alphabot2', pwmLimit = SOFT_PWM_LIMIT):
+		import gpiod
+		from gpiod.line import Direction, Value, Bias, Edge
+		self.gpiod = gpiod
+		self.chip = chip
+		self.consumer = consumer
+		self.pwmLimit = pwmLimit
+		self.DIRECTION = {OUT: Direction.OUTPUT, IN: Direction.INPUT}
+		self.BIAS = {PUD_OFF: Bias.DISABLED, PUD_UP: Bias.PULL_UP, PUD_DOWN: Bias.PULL_DOWN}
+		self.EDGE = {RISING: Edge.RISING, FALLING: Edge.FALLING, BOTH: Edge.BOTH, None: Edge.NONE}
+		self.VALUE = (Value.INACTIVE, Value.ACTIVE)
+		self.ACTIVE = Value.ACTIVE
+		# pin -> its line request, request -> {pin: settings}, output pin ->
+		# the level last written to it
+		self.requests = {}
+		self.settings = {}
+		self.values = {}
+		self.callbacks = {}
+		self.syscalls = 0
+		self._lock = threading.Lock()
+		self._events = None
+		self._pwm = {}
+		self._pwmChange = threading.Condition()
+		self._pwmThread = None
+		self._running = True
+
+	def _settings(self, mode, pull, initial, edge = None):
+		LineSettings = self.gpiod.LineSettings
+		if mode == OUT:
+			return LineSettings(direction = self.DIRECTION[OUT], output_value = self.VALUE[1 if initial else 0])
+		return LineSettings(direction = self.DIRECTION[IN], bias = self.BIAS[pull], edge_detection = self.EDGE[edge])
+
+	def setup(self, pins, mode, pull = PUD_OFF, initial = None):
+		"""
+		pins become one line request.  Pins a request already holds are
+		reconfigured in it; a request whose pins are all in the new group
+		is released and merged into it.  Either way every output keeps the
+		level last written to it, unless setup() gives it an initial one,
+		so setting up one group never glitches pins already being driven.
+		"""
+		pins = tuple(pins) if isinstance(pins, (tuple, list)) else (pins,)
+		settings = self._settings(mode, pull, initial)
+		with self._lock:
+			fresh = {}
+			for pin in pins:
+				own = settings
+				if mode != OUT:
+					self.values.pop(pin, None)
+				elif initial is None and pin in self.values:
+					own = self._settings(OUT, pull, self.values[pin])
+				else:
+					self.values[pin] = 1 if initial else 0
+				request = self.requests.get(pin)
+				if request is None:
+					fresh[pin] = own
+				elif set(self.settings[request]) <= set(pins):
+					# the rest of that request is in the group too: merge
+					self._release(request)
+					fresh[pin] = own
+				else:
+					self.settings[request][pin] = own
+					request.reconfigure_lines(self._config(request))
+					self.syscalls += 1
+			if fresh:
+				request = self.gpiod.request_lines(self.chip, consumer = self.consumer, config = dict(fresh))
+				self.syscalls += 1
+				self.settings[request] = fresh
+				for pin in fresh:
+					self.requests[pin] = request
+
+	def _config(self, request):
+		"The settings of request for reconfigure_lines(), its outputs at their current level"
+		config = self.settings[request]
+		for pin in list(config):
+			value = self.values.get(pin)
+			if value is not None and config[pin].output_value != self.VALUE[value]:
+				config[pin] = self._settings(OUT, PUD_OFF, value)
+		return config
+
+	def _release(self, request):
+		for pin in self.settings.pop(request):
+			if self.requests.get(pin) is request:
+				del self.requests[pin]
+		request.release()
+
+	def output(self, pin, value):
+		self.syscalls += 1
+		value = 1 if value else 0
+		self.requests[pin].set_value(pin, self.VALUE[value])
+		self.values[pin] = value
+
+	def input(self, pin):
+		self.syscalls += 1
+		return 1 if self.requests[pin].get_value(pin) == self.ACTIVE else 0
+
+	def outputs(self, pins, values):
+		"One set_values() per line request the pins belong to"
+		VALUE = self.VALUE
+		requests = self.requests
+		first = requests[pins[0]]
+		if all(requests[pin] is first for pin in pins):
+			self.syscalls += 1
+			first.set_values(dict((pins[i], VALUE[1 if values[i] else 0]) for i in range(0, len(pins))))
+		else:
+			grouped = {}
+			for i in range(0, len(pins)):
+				grouped.setdefault(requests[pins[i]], {})[pins[i]] = VALUE[1 if values[i] else 0]
+			for request, mapping in grouped.items():
+				self.syscalls += 1
+				request.set_values(mapping)
+		for i in range(0, len(pins)):
+			self.values[pins[i]] = 1 if values[i] else 0
+
+	def inputs(self, pins):
+		"One get_values() per line request the pins belong to"
+		requests = self.requests
+		grouped = {}
+		for pin in pins:
+			grouped.setdefault(requests[pin], []).append(pin)
+		levels = {}
+		for request, lines in grouped.items():
+			self.syscalls += 1
+			for pin, value in zip(lines, request.get_values(lines)):
+				levels[pin] = 1 if value == self.ACTIVE else 0
+		return [levels[pin] for pin in pins]
+
+	def add_event_detect(self, pin, edge, callback = None, bouncetime = None):
+		with self._lock:
+			request = self.requests[pin]
+			old = self.settings[request][pin]
+			settings = self.gpiod.LineSettings(direction = self.DIRECTION[IN], bias = old.bias,
+				edge_detection = self.EDGE[edge])
+			self.settings[request][pin] = settings
+			self.values.pop(pin, None)
+			request.reconfigure_lines(self._config(request))
+			self.callbacks[pin] = callback
+			if self._events is None:
+				self._events = threading.Thread(target=self._watch)
+				self._events.daemon = True
+				self._events.start()
+
+	def remove_event_detect(self, pin):
+		with self._lock:
+			self.callbacks.pop(pin, None)
+			request = self.requests.get(pin)
+			if request is None:
+				return
+			old = self.settings[request][pin]
+			self.settings[request][pin] = self.gpiod.LineSettings(direction = self.DIRECTION[IN], bias = old.bias)
+			request.reconfigure_lines(self._config(request))
+
+	def _watch(self):
+		"Edge events of every request with a callback, from one thread"
+		while self._running:
+			with self._lock:
+				requests = dict((self.requests[pin].fd, self.requests[pin]) for pin in self.callbacks if pin in self.requests)
+			if not requests:
+				time.sleep(0.05)
+				continue
+			try:
+				ready = select.select(list(requests), [], [], 0.05)[0]
+			except (OSError, ValueError):
+				# a request was released under the select
+				continue
+			for fd in ready:
+				with self._lock:
+					# released since, e.g. merged into a new one by setup()
+					if requests[fd] not in self.settings:
+						continue
+					events = requests[fd].read_edge_events()
+				for event in events:
+					callback = self.callbacks.get(event.line_offset)
+					if callback is not None:
+						callback(event.line_offset)
+
+	def PWM(self, pin, frequency):
+		return SoftPWM(self, pin, frequency)
+
+	def _pwmChanged(self, channel):
+		with self._pwmChange:
+			if channel.running:
+				self._pwm[channel.pin] = channel
+			else:
+				self._pwm.pop(channel.pin, None)
+				self.output(channel.pin, LOW)
+			if self._pwmThread is None:
+				self._pwmThread = threading.Thread(target=self._pwmRun)
+				self._pwmThread.daemon = True
+				self._pwmThread.start()
+			self._pwmChange.notify()
+
+	def _pwmRun(self):
+		"""
+		Every channel starts its period high and drops after duty percent
+		of it; channels of the same frequency rise together, so their
+		rising edges are one write.
+		"""
+		clock = time.perf_counter
+		start = clock()
+		levels = {}
+		with self._pwmChange:
+			while self._running:
+				now = clock()
+				pins = []
+				values = []
+				wake = None
+				for pin, channel in self._pwm.items():
+					period = channel.period
+					if channel.duty <= 0 or channel.duty >= 100:
+						level = 1 if channel.duty >= 100 else 0
+						edge = None
+					else:
+						phase = (now - start) % period
+						high = period * channel.duty / 100.0
+						level = 1 if phase < high else 0
+						edge = now + ((high - phase) if level else (period - phase))
+					if levels.get(pin) != level:
+						pins.append(pin)
+						values.append(level)
+						levels[pin] = level
+					if edge is not None and (wake is None or edge < wake):
+						wake = edge
+				for pin in list(levels):
+					if pin not in self._pwm:
+						del levels[pin]
+				if pins:
+					self.outputs(pins, values)
+				self._pwmChange.wait(None if wake is None else max(0.0, wake - clock()))
+
+	def cleanup(self):
+		self._running = False
+		with self._pwmChange:
+			self._pwmChange.notify()
+		for thread in (self._pwmThread, self._events):
+			if thread is not None and thread is not threading.current_thread():
+				thread.join()
+		with self._lock:
+			for request in list(self.settings):
+				self._release(request)
+		self.callbacks.clear()
+
+if __name__ == '__main__':
+	import sys
+	# bulk write and read round trip: python3 GPIOBackend.py gpiod:/dev/gpiochipN
+	gpio = create(sys.argv[1] if len(sys.argv) > 1 else None)
+	outputs = (12, 13, 20, 21)
+	inputs = (7, 8, 9, 10, 11, 16, 19)
+	gpio.setup(outputs, OUT, initial = LOW)
+	gpio.setup(inputs, IN, PUD_UP)
+	start = time.perf_counter()
+	for n in range(0, 1000):
+		gpio.outputs(outputs, (n & 1, 0, n & 1, 1))
+		gpio.inputs(inputs)
+	print('%s: outputs+inputs %.1fus' % (type(gpio).__name__, (time.perf_counter() - start) * 1000))
+	if hasattr(gpio, 'syscalls'):
+		print('%d ioctls for 1000 iterations' % gpio.syscalls)
+	gpio.cleanup()
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import time
+import GPIOBackend
+import threading
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+IR = 17
+
+# NEC timings in microseconds, with generous tolerances
+LEADER_MARK = (7000, 11000)       # 9ms
+LEADER_SPACE = (3500, 5500)       # 4.5ms
+REPEAT_SPACE = (1750, 2750)       # 2.25ms
+BIT_MARK = (300, 900)             # 562.5us
+ZERO_SPACE = (300, 900)           # 562.5us
+ONE_SPACE = (1300, 2100)          # 1687.5us
+IDLE_GAP = 20000                  # longer than any gap inside a frame
+REPEAT_WINDOW = 200000            # repeats are sent every 108ms while held
+
+IDLE, LEADER, SPACE, MARK, BIT = range(0, 5)
+
+"""
+NEC frame decoder driven only by edge timestamps.
+
+The receiver output idles high and goes low during carrier bursts.  Levels
+are inferred from the edge order (the first edge after an idle gap is
+always a falling one), so the decoder never needs to sample the pin and does
+not depend on sleep accuracy.  Feed it edges with edge(t_ns); it returns a
+list of (command, repeat) events, where command is data[2] of the frame.
+"""
+class NECDecoder(object):
+
+	def __init__(self, strict=True):
+		# strict also checks address/~address, as IRremote.py always did
+		self.strict = strict
+		self.reset()
+		self.lastCommand = None
+		self.lastFrame = None
+		self.frames = 0
+		self.repeats = 0
+		self.errors = 0
+
+	def reset(self):
+		self.state = IDLE
+		self.lastEdge = None
+		self.bits = 0
+		self.count = 0
+
+	def _fail(self):
+		self.errors += 1
+		self.state = IDLE
+
+	def edge(self, t_ns):
+		events = []
+		last = self.lastEdge
+		self.lastEdge = t_ns
+		if last is None:
+			self.state = LEADER
+			return events
+		width = (t_ns - last) // 1000
+		if width > IDLE_GAP:
+			# this edge starts a new burst
+			self.state = LEADER
+			return events
+		state = self.state
+		if state == LEADER:
+			# rising edge at the end of the 9ms burst
+			if LEADER_MARK[0] <= width <= LEADER_MARK[1]:
+				self.state = SPACE
+			else:
+				self._fail()
+		elif state == SPACE:
+			# falling edge after the leader space
+			if LEADER_SPACE[0] <= width <= LEADER_SPACE[1]:
+				self.bits = 0
+				self.count = 0
+				self.state = MARK
+			elif REPEAT_SPACE[0] <= width <= REPEAT_SPACE[1]:
+				self.state = IDLE
+				if self.lastCommand is not None and self.lastFrame is not None and \
+						(t_ns - self.lastFrame) // 1000 < REPEAT_WINDOW:
+					self.lastFrame = t_ns
+					self.repeats += 1
+					events.append((self.lastCommand, True))
+			else:
+				self._fail()
+		elif state == MARK:
+			# rising edge at the end of a bit burst
+			if BIT_MARK[0] <= width <= BIT_MARK[1]:
+				self.state = BIT
+			else:
+				self._fail()
+		elif state == BIT:
+			# falling edge: the space length is the bit value
+			if ZERO_SPACE[0] <= width <= ZERO_SPACE[1]:
+				bit = 0
+			elif ONE_SPACE[0] <= width <= ONE_SPACE[1]:
+				bit = 1
+			else:
+				self._fail()
+				return events
+			# bits are sent LSB first
+			self.bits |= bit << self.count
+			self.count += 1
+			if self.count < 32:
+				self.state = MARK
+				return events
+			self.state = IDLE
+			data = [(self.bits >> (8*i)) & 0xFF for i in range(0, 4)]
+			if data[2] + data[3] != 0xFF or (self.strict and data[0] + data[1] != 0xFF):
+				self.errors += 1
+				return events
+			self.lastCommand = data[2]
+			self.lastFrame = t_ns
+			self.frames += 1
+			events.append((data[2], False))
+		return events
+
+	def feed(self, timestamps):
+		"Decodes a whole sequence of edge timestamps (ns), e.g. a synthetic one"
+		events = []
+		for t in timestamps:
+			events.extend(self.edge(t))
+		return events
+
+"""
+Interrupt-driven NEC receiver.  GPIO edge callbacks only push a
+perf_counter_ns() timestamp into a queue; a worker thread decodes and hands
+every key to the listener(command, repeat) callback and to the keys queue.
+The keys queue holds the newest maxKeys keys, so a program that only uses
+the listener and never calls getkey() does not pile them up.
+"""
+class IRReceiver(object):
+
+	def __init__(self, pin=IR, listener=None, strict=True, gpio=None, maxKeys=16):
+		self.pin = pin
+		self.listener = listener
+		self.decoder = NECDecoder(strict)
+		self.edges = queue.Queue()
+		self.keys = queue.Queue(maxKeys)
+		self._running = False
+		self._thread = None
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.gpio.setup(self.pin,GPIOBackend.IN)
+
+	def _edge(self, channel):
+		self.edges.put(time.perf_counter_ns())
+
+	def _run(self):
+		while self._running:
+			t = self.edges.get()
+			if t is None:
+				break
+			for command, repeat in self.decoder.edge(t):
+				self._key(command, repeat)
+				if self.listener is not None:
+					self.listener(command, repeat)
+
+	def _key(self, command, repeat):
+		while True:
+			try:
+				self.keys.put_nowait((command, repeat))
+				return
+			except queue.Full:
+				# nobody is reading: the oldest key goes
+				try:
+					self.keys.get_nowait()
+				except queue.Empty:
+					pass
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		self.gpio.add_event_detect(self.pin,GPIOBackend.BOTH,callback=self._edge)
+		return self
+
+	def getkey(self, timeout=None):
+		"Blocks until a key arrives; returns (command, repeat) or None on timeout"
+		try:
+			return self.keys.get(True, timeout)
+		except queue.Empty:
+			return None
+
+	def stop(self):
+		self.gpio.remove_event_detect(self.pin)
+		self._running = False
+		self.edges.put(None)
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+"""
+Edge timestamps (ns) of one NEC frame, or of a repeat code, starting at
+start_ns.  Used to exercise NECDecoder without a receiver.
+"""
+def necFrame(address, command, start_ns=0, repeat=False):
+	edges = [start_ns]
+	t = start_ns + 9000000
+	edges.append(t)
+	if repeat:
+		t += 2250000
+		edges.append(t)
+		edges.append(t + 562500)
+		return edges
+	t += 4500000
+	edges.append(t)
+	data = [address, address ^ 0xFF, command, command ^ 0xFF]
+	for byte in data:
+		for i in range(0, 8):
+			t += 562500
+			edges.append(t)
+			t += 1687500 if (byte >> i) & 0x01 else 562500
+			edges.append(t)
+	edges.append(t + 562500)
+	return edges
+
+if __name__ == '__main__':
+	decoder = NECDecoder()
+	edges = necFrame(0x00, 0x18) + necFrame(0x00, 0x18, 108000000, True)
+	print(decoder.feed(edges))
+	receiver = IRReceiver().start()
+	print('IR decoder waiting for keys ...')
+	try:
+		while True:
+			print(receiver.getkey())
+	except KeyboardInterrupt:
+		receiver.stop()
+		receiver.gpio.cleanup()
@@ -1,99 +1,57 @@
-import RPi.GPIO as GPIO
+import GPIOBackend
 import time
 from AlphaBot2 import AlphaBot2
+from IRDecoder import IRReceiver
+from Watchdog import MotionWatchdog
 
 Ab = AlphaBot2()
 
 IR = 17
 PWM = 50
-n=0
+IDLE_STOP = 250    # ms without a key or repeat code before the watchdog stops
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(IR,GPIO.IN)
+Receiver = IRReceiver(IR).start()
+Watchdog = MotionWatchdog(Ab).register('ir',IDLE_STOP)
 
-
-def getkey():
-	if GPIO.input(IR) == 0:
-		count = 0
-		while GPIO.input(IR) == 0 and count < 200:  #9ms
-			count += 1
-			time.sleep(0.00006)
-		if(count < 10):
-			return;
-		count = 0
-		while GPIO.input(IR) == 1 and count < 80:  #4.5ms
-			count += 1
-			time.sleep(0.00006)
-
-		idx = 0
-		cnt = 0
-		data = [0,0,0,0]
-		for i in range(0,32):
-			count = 0
-			while GPIO.input(IR) == 0 and count < 15:    #0.56ms
-				count += 1
-				time.sleep(0.00006)
-				
-			count = 0
-			while GPIO.input(IR) == 1 and count < 40:   #0: 0.56mx
-				count += 1                               #1: 1.69ms
-				time.sleep(0.00006)
-				
-			if count > 7:
-				data[idx] |= 1<<cnt
-			if cnt == 7:
-				cnt = 0
-				idx += 1
-			else:
-				cnt += 1
-#		print data
-		if data[0]+data[1] == 0xFF and data[2]+data[3] == 0xFF:  #check
-			return data[2]
-		else:
-			print("repeat")
-			return "repeat"
-
-			
 print('IRremote Test Start ...')
 Ab.stop()
 try:
 	while True:
-		key = getkey()
-		if(key != None):
-			n = 0				 
-			if key == 0x18:
-				Ab.forward()
-				print("forward")
-			if key == 0x08:
-				Ab.left()
-				print("left")
-			if key == 0x1c:
-				Ab.stop()
-				print("stop")
-			if key == 0x5a:
-				Ab.right()
-				print("right")
-			if key == 0x52:
-				Ab.backward()		
-				print("backward")
-			if key == 0x15:
-				if(PWM + 10 < 101):
-					PWM = PWM + 10
-					Ab.setPWMA(PWM)
-					Ab.setPWMB(PWM)
-					print(PWM)
-			if key == 0x07:
-				if(PWM - 10 > -1):
-					PWM = PWM - 10
-					Ab.setPWMA(PWM)
-					Ab.setPWMB(PWM)
-					print(PWM)
-		else:
-			n += 1
-			if n > 20000:
-				n = 0
-				Ab.stop()	
+		# sleeps in the queue until a key arrives
+		key,repeat = Receiver.getkey()
+		Watchdog.refresh('ir')
+		if repeat:
+			# button held: keep doing what we are doing
+			continue
+		if key == 0x18:
+			Ab.forward()
+			print("forward")
+		if key == 0x08:
+			Ab.left()
+			print("left")
+		if key == 0x1c:
+			Ab.stop()
+			Watchdog.release('ir')
+			print("stop")
+		if key == 0x5a:
+			Ab.right()
+			print("right")
+		if key == 0x52:
+			Ab.backward()		
+			print("backward")
+		if key == 0x15:
+			if(PWM + 10 < 101):
+				PWM = PWM + 10
+				Ab.setPWMA(PWM)
+				Ab.setPWMB(PWM)
+				print(PWM)
+		if key == 0x07:
+			if(PWM - 10 > -1):
+				PWM = PWM - 10
+				Ab.setPWMA(PWM)
+				Ab.setPWMB(PWM)
+				print(PWM)
 except KeyboardInterrupt:
-	GPIO.cleanup();
-
+	Watchdog.stop()
+	Receiver.stop()
+	GPIOBackend.default().cleanup();
@@ -1,32 +1,39 @@
-import RPi.GPIO as GPIO
+import GPIOBackend
 import time
 from AlphaBot2 import AlphaBot2
+from InputEvents import InputBus, PRESS, RELEASE
+from Watchdog import MotionWatchdog
 
 Ab = AlphaBot2()
 
 DR = 16
 DL = 19
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(DR,GPIO.IN,GPIO.PUD_UP)
-GPIO.setup(DL,GPIO.IN,GPIO.PUD_UP)
+def onObstacle(name, event):
+#	print(name,event)
+	if event == PRESS:
+		Ab.left()
+		#Ab.right()
+	elif event == RELEASE and not (Inputs.active('DR') or Inputs.active('DL')):
+		Ab.forward()
 
-try:
-	while True:
-		DR_status = GPIO.input(DR)
-		DL_status = GPIO.input(DL)
-#		print(DR_status,DL_status)
-		if((DL_status == 0) or (DR_status == 0)):
-			Ab.left()
-			#Ab.right()
-			time.sleep(0.002)
-			Ab.stop()
-		#	print("object")
-		else:
-			Ab.forward()
-		#	print("forward")
+Inputs = InputBus(debounce=0.002)
+Inputs.add('DR',DR).add('DL',DL)
+Inputs.subscribe(onObstacle)
+Inputs.start()
+# the event dispatcher has to stay alive for the robot to keep moving
+Watchdog = MotionWatchdog(Ab).register('ir_obstacle',300)
 
-except KeyboardInterrupt:
-	GPIO.cleanup()
+if Inputs.active('DR') or Inputs.active('DL'):
+	Ab.left()
+else:
+	Ab.forward()
 
+try:
+	while Inputs.alive():
+		Watchdog.refresh('ir_obstacle')
+		time.sleep(0.1)
+except KeyboardInterrupt:
+	Watchdog.stop()
+	Inputs.stop()
+	GPIOBackend.default().cleanup()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import time
+import GPIOBackend
+import threading
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+PRESS = 'press'
+RELEASE = 'release'
+HOLD = 'hold'
+
+"""
+Event-driven input layer for the joystick and the IR obstacle sensors.
+
+GPIO edge callbacks only queue the pin number.  A single dispatcher thread
+debounces each input in software (the level has to be stable for debounce
+seconds), turns level changes into press/release events, fires a hold event
+once an input stays active for holdTime seconds, and calls the subscribers.
+With nothing pending the dispatcher blocks on its queue, so an idle robot
+costs no CPU.  Once started, inputs with the same pull are one GPIOBackend
+group, and the pins that settle together are read with one inputs() call.
+"""
+class InputBus(object):
+
+	def __init__(self, debounce=0.02, holdTime=0.5, gpio=None):
+		self.debounce = debounce
+		self.holdTime = holdTime
+		self.inputs = {}
+		self.subscribers = []
+		self._edges = queue.Queue()
+		self._settle = {}
+		self._hold = {}
+		self._running = False
+		self._thread = None
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+
+	def add(self, name, pin, activeLow=True, debounce=None):
+		"Registers an input; active-low inputs get the internal pull-up"
+		self.gpio.setup(pin,GPIOBackend.IN,GPIOBackend.PUD_UP if activeLow else GPIOBackend.PUD_DOWN)
+		self.inputs[pin] = {
+			'name': name,
+			'activeLow': activeLow,
+			'debounce': self.debounce if debounce is None else debounce,
+			'active': self._read(pin, activeLow),
+		}
+		return self
+
+	def subscribe(self, callback, name=None, event=None):
+		"callback(name, event) for every event, or only for the given input/event"
+		self.subscribers.append((callback, name, event))
+		return self
+
+	def active(self, name):
+		for pin, info in self.inputs.items():
+			if info['name'] == name:
+				return info['active']
+		raise KeyError(name)
+
+	def _read(self, pin, activeLow):
+		return (self.gpio.input(pin) == 0) == activeLow
+
+	def _edge(self, channel):
+		self._edges.put(channel)
+
+	def _emit(self, name, event):
+		for callback, onlyName, onlyEvent in self.subscribers:
+			if (onlyName is None or onlyName == name) and (onlyEvent is None or onlyEvent == event):
+				callback(name, event)
+
+	def _due(self, now):
+		due = [pin for pin, deadline in self._settle.items() if deadline <= now]
+		levels = self.gpio.inputs(due) if due else ()
+		for pin, level in zip(due, levels):
+			del self._settle[pin]
+			info = self.inputs[pin]
+			active = (level == 0) == info['activeLow']
+			if active == info['active']:
+				continue
+			info['active'] = active
+			if active:
+				self._hold[pin] = now + self.holdTime
+				self._emit(info['name'], PRESS)
+			else:
+				self._hold.pop(pin, None)
+				self._emit(info['name'], RELEASE)
+		for pin, deadline in list(self._hold.items()):
+			if deadline <= now:
+				del self._hold[pin]
+				self._emit(self.inputs[pin]['name'], HOLD)
+
+	def _run(self):
+		while self._running:
+			deadlines = list(self._settle.values()) + list(self._hold.values())
+			timeout = None
+			if deadlines:
+				timeout = max(min(deadlines) - time.monotonic(), 0)
+			try:
+				pin = self._edges.get(True, timeout)
+				if pin is None:
+					break
+				# every bounce pushes the settle deadline further out
+				self._settle[pin] = time.monotonic() + self.inputs[pin]['debounce']
+			except queue.Empty:
+				pass
+			self._due(time.monotonic())
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		for activeLow in (True, False):
+			pins = tuple(pin for pin, info in self.inputs.items() if info['activeLow'] == activeLow)
+			if pins:
+				self.gpio.setup(pins,GPIOBackend.IN,GPIOBackend.PUD_UP if activeLow else GPIOBackend.PUD_DOWN)
+		for pin in self.inputs:
+			self.gpio.add_event_detect(pin,GPIOBackend.BOTH,callback=self._edge)
+		return self
+
+	def alive(self):
+		return self._thread is not None and self._thread.is_alive()
+
+	def stop(self):
+		for pin in self.inputs:
+			self.gpio.remove_event_detect(pin)
+		self._running = False
+		self._edges.put(None)
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import time
+
+# adc      TLC1543 conversions on the sampler thread
+# read     getting the position into the control loop
+# compute  PID
+# actuate  motor writes
+# leds     one LedEngine frame
+# step     the whole control iteration, late its wake-up lateness
+PHASES = ('adc', 'read', 'compute', 'actuate', 'leds', 'step', 'late')
+
+"""
+Latency histogram with power-of-two buckets: bucket i counts the samples of
+i bits, i.e. [2^(i-1), 2^i) ns.  record() is one bit_length() and a few
+integer additions, so it can sit on every control iteration.  Percentiles
+are reported as the upper bound of their bucket, at most 2x pessimistic.
+"""
+class Histogram(object):
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.buckets = [0] * 64
+		self.count = 0
+		self.total = 0
+		self.max = 0
+
+	def record(self, ns):
+		self.buckets[ns.bit_length()] += 1
+		self.count += 1
+		self.total += ns
+		if ns > self.max:
+			self.max = ns
+
+	def percentile(self, fraction):
+		"In ns, the upper bound of the bucket holding that fraction of the samples"
+		target = fraction * self.count
+		seen = 0
+		for i, n in enumerate(self.buckets):
+			seen += n
+			if n and seen >= target:
+				return min(1 << i, self.max)
+		return self.max
+
+	def summary(self):
+		return {
+			'count': self.count,
+			'mean_us': round(self.total / 1000.0 / self.count, 2) if self.count else 0.0,
+			'p50_us': self.percentile(0.5) / 1000.0,
+			'p99_us': self.percentile(0.99) / 1000.0,
+			'max_us': self.max / 1000.0,
+			# bucket upper bound in us: samples
+			'buckets': dict(((1 << i) / 1000.0, n) for i, n in enumerate(self.buckets) if n),
+		}
+
+"""
+Events per second of a counter that only grows (loop iterations, sampler
+frames, LED shows), measured between two reads, so nothing has to be done
+on the hot path.
+"""
+class Rate(object):
+
+	def __init__(self, counter):
+		self.counter = counter
+		self.last = None
+		self.rate = 0.0
+
+	def value(self):
+		now = time.monotonic()
+		count = self.counter()
+		if self.last is not None:
+			then, before = self.last
+			if now > then and count >= before:
+				self.rate = (count - before) / (now - then)
+		self.last = (now, count)
+		return self.rate
+
+"""
+Instruments shared by the line follow loop and its helpers.  Every phase in
+PHASES is a Histogram attribute (inst.read.record(ns)); count() keeps event
+counters such as deadline misses; gauge() registers a Rate.  Code that was
+given no Instruments records nothing.
+"""
+class Instruments(object):
+
+	def __init__(self, phases = PHASES):
+		self.phases = []
+		for name in phases:
+			histogram = Histogram()
+			setattr(self, name, histogram)
+			self.phases.append((name, histogram))
+		self.counters = {}
+		self.rates = {}
+
+	def count(self, name, n = 1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def gauge(self, name, counter):
+		"counter() returns a growing total; reported as name=<n>Hz"
+		self.rates[name] = Rate(counter)
+		return self
+
+	def reset(self):
+		for name, histogram in self.phases:
+			histogram.reset()
+		self.counters = {}
+
+	def status(self):
+		"One line: rates, counters, then p50/p99/max in us for every phase seen"
+		fields = ['%s=%.1fHz' % (name, rate.value()) for name, rate in sorted(self.rates.items())]
+		fields += ['%s=%d' % item for item in sorted(self.counters.items())]
+		for name, histogram in self.phases:
+			if histogram.count:
+				fields.append('%s=%g/%g/%gus' % (name, histogram.percentile(0.5) / 1000.0,
+					histogram.percentile(0.99) / 1000.0, histogram.max / 1000.0))
+		return ' '.join(fields)
+
+	def snapshot(self):
+		return {
+			'rates': dict((name, round(rate.value(), 2)) for name, rate in self.rates.items()),
+			'counters': dict(self.counters),
+			'phases': dict((name, histogram.summary()) for name, histogram in self.phases),
+		}
+
+if __name__ == '__main__':
+	import random
+	inst = Instruments()
+	clock = time.perf_counter_ns
+	for i in range(0, 100000):
+		inst.compute.record(int(random.expovariate(1 / 20000.0)))
+	start = clock()
+	for i in range(0, 100000):
+		inst.read.record(1234)
+	print('record: %.0f ns' % ((clock() - start) / 100000.0))
+	print(inst.status())
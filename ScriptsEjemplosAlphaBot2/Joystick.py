@@ -1,6 +1,7 @@
-import RPi.GPIO as GPIO
+import GPIOBackend
 import time
 from AlphaBot2 import AlphaBot2
+from InputEvents import InputBus, PRESS, RELEASE
 
 Ab = AlphaBot2()
 
@@ -12,53 +13,38 @@ D = 11
 BUZ = 4
 
 def beep_on():
-	GPIO.output(BUZ,GPIO.HIGH)
+	gpio.output(BUZ,GPIOBackend.HIGH)
 def beep_off():
-	GPIO.output(BUZ,GPIO.LOW)
+	gpio.output(BUZ,GPIOBackend.LOW)
 	
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(CTR,GPIO.IN,GPIO.PUD_UP)
-GPIO.setup(A,GPIO.IN,GPIO.PUD_UP)
-GPIO.setup(B,GPIO.IN,GPIO.PUD_UP)
-GPIO.setup(C,GPIO.IN,GPIO.PUD_UP)
-GPIO.setup(D,GPIO.IN,GPIO.PUD_UP)
-GPIO.setup(BUZ,GPIO.OUT)
+# RPi.GPIO, or libgpiod with ALPHABOT_GPIO=gpiod
+gpio = GPIOBackend.default()
+gpio.setup(BUZ,GPIOBackend.OUT)
+
+actions = {
+	'center': Ab.stop,
+	'up': Ab.forward,
+	'right': Ab.right,
+	'left': Ab.left,
+	'down': Ab.backward,
+}
+
+def onPress(name, event):
+	beep_on()
+	actions[name]()
+	print(name)
+
+def onRelease(name, event):
+	beep_off()
+
+Inputs = InputBus(debounce=0.01)
+Inputs.add('center',CTR).add('up',A).add('right',B).add('left',C).add('down',D)
+Inputs.subscribe(onPress,event=PRESS).subscribe(onRelease,event=RELEASE)
+Inputs.start()
 
 try:
 	while True:
-		if GPIO.input(CTR) == 0:
-			beep_on()
-			Ab.stop()
-			print("center")
-			while GPIO.input(CTR) == 0:
-				time.sleep(0.01)
-		elif GPIO.input(A) == 0:
-			beep_on()
-			Ab.forward()
-			print("up")
-			while GPIO.input(A) == 0:
-				time.sleep(0.01)
-		elif GPIO.input(B) == 0:
-			beep_on()
-			Ab.right()
-			print("right")
-			while GPIO.input(B) == 0:
-				time.sleep(0.01)
-		elif GPIO.input(C) == 0:
-			beep_on()
-			Ab.left()
-			print("left")
-			while GPIO.input(C) == 0:
-				time.sleep(0.01)
-		elif GPIO.input(D) == 0:
-			beep_on()
-			Ab.backward()
-			print("down")
-			while GPIO.input(D) == 0:
-				time.sleep(0.01)
-		else:
-			beep_off()
-
+		time.sleep(1)
 except KeyboardInterrupt:
-	GPIO.cleanup()
\ No newline at end of file
+	Inputs.stop()
+	gpio.cleanup()
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import math
+import time
+import threading
+from rpi_ws281x import Color
+
+def Wheel(pos):
+	"""Generate rainbow colors across 0-255 positions."""
+	if pos < 85:
+		return Color(pos * 3, 255 - pos * 3, 0)
+	elif pos < 170:
+		pos -= 85
+		return Color(255 - pos * 3, 0, pos * 3)
+	else:
+		pos -= 170
+		return Color(0, pos * 3, 255 - pos * 3)
+
+# 256-entry colour wheel, computed once
+WHEEL = [Wheel(i) for i in range(0, 256)]
+
+# 256 steps of a full breath, 0-255, computed once
+BREATH = [int(round(127.5 - 127.5 * math.cos(2 * math.pi * i / 256))) for i in range(0, 256)]
+
+EFFECTS = ('off', 'static', 'rainbow', 'blink', 'breathe')
+
+"""
+LED animation engine for the Adafruit_NeoPixel strip.
+
+Setting an effect precomputes all of its frames from the lookup tables
+above; a render thread capped at fps then only picks the next frame, writes
+the pixels that differ from what is on the strip and calls show() only if
+something actually changed.  A static picture costs one show() and then the
+thread sleeps until the next change, so the control loops never have to
+touch the strip and the DMA transfers are bounded by fps.  With Instruments
+every frame's render time goes into their leds histogram.
+"""
+class LedEngine(object):
+
+	def __init__(self, strip, fps = 30, instruments = None):
+		self.strip = strip
+		self.fps = fps
+		self.instruments = instruments
+		self.count = strip.numPixels()
+		self.effect = 'off'
+		self.color = (255, 255, 255)
+		self.brightness = strip.getBrightness() if hasattr(strip, 'getBrightness') else 255
+		self.lit = True
+		self.frames = [[0] * self.count]
+		self.shown = None
+		self.shownBrightness = None
+		self.shows = 0
+		self.skipped = 0
+		self._changed = threading.Event()
+		self._running = False
+		self._thread = None
+
+	def _build(self):
+		"Precomputes every frame of the current effect"
+		n = self.count
+		r, g, b = self.color
+		if not self.lit or self.effect == 'off':
+			frames = [[0] * n]
+		elif self.effect == 'static':
+			frames = [[Color(r, g, b)] * n]
+		elif self.effect == 'rainbow':
+			frames = [[WHEEL[(int(i * 256 / n) + j) & 255] for i in range(0, n)] for j in range(0, 256)]
+		elif self.effect == 'blink':
+			# half a second on, half a second off
+			half = max(1, self.fps // 2)
+			frames = [[Color(r, g, b)] * n] * half + [[0] * n] * half
+		else:
+			frames = [[Color(r * k // 255, g * k // 255, b * k // 255)] * n for k in BREATH]
+		self.frames = frames
+		self._changed.set()
+
+	def setEffect(self, effect):
+		effect = effect.lower()
+		if effect not in EFFECTS:
+			return False
+		self.effect = effect
+		self._build()
+		return True
+
+	def setColor(self, r, g, b):
+		self.color = (r, g, b)
+		self._build()
+
+	def setBrightness(self, brightness):
+		"0-255, applied by the strip"
+		self.brightness = max(0, min(255, int(brightness)))
+		self._changed.set()
+
+	def on(self):
+		self.lit = True
+		self._build()
+
+	def off(self):
+		self.lit = False
+		self._build()
+
+	def render(self, index):
+		"Draws frame index; returns True if the strip had to be updated"
+		frames = self.frames
+		frame = frames[index % len(frames)]
+		shown = self.shown
+		if frame is shown and self.brightness == self.shownBrightness:
+			self.skipped += 1
+			return False
+		changed = False
+		for i in range(0, self.count):
+			if shown is None or shown[i] != frame[i]:
+				self.strip.setPixelColor(i, frame[i])
+				changed = True
+		if self.brightness != self.shownBrightness:
+			self.strip.setBrightness(self.brightness)
+			self.shownBrightness = self.brightness
+			changed = True
+		self.shown = frame
+		if not changed:
+			self.skipped += 1
+			return False
+		self.strip.show()
+		self.shows += 1
+		return True
+
+	def _run(self):
+		period = 1.0 / self.fps
+		index = 0
+		deadline = time.monotonic()
+		inst = self.instruments
+		while self._running:
+			self._changed.clear()
+			if inst is not None:
+				start = time.perf_counter_ns()
+				self.render(index)
+				inst.leds.record(time.perf_counter_ns() - start)
+			else:
+				self.render(index)
+			index += 1
+			if len(self.frames) == 1:
+				# nothing moves: sleep until somebody changes something
+				# (unless stop() came in before the clear() above)
+				if self._running:
+					self._changed.wait()
+				deadline = time.monotonic()
+				continue
+			deadline += period
+			delay = deadline - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				deadline = time.monotonic()
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+		self._changed.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+RESOLUTION = 1024   # TLC1543 is a 10-bit ADC
+
+def fill(table, offset, denominator, start, stop):
+	"Entries start..stop-1 of a sensor's table, exactly readCalibrated's math"
+	for raw in range(start, stop):
+		value = (raw - offset)* 1000 / denominator
+		if(value < 0):
+			value = 0
+		elif(value > 1000):
+			value = 1000
+		table[raw] = value
+
+"""
+Precomputed calibration and line-position math for TRSensor.
+
+The raw readings are 10-bit, so instead of doing a subtraction, a division
+and a clamp per sensor on every sample, update() builds one 1024-entry table
+per sensor from its offset (calibratedMin) and scale (1000/(max-min)).  The
+live path is then a single table lookup per sensor plus one weighted sum, and
+gives bit-for-bit the same values as the original readCalibrated/readLine.
+
+calibratedBatch()/lineBatch() run the same math over an (N, numSensors)
+NumPy array of recorded AnalogRead samples.
+"""
+class LineCalibration(object):
+
+	def __init__(self, numSensors = 5, calibratedMin = None, calibratedMax = None):
+		self.numSensors = numSensors
+		self.center = (numSensors - 1)*1000/2
+		self.weights = [i*1000 for i in range(0, numSensors)]
+		self.update(calibratedMin or [0]*numSensors, calibratedMax or [1023]*numSensors)
+
+	def update(self, calibratedMin, calibratedMax):
+		"Rebuilds the lookup tables; call after every change of min/max"
+		self.calibratedMin = list(calibratedMin)
+		self.calibratedMax = list(calibratedMax)
+		self.tables = []
+		for i in range(0, self.numSensors):
+			offset = self.calibratedMin[i]
+			denominator = self.calibratedMax[i] - offset
+			if(denominator == 0):
+				# readCalibrated keeps the previous sensor's value here
+				self.tables.append(None)
+				continue
+			table = [0]*RESOLUTION
+			fill(table, offset, denominator, 0, RESOLUTION)
+			self.tables.append(table)
+		self._arrays = None
+
+	"""
+	update() for a thread that cannot stall for a whole rebuild (about a
+	millisecond): a generator that builds a new LineCalibration for the
+	given bounds, at most chunk table entries per next(), and returns it
+	when done.  Sensors whose bounds did not change share this one's table.
+	"""
+	def rebuilding(self, calibratedMin, calibratedMax, chunk = 256):
+		new = LineCalibration.__new__(LineCalibration)
+		new.numSensors = self.numSensors
+		new.center = self.center
+		new.weights = self.weights
+		new.calibratedMin = list(calibratedMin)
+		new.calibratedMax = list(calibratedMax)
+		new.tables = []
+		new._arrays = None
+		for i in range(0, self.numSensors):
+			offset = new.calibratedMin[i]
+			denominator = new.calibratedMax[i] - offset
+			if offset == self.calibratedMin[i] and new.calibratedMax[i] == self.calibratedMax[i]:
+				new.tables.append(self.tables[i])
+				continue
+			if(denominator == 0):
+				new.tables.append(None)
+				continue
+			table = [0]*RESOLUTION
+			for start in range(0, RESOLUTION, chunk):
+				fill(table, offset, denominator, start, min(start + chunk, RESOLUTION))
+				yield
+			new.tables.append(table)
+		return new
+
+	def matches(self, calibratedMin, calibratedMax):
+		return calibratedMin == self.calibratedMin and calibratedMax == self.calibratedMax
+
+	def calibrated(self, sensor_values):
+		"Calibrated values (0-1000) for one AnalogRead sample"
+		value = 0
+		result = [0]*self.numSensors
+		for i in range(0, self.numSensors):
+			table = self.tables[i]
+			if table is not None:
+				value = table[sensor_values[i]]
+			result[i] = value
+		return result
+
+	def line(self, sensor_values, white_line = 0, last_value = 0):
+		"Single pass equivalent of TRSensor.readLine; returns (position, calibrated values)"
+		value = 0
+		avg = 0
+		sum = 0
+		on_line = 0
+		result = [0]*self.numSensors
+		weights = self.weights
+		for i in range(0, self.numSensors):
+			table = self.tables[i]
+			if table is not None:
+				value = table[sensor_values[i]]
+			result[i] = value
+			if(white_line):
+				v = 1000 - value
+			else:
+				v = value
+			if(v > 200):
+				on_line = 1
+			if(v > 50):
+				avg += v * weights[i]
+				sum += v
+		if(on_line != 1):
+			if(last_value < self.center):
+				return 0, result
+			return (self.numSensors - 1)*1000, result
+		return avg/sum, result
+
+	def _tableArrays(self):
+		if self._arrays is None:
+			self._arrays = [None if t is None else np.array(t, dtype=np.float64) for t in self.tables]
+		return self._arrays
+
+	def calibratedBatch(self, samples):
+		"Calibrated values for an (N, numSensors) array of raw samples"
+		samples = np.asarray(samples, dtype=np.intp)
+		result = np.zeros(samples.shape, dtype=np.float64)
+		column = np.zeros(samples.shape[0], dtype=np.float64)
+		for i, table in enumerate(self._tableArrays()):
+			if table is not None:
+				column = table[samples[:, i]]
+			result[:, i] = column
+		return result
+
+	def lineBatch(self, samples, white_line = 0, last_value = 0):
+		"""
+		readLine over many samples at once.  Returns (positions, calibrated)
+		where positions has the same left/right fallback readLine applies
+		when the line is lost, seeded with last_value.
+		"""
+		values = self.calibratedBatch(samples)
+		v = 1000 - values if white_line else values
+		n = values.shape[0]
+		avg = np.zeros(n)
+		sum = np.zeros(n)
+		# Accumulate column by column, in readLine's order, so the floating
+		# point result is identical.
+		for i in range(0, self.numSensors):
+			column = np.where(v[:, i] > 50, v[:, i], 0.0)
+			avg += column * self.weights[i]
+			sum += column
+		on_line = (v > 200).any(axis=1)
+		positions = np.zeros(n)
+		np.divide(avg, sum, out=positions, where=on_line)
+		# A lost sample falls back to the side of the most recent on-line
+		# position, or of last_value if there was none yet.
+		index = np.where(on_line, np.arange(n), -1)
+		np.maximum.accumulate(index, out=index)
+		previous = np.where(index >= 0, positions[np.maximum(index, 0)], last_value)
+		fallback = np.where(previous < self.center, 0.0, (self.numSensors - 1)*1000.0)
+		positions = np.where(on_line, positions, fallback)
+		return positions, values
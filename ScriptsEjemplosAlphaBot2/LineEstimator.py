@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import math
+
+"""
+Line position estimator for the TRSensor readLine output.
+
+A constant-velocity Kalman filter over the line position (0 to
+(numSensors-1)*1000, the readLine scale) and its rate of change, driven by
+the sample timestamps.  Between samples, and while the line is lost, the
+position is predicted from the last estimate, so a controller running
+faster than the sensors, or one that just lost the line in a curve, is
+still told where the line most likely is instead of readLine's stale value
+or its jump to 0 or 4000.  A lost line is past one of the end sensors, so
+while it is lost the prediction is kept beyond the end it left by (up to
+reach further out).
+
+command() passes the steering the controller applied: turning right moves
+the line left under the bar, with an acceleration of about
+gain * speed * power_difference.  gain = 0 leaves a plain constant-velocity
+filter.  confidence() goes from 1 (a fresh, consistent reading) towards 0 as
+the predicted position gets uncertain.
+
+	accel      process noise, std of the line's acceleration (units/s^2)
+	noise      std of a readLine position (units)
+	threshold  calibrated value a sensor must exceed to see the line, as readLine
+"""
+class LineEstimator(object):
+
+	def __init__(self, numSensors = 5, accel = 20000.0, noise = 40.0, gain = 0.0,
+			threshold = 200, white_line = 0, reach = 1000.0, spread = 500.0):
+		self.numSensors = numSensors
+		self.accel = accel
+		self.noise = noise
+		self.gain = gain
+		self.threshold = threshold
+		self.white_line = white_line
+		self.low = -reach
+		self.high = (numSensors - 1)*1000 + reach
+		self.spread = spread
+		self.reset()
+
+	def reset(self):
+		self.t = None
+		self.position = (self.numSensors - 1)*1000/2
+		self.velocity = 0.0
+		self.acceleration = 0.0
+		# covariance [[pp, pv], [pv, vv]]
+		self.pp = self.pv = self.vv = 0.0
+		self.lost = True
+		self.lostSince = None
+		self.edge = None
+
+	def command(self, power_difference, speed = 1.0):
+		"Steering applied from now on (LineFollower's power_difference, maximum)"
+		self.acceleration = -self.gain * speed * power_difference
+
+	def onLine(self, sensors):
+		threshold = self.threshold
+		if self.white_line:
+			return min(sensors) < 1000 - threshold
+		return max(sensors) > threshold
+
+	def _propagate(self, t):
+		dt = t - self.t
+		if dt <= 0:
+			return
+		a = self.acceleration
+		self.position += self.velocity*dt + 0.5*a*dt*dt
+		self.velocity += a*dt
+		q = self.accel*self.accel
+		dt2 = dt*dt
+		self.pp += 2*dt*self.pv + dt2*self.vv + q*dt2*dt2/4
+		self.pv += dt*self.vv + q*dt2*dt/2
+		self.vv += q*dt2
+		self.t = t
+
+	def update(self, t, position, sensors):
+		"""
+		Feeds one readLine result taken at t (time.perf_counter()).  A sample
+		on which no sensor sees the line is not a measurement, the estimate
+		just keeps predicting.
+		"""
+		if not self.onLine(sensors):
+			if self.t is None:
+				return False
+			self._propagate(t)
+			if not self.lost:
+				self.lost = True
+				self.lostSince = t
+				self.edge = 0 if self.position < (self.numSensors - 1)*1000/2 else (self.numSensors - 1)*1000
+			if (self.edge == 0) == (self.position > self.edge):
+				self.position = self.edge
+			return False
+		r = self.noise*self.noise
+		if self.t is None:
+			self.t = t
+			self.position = position
+			self.velocity = 0.0
+			self.pp = r
+			self.pv = 0.0
+			self.vv = (self.accel*0.1)**2
+		else:
+			self._propagate(t)
+			s = self.pp + r
+			kp = self.pp / s
+			kv = self.pv / s
+			innovation = position - self.position
+			self.position += kp*innovation
+			self.velocity += kv*innovation
+			self.vv -= kv*self.pv
+			self.pv -= kv*self.pp
+			self.pp -= kp*self.pp
+		self.lost = False
+		self.lostSince = None
+		self.edge = None
+		return True
+
+	def predict(self, t):
+		"Most likely position at t, clamped to reach past the end sensors"
+		position = self.position
+		if self.t is not None and t > self.t:
+			dt = t - self.t
+			position += self.velocity*dt + 0.5*self.acceleration*dt*dt
+		if self.lost and self.edge is not None and (self.edge == 0) == (position > self.edge):
+			position = self.edge
+		return max(self.low, min(self.high, position))
+
+	def confidence(self, t = None):
+		if self.t is None:
+			return 0.0
+		pp = self.pp
+		if t is not None and t > self.t:
+			dt = t - self.t
+			dt2 = dt*dt
+			pp += 2*dt*self.pv + dt2*self.vv + self.accel*self.accel*dt2*dt2/4
+		return 1.0 / (1.0 + math.sqrt(max(0.0, pp)) / self.spread)
+
+if __name__ == '__main__':
+	import random
+	# the line swings past both ends of the bar, sampled at 100Hz and
+	# estimated for a 200Hz loop
+	estimator = LineEstimator()
+	last = 0
+	for n in range(0, 400):
+		t = n / 200.0
+		truth = 2000 + 2600*math.sin(3*t)
+		if n % 2 == 0:
+			seen = 0 <= truth <= 4000
+			position = truth + random.gauss(0, 40) if seen else (0 if last < 2000 else 4000)
+			last = position
+			estimator.update(t, position, [0, 0, 600 if seen else 0, 0, 0])
+		if n % 10 == 0:
+			print('%.2f truth %7.1f readLine %7.1f estimate %7.1f confidence %.2f%s' % (t, truth,
+				last, estimator.predict(t), estimator.confidence(t), ' lost' if estimator.lost else ''))
@@ -1,16 +1,23 @@
 #!/usr/bin/python
 # -*- coding:utf-8 -*-
-import RPi.GPIO as GPIO
+import GPIOBackend
 from AlphaBot2 import AlphaBot2
 from rpi_ws281x import Adafruit_NeoPixel, Color
 from TRSensors import TRSensor
+from ControlLoop import ControlLoop, LineFollower, PID, loadGains
+from Telemetry import Telemetry
+from LedEngine import LedEngine
+from Instrumentation import Instruments
+from CalibrationStore import OnlineCalibrator
+from LineEstimator import LineEstimator
+from TraceRecorder import TraceRecorder, tracePath, traceOption
+import sys
 import time
 
 Button = 7
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(Button,GPIO.IN,GPIO.PUD_UP)
+gpio = GPIOBackend.default()
+gpio.setup(Button,GPIOBackend.IN,GPIOBackend.PUD_UP)
 
 # LED strip configuration:
 LED_COUNT      = 4      # Number of LED pixels.
@@ -21,20 +28,8 @@ LED_BRIGHTNESS = 255     # Set to 0 for darkest and 255 for brightest
 LED_INVERT     = False   # True to invert the signal (when using NPN transistor level shift)	
 
 maximum = 35
-j = 0
-integral = 0
-last_proportional = 0
-
-def Wheel(pos):
-#	"""Generate rainbow colors across 0-255 positions."""
-	if pos < 85:
-		return Color(pos * 3, 255 - pos * 3, 0)
-	elif pos < 170:
-		pos -= 85
-		return Color(255 - pos * 3, 0, pos * 3)
-	else:
-		pos -= 170
-		return Color(0, pos * 3, 255 - pos * 3)
+PERIOD = 0.005           # control loop period in seconds (200Hz)
+SURFACE = 'default'      # calibration profile; --calibrate redoes it
 
 # Create NeoPixel object with appropriate configuration.
 strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS)
@@ -50,72 +45,74 @@ TR = TRSensor()
 Ab = AlphaBot2()
 Ab.stop()
 print("Line follow Example")
-time.sleep(0.5)
-for i in range(0,100):
-	if(i<25 or i>= 75):
-		Ab.right()
-		Ab.setPWMA(30)
-		Ab.setPWMB(30)
-	else:
-		Ab.left()
-		Ab.setPWMA(30)
-		Ab.setPWMB(30)
-	TR.calibrate()
-Ab.stop()
+if '--calibrate' in sys.argv or not TR.loadCalibration(SURFACE):
+	time.sleep(0.5)
+	for i in range(0,100):
+		if(i<25 or i>= 75):
+			Ab.right()
+			Ab.setPWMA(30)
+			Ab.setPWMB(30)
+		else:
+			Ab.left()
+			Ab.setPWMA(30)
+			Ab.setPWMB(30)
+		TR.calibrate()
+	Ab.stop()
+	TR.saveCalibration(SURFACE)
 print(TR.calibratedMin)
 print(TR.calibratedMax)
-while (GPIO.input(Button) != 0):
+while (gpio.input(Button) != 0):
 	position,Sensors = TR.readLine()
 	print(position,Sensors)
 	time.sleep(0.05)
 Ab.forward()
 
-while True:
-	try:
-		position,Sensors = TR.readLine()
-		#print(position)
-		if(Sensors[0] >900 and Sensors[1] >900 and Sensors[2] >900 and Sensors[3] >900 and Sensors[4] >900):
-			Ab.setPWMA(0)
-			Ab.setPWMB(0)
-		else:
-			# The "proportional" term should be 0 when we are on the line.
-			proportional = position - 2000
-			
-			# Compute the derivative (change) and integral (sum) of the position.
-			derivative = proportional - last_proportional
-			integral += proportional
-			
-			# Remember the last position.
-			last_proportional = proportional
-
-			'''
-			// Compute the difference between the two motor power settings,
-			// m1 - m2.  If this is a positive number the robot will turn
-			// to the right.  If it is a negative number, the robot will
-			// turn to the left, and the magnitude of the number determines
-			// the sharpness of the turn.  You can adjust the constants by which
-			// the proportional, integral, and derivative terms are multiplied to
-			// improve performance.
-			'''
-			power_difference = proportional/30  + integral/10000 + derivative*2;  
+# per phase latency histograms, printed when the loop stops
+instruments = Instruments()
+# keep the calibration in step with the light while driving
+online = OnlineCalibrator(TR)
+TR.startSampler(rate = 1/PERIOD, instruments = instruments, online = online)
+# --telemetry streams live data on port 5004 instead of printing from the
+# control loop
+telemetry = None
+if '--telemetry' in sys.argv:
+	telemetry = Telemetry().start()
+# gains and speed from PIDTuner.py if it has been run, the ones above if not
+gains = loadGains()
+pid = None
+if gains is not None:
+	maximum = gains['maximum']
+	pid = PID(gains['kp'], gains['ki'], gains['kd'], maximum)
+# steer on the estimated line position, which keeps its direction when the
+# line slips past the end sensors in a curve
+follower = LineFollower(TR, Ab, maximum, pid = pid, telemetry = telemetry, instruments = instruments,
+	estimator = LineEstimator(TR.numSensors))
+# --trace [path] records every step, replay it with TraceRecorder.py
+trace = traceOption(sys.argv)
+recorder = None
+if trace is not None:
+	trace = tracePath(trace)
+	recorder = follower.recorder = TraceRecorder(trace, follower)
+# the rainbow runs on its own thread, the control loop never touches the strip
+leds = LedEngine(strip, instruments = instruments).start()
+leds.setEffect('rainbow')
 
-			if (power_difference > maximum):
-				power_difference = maximum
-			if (power_difference < - maximum):
-				power_difference = - maximum
-			print(position,power_difference)
-			if (power_difference < 0):
-				Ab.setPWMA(maximum + power_difference)
-				Ab.setPWMB(maximum)
-			else:
-				Ab.setPWMA(maximum)
-				Ab.setPWMB(maximum - power_difference)
-			
-		for i in range(0,strip.numPixels()):
-			strip.setPixelColor(i, Wheel((int(i * 256 / strip.numPixels()) + j) & 255))
-		strip.show()
-		j += 1
-		if(j > 256*4): 
-			j= 0
-	except KeyboardInterrupt:
-		break
+loop = ControlLoop(follower.step, PERIOD, instruments = instruments)
+try:
+	loop.run()
+except KeyboardInterrupt:
+	pass
+loop.stop()
+TR.stopSampler()
+if recorder is not None:
+	recorder.close()
+if online.updates:
+	TR.saveCalibration(SURFACE)
+if telemetry is not None:
+	telemetry.stop()
+leds.stop()
+Ab.stop()
+print(loop.stats())
+print(instruments.status())
+if recorder is not None:
+	print('%d steps in %s, %d dropped' % (recorder.records, trace, recorder.dropped))
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+
+"""
+asyncio motor controller on top of AlphaBot2.apply().
+
+Callers only set target speeds (-100..100, clamped); a background task
+moves the actual duty cycles toward them at no more than accel percent per
+second, one step every tick seconds.  setTarget() never blocks, and
+waitReached()/moveTo() can be awaited to know when the wheels got there.
+The task sleeps while both channels are on target.
+"""
+class MotorController(object):
+
+	def __init__(self, bot, accel = 400.0, tick = 0.01):
+		self.bot = bot
+		self.accel = accel
+		self.tick = tick
+		self.left = 0.0
+		self.right = 0.0
+		self.targetLeft = 0.0
+		self.targetRight = 0.0
+		self._changed = asyncio.Event()
+		self._reached = asyncio.Event()
+		self._reached.set()
+		self._task = None
+
+	def start(self):
+		if self._task is None:
+			self._task = asyncio.ensure_future(self._run())
+		return self._task
+
+	async def close(self):
+		if self._task is not None:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+		self.brake()
+
+	def setTarget(self, left, right):
+		self.targetLeft = max(-100.0, min(100.0, float(left)))
+		self.targetRight = max(-100.0, min(100.0, float(right)))
+		if self.targetLeft == self.left and self.targetRight == self.right:
+			self._reached.set()
+			return
+		self._reached.clear()
+		self._changed.set()
+
+	def brake(self):
+		"Stops immediately, bypassing the acceleration limit"
+		self.targetLeft = self.targetRight = self.left = self.right = 0.0
+		self.bot.stop()
+		self._reached.set()
+
+	async def waitReached(self, timeout = None):
+		if timeout is None:
+			await self._reached.wait()
+			return True
+		try:
+			await asyncio.wait_for(self._reached.wait(), timeout)
+			return True
+		except asyncio.TimeoutError:
+			return False
+
+	async def moveTo(self, left, right, timeout = None):
+		self.setTarget(left, right)
+		return await self.waitReached(timeout)
+
+	def _approach(self, value, target, step):
+		if value < target:
+			return min(value + step, target)
+		return max(value - step, target)
+
+	async def _run(self):
+		last = time.monotonic()
+		while True:
+			if self._reached.is_set():
+				self._changed.clear()
+				await self._changed.wait()
+				last = time.monotonic() - self.tick
+			now = time.monotonic()
+			step = self.accel * min(now - last, 4*self.tick)
+			last = now
+			self.left = self._approach(self.left, self.targetLeft, step)
+			self.right = self._approach(self.right, self.targetRight, step)
+			self.bot.apply(self.left, self.right)
+			if self.left == self.targetLeft and self.right == self.targetRight:
+				self._reached.set()
+				continue
+			await asyncio.sleep(self.tick)
@@ -24,20 +24,52 @@ class PCA9685:
   __ALLLED_ON_H        = 0xFB
   __ALLLED_OFF_L       = 0xFC
   __ALLLED_OFF_H       = 0xFD
+  __AI                 = 0x20   # MODE1 register auto-increment
+  __BLOCK              = 32     # SMBus block transfer limit
 
-  def __init__(self, address=0x40, debug=False):
-    self.bus = smbus.SMBus(1)
+  def __init__(self, address=0x40, debug=False, bus=None):
+    # bus lets you pass another SMBus, e.g. FakeSMBus.SMBus() for testing
+    self.bus = bus if bus is not None else smbus.SMBus(1)
     self.address = address
     self.debug = debug
+    # Shadow of the LEDn registers, None = unknown
+    self.cache = [None] * 256
     if (self.debug):
       print("Reseting PCA9685")
-    self.write(self.__MODE1, 0x00)
+    # Auto-increment on, so a channel's 4 registers go in one block write
+    self.write(self.__MODE1, self.__AI)
 	
   def write(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
+    if (reg >= self.__LED0_ON_L and reg < self.__ALLLED_ON_L and self.cache[reg] == value):
+      return
     self.bus.write_byte_data(self.address, reg, value)
+    self.cache[reg] = value
     if (self.debug):
       print("I2C: Write 0x%02X to register 0x%02X" % (value, reg))
+
+  def writeBlock(self, reg, values):
+    "Writes consecutive registers, skipping the ones the cache says are unchanged"
+    cache = self.cache
+    changed = [i for i in range(len(values)) if cache[reg + i] != values[i]]
+    if not changed:
+      return
+    # Group the changed bytes into transfers; rewriting a short run of
+    # unchanged bytes (up to one channel) is cheaper than a new transaction.
+    start = changed[0]
+    end = start
+    for i in changed[1:]:
+      if i - end > 5 or i - start >= self.__BLOCK:
+        self._transfer(reg + start, values[start:end + 1])
+        start = i
+      end = i
+    self._transfer(reg + start, values[start:end + 1])
+
+  def _transfer(self, reg, values):
+    self.bus.write_i2c_block_data(self.address, reg, list(values))
+    self.cache[reg:reg + len(values)] = values
+    if (self.debug):
+      print("I2C: Write %d bytes from register 0x%02X" % (len(values), reg))
 	  
   def read(self, reg):
     "Read an unsigned byte from the I2C device"
@@ -69,18 +101,45 @@ class PCA9685:
 
   def setPWM(self, channel, on, off):
     "Sets a single PWM channel"
-    self.write(self.__LED0_ON_L+4*channel, on & 0xFF)
-    self.write(self.__LED0_ON_H+4*channel, on >> 8)
-    self.write(self.__LED0_OFF_L+4*channel, off & 0xFF)
-    self.write(self.__LED0_OFF_H+4*channel, off >> 8)
+    self.writeBlock(self.__LED0_ON_L+4*channel, [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
     if (self.debug):
       print("channel: %d  LED_ON: %d LED_OFF: %d" % (channel,on,off))
+
+  def setPWMs(self, channels):
+    "Sets several channels from {channel: (on, off)}, adjacent channels share a block write"
+    if not channels:
+      return
+    order = sorted(channels)
+    first = order[0]
+    values = []
+    for n, channel in enumerate(order):
+      if n and channel != order[n - 1] + 1:
+        self.writeBlock(self.__LED0_ON_L+4*first, values)
+        first = channel
+        values = []
+      on, off = channels[channel]
+      values += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+    self.writeBlock(self.__LED0_ON_L+4*first, values)
+    if (self.debug):
+      print("channels: %s" % channels)
+
+  def setAllPWM(self, on, off):
+    "Sets all 16 channels at once through the ALL_LED registers"
+    self.bus.write_i2c_block_data(self.address, self.__ALLLED_ON_L, [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+    # Every channel changed behind the cache's back
+    self.cache[self.__LED0_ON_L:self.__LED0_ON_L + 64] = [None] * 64
+    if (self.debug):
+      print("all channels: LED_ON: %d LED_OFF: %d" % (on,off))
 	  
   def setServoPulse(self, channel, pulse):
     "Sets the Servo Pulse,The PWM frequency must be 50HZ"
     pulse = int(pulse*4096/20000)      #PWM frequency is 50HZ,the period is 20000us
     self.setPWM(channel, 0, pulse)
 
+  def setServoPulses(self, pulses):
+    "Sets several servos from {channel: pulse in us}, The PWM frequency must be 50HZ"
+    self.setPWMs(dict((channel, (0, int(pulse*4096/20000))) for channel, pulse in pulses.items()))
+
 if __name__=='__main__':
  
   pwm = PCA9685(0x40, debug=True)
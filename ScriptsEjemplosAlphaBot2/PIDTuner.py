@@ -0,0 +1,303 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from Simulator import TRACKS, Robot, frange
+from TRSensors import TRSensor
+from LineEstimator import LineEstimator
+from ControlLoop import PID, LineFollower, gainsPath, LEGACY_PERIOD
+
+PERIOD = 0.005           # the Line_Follow.py control period
+SAMPLE_PHASE = 0.5       # where in a period the sampler takes its frame
+TIMEOUT = 90.0           # simulated seconds a lap may take
+LOST = 4.0               # cm off the line that count as having lost it
+
+# (low, high, log scale): PID gains in per-second units (see ControlLoop.PID)
+# and the maximum duty cycle
+SPACE = {
+	'kp': (0.005, 0.2, True),
+	'ki': (0.0, 0.1, False),
+	'kd': (0.0, 0.08, False),
+	'maximum': (25, 95, False),
+}
+
+GRID = {
+	'kp': [0.01, 0.02, 0.033, 0.05, 0.08, 0.12],
+	'ki': [0.0, 0.01, 0.05],
+	'kd': [0.0, 0.01, 0.02, 0.04, 0.06],
+	'maximum': [35, 50, 65, 80, 95],
+}
+
+"""
+Offline PID gain and speed tuner.
+
+Every candidate (kp, ki, kd, maximum) drives the controller the robot runs,
+TRSensor's sampler, LineEstimator, LineFollower and PID, against the
+kinematic AlphaBot2 of Simulator.py on a set of tracks: no virtual clock
+thread or GPIO, the sampler and the control law are stepped in lockstep
+every PERIOD seconds.
+A candidate scores the sum of its lap times and its mean distance from the
+line; one that loses the line on any track is discarded.  The candidates
+run in parallel on all cores, and the result is the Pareto frontier of lap
+time against tracking error.
+
+	grid    every combination of GRID
+	random  samples drawn from SPACE
+	refine  random samples, then rounds of samples around the frontier with
+	        a shrinking spread (a cheap stand-in for Bayesian optimisation)
+
+The chosen gains (the fastest frontier point within --max-error) are saved
+with the frontier to gains.json; Line_Follow.py and RobotServer load them
+through ControlLoop.loadGains().
+
+	python3 PIDTuner.py --search refine --samples 120 --rounds 3
+"""
+
+class ModelADC(object):
+	"TLC1543.read() over the simulated bar"
+
+	def __init__(self, robot):
+		self.robot = robot
+
+	def read(self, channels):
+		return [self.robot.sensor(i, len(channels)) for i in channels]
+
+class ModelPins(object):
+	"TRSensor sets up its pins; behind ModelADC nothing uses them"
+
+	def setup(self, pins, mode, pull = None, initial = None):
+		pass
+
+def calibrate(TR, robot):
+	"TRSensor.calibrate over a sweep of the bar across the line"
+	x, y, heading = robot.x, robot.y, robot.theta
+	for offset in frange(-4.0, 4.0, 0.5):
+		robot.x = x - offset*math.sin(heading)
+		robot.y = y + offset*math.cos(heading)
+		TR.calibrate()
+	robot.x, robot.y = x, y
+
+class ModelMotors(object):
+	"The part of AlphaBot2 that LineFollower uses, driving forward"
+
+	def __init__(self, robot):
+		self.robot = robot
+		self.t = 0.0
+		self.PA = 0
+		self.PB = 0
+
+	def setPWMA(self, value):
+		self.PA = value
+		self.robot.setWheels(self.t, self.PA / 100.0, self.PB / 100.0)
+
+	def setPWMB(self, value):
+		self.PB = value
+		self.robot.setWheels(self.t, self.PA / 100.0, self.PB / 100.0)
+
+def lap(candidate, track, seed = 1, period = PERIOD, timeout = TIMEOUT, lost = LOST):
+	"""
+	One lap of track (to the end of an open one).  Returns (lap time, mean
+	error in cm, max error in cm), or None if the line was lost.
+
+	The controller is the one Line_Follow.py and RobotServer run: a
+	TRSensor sampler at the loop rate feeding LineFollower through its
+	ring, and the LineEstimator in between.  The sampler and the loop are
+	separate threads on the robot, so here a frame is taken SAMPLE_PHASE
+	into every period and is that old when the step reads it.
+	"""
+	robot = Robot(track, seed = seed)
+	TR = TRSensor(adc = ModelADC(robot), gpio = ModelPins())
+	calibrate(TR, robot)
+	Ab = ModelMotors(robot)
+	now = [0.0]
+	clock = lambda: now[0]
+	TR.startSampler(rate = 1/period, background = False, clock = clock)
+	maximum = candidate['maximum']
+	follower = LineFollower(TR, Ab, maximum, PID(candidate['kp'], candidate['ki'], candidate['kd'], maximum),
+		estimator = LineEstimator(TR.numSensors), clock = clock)
+	goal = track.length if track.closed else track.length - 5.0
+	along = track.nearest(robot.x, robot.y)[1]
+	progress = 0.0
+	errorSum = 0.0
+	errorMax = 0.0
+	steps = 0
+	t = 0.0
+	while t < timeout:
+		now[0] = t + SAMPLE_PHASE * period
+		robot.integrate(now[0])
+		TR.sample()
+		t += period
+		now[0] = Ab.t = t
+		robot.integrate(t)
+		follower.step(period)
+		error, position = track.nearest(robot.x, robot.y)
+		if error > lost or (Ab.PA == 0 and Ab.PB == 0):
+			return None
+		errorSum += error
+		errorMax = max(errorMax, error)
+		steps += 1
+		delta = position - along
+		if track.closed:
+			# wrapped around the start of the loop
+			if delta < -track.length/2:
+				delta += track.length
+			elif delta > track.length/2:
+				delta -= track.length
+		progress += delta
+		along = position
+		if progress >= goal:
+			return t, errorSum / steps, errorMax
+	return None
+
+def evaluate(candidate, tracks, seed = 1):
+	"candidate with its scores over all tracks; feasible False if any lap failed"
+	result = dict(candidate)
+	result['laps'] = {}
+	lapTime = 0.0
+	errors = []
+	worst = 0.0
+	for name in tracks:
+		outcome = lap(candidate, TRACKS[name](), seed)
+		if outcome is None:
+			result.update(feasible = False, lap_time = None, error = None, error_max = None)
+			return result
+		result['laps'][name] = round(outcome[0], 3)
+		lapTime += outcome[0]
+		errors.append(outcome[1])
+		worst = max(worst, outcome[2])
+	result.update(feasible = True, lap_time = round(lapTime, 3),
+		error = round(sum(errors) / len(errors), 4), error_max = round(worst, 3))
+	return result
+
+def frontier(results):
+	"Feasible results not beaten on both lap time and error, fastest first"
+	best = []
+	for r in sorted((r for r in results if r['feasible']), key = lambda r: (r['lap_time'], r['error'])):
+		if not best or r['error'] < best[-1]['error']:
+			best.append(r)
+	return best
+
+def choose(front, maxError):
+	"The fastest frontier point tracking within maxError, else the most accurate"
+	for r in front:
+		if r['error'] <= maxError:
+			return r
+	return front[-1] if front else None
+
+def _draw(rng, name):
+	low, high, log = SPACE[name]
+	if log:
+		return math.exp(rng.uniform(math.log(low), math.log(high)))
+	return rng.uniform(low, high)
+
+def _round(candidate):
+	candidate = dict((name, round(value, 4)) for name, value in candidate.items())
+	candidate['maximum'] = int(round(candidate['maximum']))
+	return candidate
+
+def gridCandidates():
+	names = sorted(GRID)
+	candidates = [{}]
+	for name in names:
+		candidates = [dict(c, **{name: value}) for c in candidates for value in GRID[name]]
+	return candidates
+
+def randomCandidates(rng, count):
+	return [_round(dict((name, _draw(rng, name)) for name in SPACE)) for i in range(0, count)]
+
+def aroundCandidates(rng, front, count, spread):
+	"count candidates scattered around the frontier points, spread as a fraction of the range"
+	candidates = []
+	for i in range(0, count):
+		base = front[i % len(front)]
+		candidate = {}
+		for name, (low, high, log) in SPACE.items():
+			if log:
+				value = math.exp(math.log(base[name]) + rng.gauss(0, spread * (math.log(high) - math.log(low))))
+			else:
+				value = base[name] + rng.gauss(0, spread * (high - low))
+			candidate[name] = max(low, min(high, value))
+		candidates.append(_round(candidate))
+	return candidates
+
+def run(candidates, tracks, workers = None, seed = 1, progress = None):
+	results = []
+	with ProcessPoolExecutor(max_workers = workers) as pool:
+		futures = [pool.submit(evaluate, c, tracks, seed) for c in candidates]
+		for future in futures:
+			results.append(future.result())
+			if progress is not None:
+				progress(len(results), len(futures))
+	return results
+
+def search(mode, tracks, samples = 100, rounds = 3, workers = None, seed = 1, progress = None):
+	rng = random.Random(seed)
+	if mode == 'grid':
+		return run(gridCandidates(), tracks, workers, seed, progress)
+	results = run(randomCandidates(rng, samples), tracks, workers, seed, progress)
+	if mode == 'refine':
+		spread = 0.1
+		for r in range(0, rounds):
+			front = frontier(results)
+			if not front:
+				break
+			results += run(aroundCandidates(rng, front, samples, spread), tracks, workers, seed, progress)
+			spread /= 2
+	return results
+
+def legacy():
+	"Line_Follow.py's hand-picked gains in the same units"
+	pid = PID.fromLegacy(period = LEGACY_PERIOD)
+	return {'kp': pid.kp, 'ki': pid.ki, 'kd': pid.kd, 'maximum': 35}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Tune the line follow PID gains and speed in simulation')
+	parser.add_argument('--search', choices = ('grid', 'random', 'refine'), default = 'refine')
+	parser.add_argument('--samples', type = int, default = 120, help = 'candidates per random/refine round')
+	parser.add_argument('--rounds', type = int, default = 3, help = 'refine rounds after the random one')
+	parser.add_argument('--tracks', default = 'oval,wave,circle', help = 'comma separated, from %s' % ','.join(sorted(TRACKS)))
+	parser.add_argument('--workers', type = int, default = None, help = 'processes, all cores by default')
+	parser.add_argument('--seed', type = int, default = 1)
+	parser.add_argument('--max-error', type = float, default = 0.5, help = 'cm of mean error the chosen gains may have')
+	parser.add_argument('--output', default = gainsPath())
+	args = parser.parse_args()
+	tracks = args.tracks.split(',')
+	for name in tracks:
+		if name not in TRACKS:
+			parser.error('unknown track %s' % name)
+
+	def progress(done, total):
+		sys.stdout.write('\r%d/%d' % (done, total))
+		sys.stdout.flush()
+
+	started = time.time()
+	reference = evaluate(legacy(), tracks, args.seed)
+	results = search(args.search, tracks, args.samples, args.rounds, args.workers, args.seed, progress)
+	elapsed = time.time() - started
+	front = frontier(results)
+	chosen = choose(front, args.max_error)
+	print('\r%d candidates, %d feasible, %.0fs on %d cores' % (len(results),
+		sum(1 for r in results if r['feasible']), elapsed, args.workers or os.cpu_count()))
+	print('%8s %8s %8s %8s %10s %8s' % ('kp', 'ki', 'kd', 'maximum', 'lap_time', 'error'))
+	for r in front:
+		print('%8.4f %8.4f %8.4f %8d %10.2f %8.3f%s' % (r['kp'], r['ki'], r['kd'], r['maximum'],
+			r['lap_time'], r['error'], '  <- chosen' if r is chosen else ''))
+	if reference['feasible']:
+		print('Line_Follow.py gains: lap_time %.2f error %.3f' % (reference['lap_time'], reference['error']))
+	else:
+		print('Line_Follow.py gains: lost the line')
+	if chosen is None:
+		print('no candidate kept the line on every track')
+		sys.exit(1)
+	with open(args.output, 'w') as f:
+		json.dump({'tracks': tracks, 'period': PERIOD, 'search': args.search,
+			'controller': {'sampler': True, 'sample_phase': SAMPLE_PHASE, 'estimator': True},
+			'chosen': dict((name, chosen[name]) for name in ('kp', 'ki', 'kd', 'maximum')),
+			'frontier': front, 'legacy': reference}, f, indent = 1, sort_keys = True)
+	print('saved %s' % args.output)
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+from array import array
+
+"""
+Fixed-size, array-backed ring of timestamped frames.
+
+One thread writes, any number of threads read.  Nothing is allocated after
+construction on the write side and no lock is taken.  Every slot carries
+the number of the frame in it, negative while the writer is filling it;
+the writer publishes a frame by bumping seq last, and a reader checks the
+slot number before and after copying, so a reader that was overtaken
+while copying a slot drops that frame instead of returning it torn.
+
+Frames are numbered from 1; seq is the number of the newest frame (0 while
+the ring is empty).
+"""
+class FrameRing(object):
+
+	def __init__(self, width, capacity = 1024, typecode = 'd'):
+		# capacity is rounded up to a power of two so the slot is seq & mask
+		size = 1
+		while size < capacity:
+			size <<= 1
+		self.width = width
+		self.capacity = size
+		self.mask = size - 1
+		self.typecode = typecode
+		self.data = array(typecode, [0]) * (width * size)
+		self.stamps = array('d', [0.0]) * size
+		self.seqs = array('q', [0]) * size
+		self.seq = 0
+
+	def write(self, timestamp, values):
+		seq = self.seq + 1
+		slot = seq & self.mask
+		base = slot * self.width
+		data = self.data
+		self.seqs[slot] = -seq
+		for i in range(0, self.width):
+			data[base + i] = values[i]
+		self.stamps[slot] = timestamp
+		self.seqs[slot] = seq
+		self.seq = seq
+		return seq
+
+	def read(self, seq):
+		"Returns (seq, timestamp, values) or None if the frame is gone"
+		if seq < 1 or seq > self.seq:
+			return None
+		slot = seq & self.mask
+		if self.seqs[slot] != seq:
+			return None
+		base = slot * self.width
+		values = self.data[base:base + self.width].tolist()
+		timestamp = self.stamps[slot]
+		if self.seqs[slot] != seq:
+			return None
+		return seq, timestamp, values
+
+	def latest(self):
+		return self.read(self.seq)
+
+	def since(self, seq):
+		"All frames still in the ring that are newer than seq, oldest first"
+		last = self.seq
+		first = max(seq + 1, last - self.capacity + 1, 1)
+		frames = []
+		for s in range(first, last + 1):
+			frame = self.read(s)
+			if frame is not None:
+				frames.append(frame)
+		return frames
+
+	def average(self, count = None, seconds = None):
+		"""
+		Per-column mean of the newest count frames, or of the frames
+		from the last seconds (relative to the newest timestamp).
+		Returns None while there is nothing to average.
+		"""
+		last = self.seq
+		if last == 0:
+			return None
+		if count is None:
+			count = self.capacity - 1
+		frames = self.since(max(last - count, 0))
+		if seconds is not None and frames:
+			oldest = frames[-1][1] - seconds
+			frames = [f for f in frames if f[1] >= oldest]
+		if not frames:
+			return None
+		n = len(frames)
+		return [sum(f[2][i] for f in frames) / n for i in range(0, self.width)]
@@ -0,0 +1,406 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import GPIOBackend
+import asyncio
+import json
+import sys
+import time
+from AlphaBot2 import AlphaBot2
+from TRSensors import TRSensor
+from TLC1543 import TLC1543
+from PCA9685 import PCA9685
+from rpi_ws281x import Adafruit_NeoPixel, Color
+from MotorController import MotorController
+from ServoPlanner import ServoPlanner
+from ControlLoop import ControlLoop, LineFollower, PID, loadGains
+from LineEstimator import LineEstimator
+from TraceRecorder import TraceRecorder, tracePath, traceOption
+import ControlPacket
+from Watchdog import MotionWatchdog
+from LedEngine import LedEngine
+from Instrumentation import Instruments
+from CalibrationStore import OnlineCalibrator
+
+CONTROL_PORT = 5555      # MOVE x y / CAMERA x y / quit
+LED_PORT = 5556          # ON / OFF / COLOR r g b / BRIGHTNESS n / EFFECT name / QUIT
+LINE_PORT = 5003         # calibrate / start / stop / speed:n / surface:name / status / dump
+UDP_PORT = 5557          # binary ControlPacket datagrams, optional MOVE replacement
+
+# LED strip configuration:
+LED_COUNT      = 4      # Number of LED pixels.
+LED_PIN        = 18      # GPIO pin connected to the pixels (must support PWM!).
+LED_FREQ_HZ    = 800000  # LED signal frequency in hertz (usually 800khz)
+LED_DMA        = 5       # DMA channel to use for generating signal (try 5)
+LED_BRIGHTNESS = 255     # Set to 0 for darkest and 255 for brightest
+LED_INVERT     = False   # True to invert the signal (when using NPN transistor level shift)
+
+MAX_SPEED = 100          # duty cycle for a full joystick deflection
+LINE_PERIOD = 0.005      # line follow control period (200Hz)
+LINE_LIMIT = 256         # longest accepted command line, in bytes
+CLIENT_TIMEOUT = 500     # ms without MOVE/UDP packets before the watchdog stops
+LINE_TIMEOUT = 100       # ms without a line follow iteration before it stops
+
+IDLE = 'idle'
+CALIBRATING = 'calibrating'
+FOLLOWING = 'following'
+
+"""
+Joystick to wheel speeds.  The app sends y < 0 when the stick is pushed
+forward and x < 0 when it is pushed right; setMotor drives forward for
+negative values (see AlphaBot2.forward), so the mix keeps those signs.
+"""
+def mix(x, y, speed = MAX_SPEED):
+	left = max(-1.0, min(1.0, y + x)) * speed
+	right = max(-1.0, min(1.0, y - x)) * speed
+	return left, right
+
+"""
+One asyncio process serving the three line protocols the app speaks, on top
+of a single AlphaBot2, TRSensor, PCA9685 and LED strip, so the hardware is
+set up once and no two processes fight over the same pins.
+
+Each connection reads one line at a time and waits for its reply to drain
+before reading the next, so a slow client is throttled by TCP instead of
+queueing work here.  MOVE/CAMERA only overwrite targets (latest wins), so a
+fast client never builds up a backlog either.
+
+trace, a TraceRecorder path (strftime fields are filled in per drive),
+records every line follow drive; None, the default, records nothing.
+"""
+class RobotServer(object):
+
+	def __init__(self, Ab = None, TR = None, pwm = None, strip = None, trace = None):
+		self.Ab = Ab if Ab is not None else AlphaBot2()
+		self.TR = TR if TR is not None else TRSensor(adc = TLC1543())
+		self.pwm = pwm if pwm is not None else PCA9685(0x40)
+		if strip is None:
+			strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS)
+			strip.begin()
+		self.strip = strip
+		self.instruments = Instruments()
+		self.leds = LedEngine(strip, instruments = self.instruments).start()
+		self.servos = ServoPlanner(self.pwm).start()
+		self.motors = None
+		self.follower = LineFollower(self.TR, self.Ab, instruments = self.instruments,
+			estimator = LineEstimator(self.TR.numSensors))
+		gains = loadGains()
+		if gains is not None:
+			# tuned by PIDTuner.py; speed:n still overrides the speed
+			self.follower.maximum = gains['maximum']
+			self.follower.pid = PID(gains['kp'], gains['ki'], gains['kd'], gains['maximum'])
+		self.online = OnlineCalibrator(self.TR)
+		self.trace = trace
+		self.loop = None
+		self.state = IDLE
+		# a saved profile makes calibrate optional
+		self.surface = 'default'
+		self.calibrated = self.TR.loadCalibration(self.surface)
+		self.ledEffect = 'static'
+		self.servers = []
+		self.udp = None
+		self.udpFilters = {}
+		self.udpMalformed = 0
+		self.watchdog = None
+		self.instruments.gauge('loop', lambda: self.loop.iterations if self.loop is not None else 0)
+		self.instruments.gauge('sensors', lambda: self.TR.samples.seq if self.TR.samples is not None else 0)
+		self.instruments.gauge('leds', lambda: self.leds.shows)
+
+	async def start(self, host = '0.0.0.0', udp = True):
+		self.motors = MotorController(self.Ab)
+		self.motors.start()
+		loop = asyncio.get_event_loop()
+		self.watchdog = MotionWatchdog(self.Ab, lambda source: loop.call_soon_threadsafe(self._tripped, source),
+			owns = self._owns)
+		self.watchdog.register('tcp', CLIENT_TIMEOUT).register('udp', CLIENT_TIMEOUT).register('line', LINE_TIMEOUT)
+		for port, handler in ((CONTROL_PORT, self.handleControl),
+				(LED_PORT, self.handleLeds), (LINE_PORT, self.handleLineFollow)):
+			server = await asyncio.start_server(handler, host, port, limit = LINE_LIMIT)
+			self.servers.append(server)
+		if udp:
+			self.udp, protocol = await asyncio.get_event_loop().create_datagram_endpoint(
+				lambda: ControlDatagrams(self), local_addr = (host, UDP_PORT))
+		print("RobotServer listening on %d, %d and %d%s" % (CONTROL_PORT, LED_PORT, LINE_PORT,
+			" (udp %d)" % UDP_PORT if udp else ""))
+
+	async def close(self):
+		if self.udp is not None:
+			self.udp.close()
+		for server in self.servers:
+			server.close()
+			await server.wait_closed()
+		self.stopFollowing()
+		self.servos.stop()
+		self.leds.setEffect('off')
+		self.leds.stop()
+		await self.motors.close()
+		self.watchdog.stop()
+		self.Ab.stop()
+
+	def _owns(self, source):
+		"Whether source drives the motors now; asked by the watchdog thread"
+		if source == 'line':
+			return self.state == FOLLOWING
+		return self.state == IDLE
+
+	def _tripped(self, source):
+		"Runs on the event loop after the watchdog already stopped the motors"
+		if source == 'line':
+			self.stopFollowing()
+		elif self.state == IDLE:
+			self.motors.brake()
+
+	def _takeOver(self):
+		"Calibration or line following gets the motors: the joystick leases end"
+		self.motors.brake()
+		self.watchdog.release('tcp')
+		self.watchdog.release('udp')
+
+	async def _lines(self, reader):
+		while True:
+			try:
+				line = await reader.readline()
+			except (ConnectionError, ValueError):
+				# reset by the client, or a line longer than LINE_LIMIT
+				return
+			if not line:
+				return
+			line = line.decode('utf-8', 'replace').strip()
+			if line:
+				yield line
+
+	async def _reply(self, writer, text):
+		writer.write((text + '\n').encode('utf-8'))
+		await writer.drain()
+
+	# ---------------------------------------------------------------- 5555
+	def move(self, x, y, source = 'tcp'):
+		if self.state != IDLE:
+			return False
+		left, right = mix(x, y)
+		self.motors.setTarget(left, right)
+		if left == 0 and right == 0:
+			self.watchdog.release(source)
+		else:
+			self.watchdog.refresh(source)
+		return True
+
+	async def handleControl(self, reader, writer):
+		try:
+			async for line in self._lines(reader):
+				parts = line.split()
+				command = parts[0].upper()
+				try:
+					if command == 'MOVE' and len(parts) == 3:
+						self.move(float(parts[1]), float(parts[2]))
+					elif command == 'CAMERA' and len(parts) == 3:
+						self.servos.camera(float(parts[1]), float(parts[2]))
+					elif command == 'QUIT':
+						break
+				except ValueError:
+					pass
+		finally:
+			# a client that goes away must not leave the robot driving
+			if self.state == IDLE:
+				self.motors.setTarget(0, 0)
+				self.watchdog.release('tcp')
+			writer.close()
+
+	# ---------------------------------------------------------------- 5557
+	def datagram(self, data, addr):
+		packet = ControlPacket.unpack(data)
+		if packet is None:
+			self.udpMalformed += 1
+			return
+		mode, seq, timestamp, a, b = packet
+		# one sequence per sender, so two phones do not drop each other
+		filter = self.udpFilters.get(addr)
+		if filter is None:
+			filter = self.udpFilters[addr] = ControlPacket.SequenceFilter()
+		if not filter.accept(seq):
+			return
+		if mode == ControlPacket.MODE_XY:
+			self.move(a, b, 'udp')
+		elif self.state == IDLE:
+			self.motors.setTarget(a * MAX_SPEED, b * MAX_SPEED)
+			self.watchdog.refresh('udp')
+
+	# ---------------------------------------------------------------- 5556
+	def ledCommand(self, parts):
+		command = parts[0].upper()
+		leds = self.leds
+		if command == 'ON' and len(parts) == 1:
+			leds.on()
+			leds.setEffect(self.ledEffect)
+		elif command == 'OFF' and len(parts) == 1:
+			leds.off()
+		elif command == 'COLOR' and len(parts) == 4:
+			color = tuple(int(v) for v in parts[1:])
+			if any(v < 0 or v > 255 for v in color):
+				return False
+			leds.setColor(*color)
+		elif command == 'BRIGHTNESS' and len(parts) == 2:
+			brightness = int(parts[1])
+			if brightness < 0 or brightness > 100:
+				return False
+			leds.setBrightness(brightness * 255 // 100)
+		elif command == 'EFFECT' and len(parts) == 2:
+			effect = parts[1].lower()
+			if effect == 'off' or not leds.setEffect(effect):
+				return False
+			self.ledEffect = effect
+		else:
+			return False
+		return True
+
+	async def handleLeds(self, reader, writer):
+		try:
+			async for line in self._lines(reader):
+				parts = line.split()
+				if parts[0].upper() == 'QUIT':
+					break
+				try:
+					ok = self.ledCommand(parts)
+				except ValueError:
+					ok = False
+				await self._reply(writer, 'OK' if ok else 'ERROR')
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	# ---------------------------------------------------------------- 5003
+	def calibrate(self):
+		"Blocking: spins the robot over the line like Line_Follow.py does"
+		Ab = self.Ab
+		Ab.stop()
+		time.sleep(0.5)
+		for i in range(0,100):
+			if(i<25 or i>= 75):
+				Ab.right()
+			else:
+				Ab.left()
+			Ab.setPWMA(30)
+			Ab.setPWMB(30)
+			self.TR.calibrate()
+		Ab.stop()
+
+	def startFollowing(self):
+		self._takeOver()
+		self.follower.pid.reset()
+		self.follower.estimator.reset()
+		if self.trace is not None:
+			self.follower.recorder = TraceRecorder(tracePath(self.trace), self.follower)
+		self.TR.startSampler(rate = 1/LINE_PERIOD, instruments = self.instruments, online = self.online)
+		self.Ab.forward()
+		self.instruments.reset()
+		self.loop = ControlLoop(self.followStep, LINE_PERIOD, instruments = self.instruments)
+		self.loop.start()
+		self.state = FOLLOWING
+
+	def followStep(self, dt):
+		self.watchdog.refresh('line')
+		self.follower.step(dt)
+
+	def stopFollowing(self):
+		if self.loop is not None:
+			self.loop.stop()
+			self.loop = None
+			self.TR.stopSampler()
+			if self.follower.recorder is not None:
+				self.follower.recorder.close()
+				self.follower.recorder = None
+			if self.online.updates:
+				# keep what the drive learnt about the light
+				self.TR.saveCalibration(self.surface)
+		self.watchdog.release('line')
+		self.Ab.stop()
+		if self.state == FOLLOWING:
+			self.state = IDLE
+
+	async def lineCommand(self, line):
+		command = line.lower()
+		if command == 'calibrate':
+			if self.state != IDLE:
+				return 'ERROR:Busy (%s)' % self.state
+			self._takeOver()
+			self.state = CALIBRATING
+			try:
+				await asyncio.get_event_loop().run_in_executor(None, self.calibrate)
+			finally:
+				self.state = IDLE
+			self.calibrated = True
+			self.TR.saveCalibration(self.surface)
+			return 'OK:Calibrated min=%s max=%s' % (self.TR.calibratedMin, self.TR.calibratedMax)
+		if command == 'start':
+			if self.state == FOLLOWING:
+				return 'OK:Already following'
+			if self.state != IDLE:
+				return 'ERROR:Busy (%s)' % self.state
+			if not self.calibrated:
+				return 'ERROR:Calibrate first'
+			self.startFollowing()
+			return 'OK:Following'
+		if command == 'stop':
+			self.stopFollowing()
+			return 'OK:Stopped'
+		if command.startswith('speed:'):
+			try:
+				speed = int(command[6:])
+			except ValueError:
+				return 'ERROR:Invalid speed'
+			self.follower.maximum = max(10, min(100, speed))
+			return 'OK:Speed %d' % self.follower.maximum
+		if command.startswith('surface:'):
+			if self.state != IDLE:
+				return 'ERROR:Busy (%s)' % self.state
+			surface = line[8:].strip()
+			if not surface:
+				return 'ERROR:Invalid surface'
+			self.surface = surface
+			self.calibrated = self.TR.loadCalibration(surface)
+			return 'OK:Surface %s%s' % (surface, '' if self.calibrated else ' (calibrate first)')
+		if command == 'status':
+			# the app only looks at the first word after OK:
+			return 'OK:%s %s' % (self.state, self.instruments.status())
+		if command == 'dump':
+			snapshot = self.instruments.snapshot()
+			snapshot['state'] = self.state
+			return 'OK:' + json.dumps(snapshot, sort_keys = True)
+		return 'ERROR:Unknown command'
+
+	async def handleLineFollow(self, reader, writer):
+		try:
+			async for line in self._lines(reader):
+				await self._reply(writer, await self.lineCommand(line))
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+"""
+UDP control endpoint: every datagram is one ControlPacket.  Late or
+duplicated packets are dropped instead of delaying the newer ones.
+"""
+class ControlDatagrams(asyncio.DatagramProtocol):
+
+	def __init__(self, server):
+		self.server = server
+
+	def datagram_received(self, data, addr):
+		self.server.datagram(data, addr)
+
+async def main(trace = None):
+	server = RobotServer(trace = trace)
+	await server.start()
+	try:
+		await asyncio.gather(*[s.serve_forever() for s in server.servers])
+	finally:
+		await server.close()
+
+if __name__ == '__main__':
+	try:
+		# --trace [path] records the line follow drives
+		asyncio.run(main(traceOption(sys.argv)))
+	except KeyboardInterrupt:
+		pass
+	GPIOBackend.default().cleanup()
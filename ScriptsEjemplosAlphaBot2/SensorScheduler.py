@@ -0,0 +1,363 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import math
+import time
+import threading
+import collections
+import GPIOBackend
+from RingBuffer import FrameRing
+from IRDecoder import NECDecoder, IR
+from Ultrasonic import UltrasonicRanger
+
+DR = 16
+DL = 19
+
+ECHO_POLL = 0.0005       # seconds between checks for the end of an echo
+IDLE_MAX = 0.05          # longest sleep, so stop() is noticed
+NAN = float('nan')
+
+"""
+A sensor the scheduler owns.  acquire() is a generator: it yields the
+perf_counter() time it wants to be resumed at while it waits on the
+hardware, and returns the values of its fields when the sample is done.
+Sources with a lower priority number run first when several are due.
+"""
+class Source(object):
+
+	name = 'source'
+	fields = ()
+
+	def __init__(self, rate, priority):
+		self.period = 1.0/rate
+		self.priority = priority
+		self.task = None
+		self.due = 0.0
+		self.wake = 0.0
+		self.started = 0.0
+		self.samples = 0
+		self.skipped = 0
+
+	def open(self):
+		pass
+
+	def close(self):
+		pass
+
+	def acquire(self):
+		return ()
+		yield
+
+"""
+TRSensor frames, written into TR.samples exactly as its own sampler thread
+would, so TR.latest() and LineFollower work unchanged.  No waiting: a
+TLC1543 read is a few hundred microseconds of clocking.
+"""
+class LineSource(Source):
+
+	name = 'line'
+	fields = ('seq', 'position')
+
+	def __init__(self, TR, rate = 200, priority = 0, white_line = 0, instruments = None, online = None, capacity = 1024):
+		Source.__init__(self, rate, priority)
+		self.TR = TR
+		self.white_line = white_line
+		self.instruments = instruments
+		self.online = online
+		self.capacity = capacity
+
+	def open(self):
+		self.TR.startSampler(capacity = self.capacity, online = self.online, background = False)
+
+	def close(self):
+		self.TR.stopSampler()
+
+	def acquire(self):
+		seq = self.TR.sample(self.white_line, self.instruments, self.online)
+		return seq, self.TR.last_value
+		yield
+
+"""
+HC-SR04 through UltrasonicRanger's edge-timed echo: TRIG is raised,
+dropped a slot later and the echo is left to the GPIO callbacks, so the
+other sources keep running for the up to maxRange round trip.  distance is
+the median filtered reading (NaN without one), raw the ping itself.
+"""
+class UltrasonicSource(Source):
+
+	name = 'ultrasonic'
+	fields = ('distance', 'raw')
+
+	def __init__(self, ranger = None, rate = 20, priority = 1):
+		Source.__init__(self, rate, priority)
+		self.ranger = ranger if ranger is not None else UltrasonicRanger(rate = rate)
+
+	def close(self):
+		self.ranger.close()
+
+	def acquire(self):
+		ranger = self.ranger
+		clock = time.perf_counter
+		ranger.trigger()
+		# the module wants TRIG high for 10us at least
+		yield clock() + 0.00001
+		ranger.release()
+		deadline = clock() + ranger.timeout
+		while not ranger.echoed():
+			now = clock()
+			if now >= deadline:
+				break
+			yield min(deadline, now + ECHO_POLL)
+		value = ranger.result(ranger.echoed())
+		ranger.store(value)
+		distance = ranger.distance()
+		return (NAN if distance is None else distance), (NAN if value is None else value)
+
+"IR obstacle sensors DR/DL, active low and read together; 1 while something is in front of one"
+class ObstacleSource(Source):
+
+	name = 'obstacle'
+	fields = ('right', 'left')
+
+	def __init__(self, dr = DR, dl = DL, rate = 100, priority = 2, gpio = None):
+		Source.__init__(self, rate, priority)
+		self.DR = dr
+		self.DL = dl
+		self.pins = (dr, dl)
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.gpio.setup(self.pins,GPIOBackend.IN,GPIOBackend.PUD_UP)
+
+	def acquire(self):
+		right, left = self.gpio.inputs(self.pins)
+		return (0 if right else 1), (0 if left else 1)
+		yield
+
+"""
+NEC remote on the IR receiver.  The edge callbacks only timestamp into a
+deque; each sample decodes what has arrived since the last one, which is
+exact because NECDecoder works on the timestamps alone.  command is the
+newest key, repeat 1 if it was a repeat code, count grows with every key
+so a reader can tell a new press from the same one; listener(command,
+repeat) is called from the scheduler thread.
+"""
+class IRSource(Source):
+
+	name = 'ir'
+	fields = ('command', 'repeat', 'count')
+
+	def __init__(self, pin = IR, rate = 50, priority = 3, listener = None, strict = True, gpio = None):
+		Source.__init__(self, rate, priority)
+		self.pin = pin
+		self.listener = listener
+		self.decoder = NECDecoder(strict)
+		self.edges = collections.deque()
+		self.command = NAN
+		self.repeat = 0
+		self.count = 0
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.gpio.setup(self.pin,GPIOBackend.IN)
+
+	def _edge(self, channel):
+		self.edges.append(time.perf_counter_ns())
+
+	def open(self):
+		self.gpio.add_event_detect(self.pin,GPIOBackend.BOTH,callback=self._edge)
+
+	def close(self):
+		self.gpio.remove_event_detect(self.pin)
+
+	def acquire(self):
+		edges = self.edges
+		while edges:
+			for command, repeat in self.decoder.edge(edges.popleft()):
+				self.command = command
+				self.repeat = 1 if repeat else 0
+				self.count += 1
+				if self.listener is not None:
+					self.listener(command, repeat)
+		return self.command, self.repeat, self.count
+		yield
+
+"""
+One acquisition thread for all the sensors.
+
+Every source has a rate and a priority.  When several are due the one with
+the lowest priority number starts (or resumes) first, and a source that
+is waiting on hardware, such as the ultrasonic echo, yields the thread to
+the others instead of sleeping in it: a TLC1543 frame is read while the
+echo is in flight.  The thread only sleeps when nothing is due.  A source
+that falls behind skips its missed slots.
+
+After every sample the combined snapshot, one column per field of every
+source plus '<source>.t' with the time of its last sample, is written to
+a FrameRing:
+
+	scheduler = SensorScheduler([LineSource(TR), UltrasonicSource(), ObstacleSource()]).start()
+	scheduler.value('ultrasonic.distance')
+	scheduler.snapshot()        # {'line.position': ..., 'obstacle.left': ..., 't': ...}
+"""
+class SensorScheduler(object):
+
+	def __init__(self, sources, capacity = 256):
+		self.sources = list(sources)
+		self.columns = {}
+		names = []
+		for source in self.sources:
+			source.offset = len(names)
+			names.append(source.name + '.t')
+			names += [source.name + '.' + field for field in source.fields]
+		for i, name in enumerate(names):
+			self.columns[name] = i
+		self.names = names
+		self.row = [NAN] * len(names)
+		self.ring = FrameRing(len(names), capacity)
+		self.busy = 0.0
+		self.idle = 0.0
+		self._running = False
+		self._thread = None
+
+	def start(self):
+		if self._running:
+			return self
+		now = time.perf_counter()
+		for source in self.sources:
+			source.open()
+			source.task = None
+			source.due = now
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		for source in self.sources:
+			source.close()
+
+	def _run(self):
+		clock = time.perf_counter
+		sources = self.sources
+		started = clock()
+		while self._running:
+			now = clock()
+			best = None
+			bestTime = 0.0
+			wake = now + IDLE_MAX
+			for source in sources:
+				t = source.wake if source.task is not None else source.due
+				if t <= now:
+					if best is None or source.priority < best.priority or \
+							(source.priority == best.priority and t < bestTime):
+						best = source
+						bestTime = t
+				elif t < wake:
+					wake = t
+			if best is None:
+				time.sleep(wake - now)
+				self.idle += clock() - now
+				continue
+			self._step(best, now)
+		self.busy = clock() - started - self.idle
+
+	def _step(self, source, now):
+		if source.task is None:
+			source.task = source.acquire()
+			source.started = now
+			source.due += source.period
+			if source.due <= now:
+				# fell behind: skip the missed slots instead of bursting
+				missed = int((now - source.due) / source.period) + 1
+				source.skipped += missed
+				source.due += missed * source.period
+		try:
+			source.wake = next(source.task)
+		except StopIteration as done:
+			source.task = None
+			source.samples += 1
+			self._publish(source, done.value)
+
+	def _publish(self, source, values):
+		row = self.row
+		offset = source.offset
+		row[offset] = time.perf_counter()
+		for i, value in enumerate(values):
+			row[offset + 1 + i] = value
+		self.ring.write(row[offset], row)
+
+	def latest(self):
+		"(seq, timestamp, values) of the newest snapshot, values in names order"
+		return self.ring.latest()
+
+	def snapshot(self):
+		"The newest snapshot as a dict, with its time as 't'; None before the first sample"
+		frame = self.ring.latest()
+		if frame is None:
+			return None
+		snapshot = dict(zip(self.names, frame[2]))
+		snapshot['t'] = frame[1]
+		return snapshot
+
+	def value(self, name):
+		frame = self.ring.latest()
+		if frame is None:
+			return NAN
+		return frame[2][self.columns[name]]
+
+	def stats(self):
+		total = self.busy + self.idle
+		return {
+			'sources': dict((s.name, {'samples': s.samples, 'skipped': s.skipped}) for s in self.sources),
+			'busy': round(self.busy / total, 3) if total else 0.0,
+		}
+
+# Line follow with an obstacle stop, both read by the one scheduler
+# thread: stops while anything is within STOP cm ahead or an IR obstacle
+# sensor is active, and drives on once it is gone.  No distance (NaN: no
+# ping yet, or the ranger timed out or went stale) counts as an obstacle.
+if __name__ == '__main__':
+	from AlphaBot2 import AlphaBot2
+	from TRSensors import TRSensor
+	from TLC1543 import TLC1543
+	from ControlLoop import ControlLoop, LineFollower
+
+	STOP = 15
+	PERIOD = 0.005
+
+	TR = TRSensor(adc = TLC1543())
+	Ab = AlphaBot2()
+	if not TR.loadCalibration():
+		print('no saved calibration, run Line_Follow.py --calibrate first')
+		raise SystemExit(1)
+	scheduler = SensorScheduler([LineSource(TR, rate = 1/PERIOD), UltrasonicSource(rate = 25),
+		ObstacleSource(), IRSource()]).start()
+	follower = LineFollower(TR, Ab)
+	blocked = [False]
+
+	def step(dt):
+		distance = scheduler.value('ultrasonic.distance')
+		obstacle = math.isnan(distance) or distance <= STOP or \
+			scheduler.value('obstacle.right') or scheduler.value('obstacle.left')
+		if obstacle:
+			if not blocked[0]:
+				print('obstacle %s' % scheduler.snapshot())
+			Ab.stop()
+		elif blocked[0]:
+			Ab.forward()
+		blocked[0] = bool(obstacle)
+		if not obstacle:
+			follower.step(dt)
+
+	Ab.forward()
+	loop = ControlLoop(step, PERIOD)
+	try:
+		loop.run()
+	except KeyboardInterrupt:
+		pass
+	loop.stop()
+	scheduler.stop()
+	Ab.stop()
+	print(scheduler.stats())
+	GPIOBackend.default().cleanup()
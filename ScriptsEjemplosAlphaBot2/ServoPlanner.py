@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import time
+import math
+import threading
+from PCA9685 import PCA9685
+
+PAN = 0
+TILT = 1
+FRAME = 0.02   # one 50Hz servo PWM period
+
+"""
+Latest-wins pan/tilt motion planner on top of PCA9685.
+
+setTarget()/camera() only overwrite the wanted pulse for a channel, so a
+client can send targets as fast as it likes.  A planner thread runs once per
+20ms PWM frame, moves each servo toward its newest target with limited
+velocity (us/s) and acceleration (us/s^2), and writes all the channels that
+moved in a single setServoPulses() call.  Bus traffic is at most one block
+write per frame no matter how fast targets arrive, and the thread sleeps
+while the servos are at rest.
+"""
+class ServoPlanner(object):
+
+	def __init__(self, pwm=None, channels=(PAN, TILT), minPulse=500, maxPulse=2500,
+			maxVelocity=2000.0, maxAccel=10000.0):
+		self.pwm = pwm if pwm is not None else PCA9685(0x40)
+		self.pwm.setPWMFreq(50)
+		self.minPulse = minPulse
+		self.maxPulse = maxPulse
+		self.maxVelocity = maxVelocity
+		self.maxAccel = maxAccel
+		center = (minPulse + maxPulse) / 2.0
+		self.position = dict((c, center) for c in channels)
+		self.velocity = dict((c, 0.0) for c in channels)
+		self.target = dict((c, center) for c in channels)
+		self.written = {}
+		self.frames = 0
+		self.writes = 0
+		self._wake = threading.Event()
+		self._running = False
+		self._thread = None
+		self._write()
+
+	def setTarget(self, channel, pulse):
+		self.target[channel] = max(self.minPulse, min(self.maxPulse, pulse))
+		self._wake.set()
+
+	def camera(self, x, y):
+		"Pan/tilt from the app's CAMERA x y, both in -1..1"
+		half = (self.maxPulse - self.minPulse) / 2.0
+		center = self.minPulse + half
+		self.setTarget(PAN, center + max(-1.0, min(1.0, x)) * half)
+		self.setTarget(TILT, center + max(-1.0, min(1.0, y)) * half)
+
+	def _step(self, channel, dt):
+		"One frame of a velocity and acceleration limited move; True when at rest"
+		error = self.target[channel] - self.position[channel]
+		v = self.velocity[channel]
+		if abs(error) < 1.0 and abs(v) < self.maxAccel * dt:
+			self.position[channel] = self.target[channel]
+			self.velocity[channel] = 0.0
+			return True
+		# fastest speed from which we can still stop at the target
+		wanted = math.copysign(min(self.maxVelocity, math.sqrt(2 * self.maxAccel * abs(error))), error)
+		dv = self.maxAccel * dt
+		v = max(v - dv, min(v + dv, wanted))
+		step = v * dt
+		if abs(step) > abs(error) and (step > 0) == (error > 0):
+			step = error
+			v = 0.0
+		self.position[channel] += step
+		self.velocity[channel] = v
+		return False
+
+	def _write(self):
+		pulses = {}
+		for channel, position in self.position.items():
+			pulse = int(round(position))
+			if self.written.get(channel) != pulse:
+				pulses[channel] = pulse
+		if pulses:
+			self.pwm.setServoPulses(pulses)
+			self.written.update(pulses)
+			self.writes += 1
+
+	def _run(self):
+		deadline = time.monotonic()
+		while self._running:
+			rest = True
+			for channel in self.position:
+				rest = self._step(channel, FRAME) and rest
+			self._write()
+			self.frames += 1
+			if rest:
+				self._wake.clear()
+				# stop() may have set _wake just before the clear()
+				if self._running and all(self.target[c] == self.position[c] for c in self.position):
+					self._wake.wait()
+				deadline = time.monotonic()
+				continue
+			deadline += FRAME
+			delay = deadline - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				deadline = time.monotonic()
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+		self._wake.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+if __name__ == '__main__':
+	planner = ServoPlanner().start()
+	try:
+		while True:
+			# a burst of stale targets: only the last one is followed
+			for x in range(-10, 11):
+				planner.camera(x / 10.0, 0)
+			time.sleep(1.5)
+			planner.camera(-1, 0.5)
+			time.sleep(1.5)
+	except KeyboardInterrupt:
+		planner.stop()
@@ -0,0 +1,922 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import sys
+import os
+import math
+import heapq
+import random
+import threading
+import _thread
+import time
+import types
+import runpy
+import queue
+import signal
+import FakeSMBus
+
+"""
+In-process AlphaBot2 simulator.
+
+install() puts drop-in fakes for RPi.GPIO, smbus and rpi_ws281x into
+sys.modules and replaces time.time/monotonic/perf_counter/sleep (and their
+_ns variants) with a virtual clock, so AlphaBot2, TRSensor, PCA9685 and the
+example scripts run unmodified on any Linux box:
+
+	python3 Simulator.py Line_Follow.py --duration 30 --press 7@3
+
+Options may come before or after the script; arguments for the script
+itself go after --:
+
+	python3 Simulator.py Line_Follow.py --duration 30 --press 7@3 -- --trace
+
+Behind the pins there is a TLC1543 model feeding the line sensors, an
+HC-SR04 echo model, the two IR obstacle sensors, and a differential-drive
+model of the robot driven by the ENA/ENB duty cycles and direction pins,
+running over a line track with optional round obstacles.
+
+Virtual time is discrete-event.  time.sleep() and every Condition.wait()
+(hence Event.wait() and Queue.get()) register the thread as idle until a
+virtual wake-up time; once all simulated threads are idle the clock jumps
+straight to the earliest wake-up or scheduled pin event.  An event whose
+callback notifies a waiting thread stops the jump until that thread has run.
+If the clock does not move for grace seconds of real time (a thread computes
+without touching it, or sits in select()), a ticker thread lets it run at
+real speed.  Every GPIO operation and clock read also costs a little virtual
+time, so busy-wait loops terminate.  Sleep-bound scripts run as fast as the
+CPU allows.
+"""
+
+SPEED_OF_SOUND = 34000   # cm/s, the constant the scripts use
+
+# ============================================================================
+# Virtual clock
+# ============================================================================
+INFINITY = float('inf')
+
+# the real primitives, before install() replaces them
+_realTime = time.monotonic
+_conditionWait = threading.Condition.wait
+_conditionNotify = threading.Condition.notify
+
+class VirtualClock(object):
+
+	def __init__(self, opCost = 1e-6, grace = 0.002, slice = 0.0005, epoch = 1600000000.0):
+		self.now = 0.0
+		self.opCost = opCost
+		self.grace = grace
+		self.slice = slice
+		self.epoch = epoch
+		self.end = None
+		self._cond = threading.Condition(threading.RLock())
+		self._events = []
+		self._seq = 0
+		self._sleepers = {}
+		self._participants = set([threading.main_thread()])
+		self._waiting = {}
+		self._woken = False
+		self._ticking = False
+		self._ticker = None
+
+	def schedule(self, t, callback):
+		"Runs callback() when virtual time reaches t"
+		with self._cond:
+			self._seq += 1
+			heapq.heappush(self._events, (t, self._seq, callback))
+			self._cond.notify_all()
+
+	def _advance(self, target, yielding = False):
+		# called with the lock held
+		while self._events and self._events[0][0] <= target:
+			t, seq, callback = heapq.heappop(self._events)
+			if t > self.now:
+				self.now = t
+			self._woken = False
+			callback()
+			if yielding and self._woken:
+				# the event woke a thread up: let it run before going on
+				self._cond.notify_all()
+				return
+		if target > self.now:
+			self.now = target
+		self._cond.notify_all()
+
+	def _next(self):
+		"Earliest finite wake-up or event, None when nothing is pending"
+		times = [t for t in list(self._sleepers.values()) if t < INFINITY]
+		if self._events:
+			times.append(self._events[0][0])
+		return min(times) if times else None
+
+	def _idle(self):
+		for thread in list(self._participants):
+			if not thread.is_alive():
+				self._participants.discard(thread)
+			elif thread not in self._sleepers:
+				return False
+		return True
+
+	def spend(self, dt = None):
+		"Time used up by a running thread (a GPIO call, a clock read)"
+		with self._cond:
+			self._advance(self.now + (self.opCost if dt is None else dt))
+
+	def read(self):
+		with self._cond:
+			self._advance(self.now + self.opCost)
+			now = self.now
+		self._checkEnd()
+		return now
+
+	def _checkEnd(self):
+		if self.end is not None and self.now >= self.end and threading.current_thread() is threading.main_thread():
+			self.end = None
+			raise KeyboardInterrupt
+
+	def sleep(self, dt):
+		me = threading.current_thread()
+		with self._cond:
+			self._participants.add(me)
+			wake = self.now + max(dt, 0)
+			try:
+				while self.now < wake:
+					self._sleepers[me] = wake
+					target = self._next()
+					if target > self.now and self._idle():
+						# everybody is idle: jump to the earliest wake-up
+						self._advance(target, True)
+						continue
+					# somebody is due, busy, or blocked outside the clock
+					self._cond.wait(self.slice)
+			finally:
+				self._sleepers.pop(me, None)
+		self._checkEnd()
+
+	def wait(self, cond, timeout = None):
+		"""
+		Condition.wait() with a virtual timeout.  The waiting thread counts as
+		idle until notify() or its timeout; it polls its waiter lock in slices
+		of real time, so a notify() the clock did not see cannot strand it.
+		This is Condition.wait() itself with one waiter lock for all slices:
+		waiting again per slice would lose a notify() that lands between a
+		slice timing out and the lock being taken back.  The caller's lock is
+		released while waiting and the clock's is never held.
+		"""
+		if cond is self._cond:
+			return _conditionWait(cond, timeout)
+		me = threading.current_thread()
+		wake = INFINITY if timeout is None else self.now + max(timeout, 0)
+		waiters = self._waiting.setdefault(cond, set())
+		self._participants.add(me)
+		waiter = _thread.allocate_lock()
+		waiter.acquire()
+		cond._waiters.append(waiter)
+		saved = cond._release_save()
+		notified = False
+		try:
+			while True:
+				waiters.add(me)
+				self._sleepers[me] = wake
+				self._poke()
+				if waiter.acquire(True, self.slice):
+					notified = True
+					break
+				if self.now >= wake:
+					break
+				self._checkEnd()
+		finally:
+			cond._acquire_restore(saved)
+			if not notified:
+				# a notify() racing the timeout still counts
+				notified = waiter.acquire(False)
+				if not notified:
+					try:
+						cond._waiters.remove(waiter)
+					except ValueError:
+						pass
+			waiters.discard(me)
+			self._sleepers.pop(me, None)
+			self._poke()
+		return notified
+
+	def notify(self, cond, n = 1):
+		"Condition.notify(): the waiters are runnable again as of now"
+		if cond is not self._cond:
+			waiters = self._waiting.get(cond)
+			if waiters:
+				for thread in list(waiters):
+					self._sleepers.pop(thread, None)
+				self._woken = True
+		_conditionNotify(cond, n)
+
+	def _poke(self):
+		# never block on the clock while holding somebody else's lock
+		if self._cond.acquire(False):
+			try:
+				self._cond.notify_all()
+			finally:
+				self._cond.release()
+
+	def _tick(self):
+		with self._cond:
+			before = self.now
+			since = _realTime()
+			while self._ticking:
+				self._cond.wait(self.grace)
+				if self.now != before:
+					before = self.now
+					since = _realTime()
+					continue
+				if _realTime() - since < self.grace:
+					continue
+				# stalled for grace seconds of real time
+				since = _realTime()
+				target = self._next()
+				if target is not None and target <= self.now:
+					continue
+				if target is None or (target > self.now + self.grace and not self._idle()):
+					# somebody computes without looking at the clock, or nothing
+					# is pending at all: time passes at real speed
+					target = self.now + self.grace
+				if self.end is not None and target >= self.end:
+					self._advance(self.end)
+					self.end = None
+					signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+				else:
+					self._advance(target, True)
+
+	def start(self):
+		"Starts the real-time thread that unsticks the clock"
+		self._ticking = True
+		self._ticker = threading.Thread(target=self._tick)
+		self._ticker.daemon = True
+		self._ticker.start()
+
+	def stop(self):
+		with self._cond:
+			self._ticking = False
+			self._cond.notify_all()
+		if self._ticker is not None:
+			self._ticker.join()
+			self._ticker = None
+
+# ============================================================================
+# Track and world
+# ============================================================================
+class Track(object):
+
+	def __init__(self, points, closed = True, width = 1.8, obstacles = None, cell = 8.0):
+		self.points = points
+		self.closed = closed
+		self.width = width
+		self.obstacles = obstacles or []
+		pairs = list(zip(points, points[1:] + (points[:1] if closed else [])))
+		self.segments = []
+		self.length = 0.0
+		for (x0, y0), (x1, y1) in pairs:
+			dx, dy = x1 - x0, y1 - y0
+			l2 = dx*dx + dy*dy
+			if l2 == 0:
+				continue
+			self.segments.append((x0, y0, dx, dy, l2, self.length))
+			self.length += math.sqrt(l2)
+		# grid of cell x cell squares, each listing the segments whose
+		# bounding box grown by one cell reaches it: every segment closer
+		# than cell to a point of the square is in its list
+		self.cell = cell
+		self.cells = {}
+		for segment in self.segments:
+			x0, y0, dx, dy = segment[:4]
+			for ix in range(int(math.floor(min(x0, x0 + dx)/cell)) - 1, int(math.floor(max(x0, x0 + dx)/cell)) + 2):
+				for iy in range(int(math.floor(min(y0, y0 + dy)/cell)) - 1, int(math.floor(max(y0, y0 + dy)/cell)) + 2):
+					self.cells.setdefault((ix, iy), []).append(segment)
+
+	def nearest(self, x, y):
+		"(distance to the centre line, arc length of the nearest point)"
+		cell = self.cell
+		segments = self.cells.get((int(math.floor(x/cell)), int(math.floor(y/cell))))
+		if segments is not None:
+			result = self._nearest(x, y, segments)
+			if result[0] <= cell:
+				return result
+		return self._nearest(x, y, self.segments)
+
+	def _nearest(self, x, y, segments):
+		best = None
+		along = 0.0
+		for x0, y0, dx, dy, l2, start in segments:
+			u = ((x - x0)*dx + (y - y0)*dy) / l2
+			u = 0.0 if u < 0 else (1.0 if u > 1 else u)
+			ex = x0 + u*dx - x
+			ey = y0 + u*dy - y
+			d = ex*ex + ey*ey
+			if best is None or d < best:
+				best = d
+				along = start + u*math.sqrt(l2)
+		return math.sqrt(best), along
+
+	def distance(self, x, y):
+		return self.nearest(x, y)[0]
+
+	def start(self):
+		"Pose (x, y, heading) at the start of the line, facing along it"
+		x0, y0, dx, dy, l2, s = self.segments[0]
+		return x0, y0, math.atan2(dy, dx)
+
+	@classmethod
+	def oval(cls, straight = 100.0, radius = 40.0, step = 5.0, **kw):
+		points = []
+		n = max(8, int(math.pi*radius/step))
+		for i in range(0, int(straight/step)):
+			points.append((i*step, 0.0))
+		for i in range(0, n):
+			a = -math.pi/2 + math.pi*i/n
+			points.append((straight + radius*math.cos(a), radius + radius*math.sin(a)))
+		for i in range(0, int(straight/step)):
+			points.append((straight - i*step, 2*radius))
+		for i in range(0, n):
+			a = math.pi/2 + math.pi*i/n
+			points.append((radius*math.cos(a), radius + radius*math.sin(a)))
+		return cls(points, True, **kw)
+
+	@classmethod
+	def circle(cls, radius = 50.0, step = 4.0, **kw):
+		n = max(12, int(2*math.pi*radius/step))
+		return cls([(radius*math.sin(2*math.pi*i/n), radius - radius*math.cos(2*math.pi*i/n)) for i in range(0, n)], True, **kw)
+
+	@classmethod
+	def wave(cls, length = 300.0, amplitude = 20.0, wavelength = 80.0, step = 3.0, **kw):
+		return cls([(x, amplitude*math.sin(2*math.pi*x/wavelength)) for x in frange(0, length, step)], False, **kw)
+
+	@classmethod
+	def zigzag(cls, length = 240.0, amplitude = 15.0, pitch = 40.0, **kw):
+		points = [(x, amplitude if (i % 2) else -amplitude) for i, x in enumerate(frange(0, length, pitch/2))]
+		points[0] = (0.0, 0.0)
+		return cls(points, False, **kw)
+
+def frange(start, stop, step):
+	values = []
+	x = start
+	while x <= stop:
+		values.append(x)
+		x += step
+	return values
+
+TRACKS = {
+	'oval': Track.oval,
+	'circle': Track.circle,
+	'wave': Track.wave,
+	'zigzag': Track.zigzag,
+}
+
+"""
+Differential-drive AlphaBot2.  Channel A (ENA, AIN1/AIN2) is the left
+wheel and B the right one, which is what AlphaBot2.left()/right() imply;
+IN1 low / IN2 high turns a wheel forward.  Units are cm, s and radians.
+"""
+class Robot(object):
+
+	def __init__(self, track, maxSpeed = 50.0, wheelBase = 9.5, sensorOffset = 7.0,
+			sensorSpacing = 1.6, white = 880, black = 60, noise = 4, seed = 1):
+		self.track = track
+		self.maxSpeed = maxSpeed
+		self.wheelBase = wheelBase
+		self.sensorOffset = sensorOffset
+		self.sensorSpacing = sensorSpacing
+		self.white = white
+		self.black = black
+		self.noise = noise
+		self.random = random.Random(seed)
+		self.x, self.y, self.theta = track.start()
+		self.vl = 0.0
+		self.vr = 0.0
+		self.t = 0.0
+		self.travelled = 0.0
+		self.errorSum = 0.0
+		self.errorMax = 0.0
+		self.errorTime = 0.0
+
+	def integrate(self, t):
+		dt = t - self.t
+		if dt <= 0:
+			return
+		v = (self.vl + self.vr) / 2
+		w = (self.vr - self.vl) / self.wheelBase
+		if abs(w) < 1e-9:
+			self.x += v*dt*math.cos(self.theta)
+			self.y += v*dt*math.sin(self.theta)
+		else:
+			r = v / w
+			theta = self.theta + w*dt
+			self.x += r*(math.sin(theta) - math.sin(self.theta))
+			self.y -= r*(math.cos(theta) - math.cos(self.theta))
+			self.theta = theta
+		self.travelled += abs(v)*dt
+		error = self.track.distance(self.x, self.y)
+		self.errorSum += error*dt
+		self.errorTime += dt
+		self.errorMax = max(self.errorMax, error)
+		self.t = t
+
+	def setWheels(self, t, left, right):
+		"left/right in -1..1 of full speed"
+		self.integrate(t)
+		self.vl = left*self.maxSpeed
+		self.vr = right*self.maxSpeed
+
+	def sensor(self, i, n = 5):
+		"Raw 10-bit reading of line sensor i (0 = leftmost); the line reads low"
+		c, s = math.cos(self.theta), math.sin(self.theta)
+		lateral = ((n - 1)/2.0 - i)*self.sensorSpacing
+		x = self.x + self.sensorOffset*c - lateral*s
+		y = self.y + self.sensorOffset*s + lateral*c
+		d = self.track.distance(x, y) / (self.track.width/2)
+		value = self.white + (self.black - self.white)*math.exp(-d*d*d*d)
+		value += self.random.gauss(0, self.noise)
+		return int(max(0, min(1023, value)))
+
+	def ray(self, angle, maxRange):
+		"Distance to the nearest obstacle along heading+angle"
+		a = self.theta + angle
+		dx, dy = math.cos(a), math.sin(a)
+		best = maxRange
+		for ox, oy, r in self.track.obstacles:
+			fx, fy = ox - self.x, oy - self.y
+			along = fx*dx + fy*dy
+			if along <= 0:
+				continue
+			across2 = fx*fx + fy*fy - along*along
+			if across2 > r*r:
+				continue
+			best = min(best, along - math.sqrt(r*r - across2))
+		return best
+
+	def meanError(self):
+		return self.errorSum / self.errorTime if self.errorTime else 0.0
+
+# ============================================================================
+# RPi.GPIO
+# ============================================================================
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+class SimGPIO(object):
+
+	def __init__(self, clock):
+		self.clock = clock
+		self.levels = {}
+		self.modes = {}
+		self.duty = {}
+		self.providers = {}
+		self.watchers = {}
+		self.callbacks = {}
+		self.ops = 0
+
+	def module(self):
+		"An RPi.GPIO look-alike module bound to this instance"
+		mod = types.ModuleType('RPi.GPIO')
+		for name in ('BCM', 'BOARD', 'OUT', 'IN', 'HIGH', 'LOW', 'PUD_OFF', 'PUD_DOWN',
+				'PUD_UP', 'RISING', 'FALLING', 'BOTH'):
+			setattr(mod, name, globals()[name])
+		for name in ('setmode', 'setwarnings', 'setup', 'output', 'input', 'cleanup',
+				'add_event_detect', 'remove_event_detect', 'event_detected'):
+			setattr(mod, name, getattr(self, name))
+		gpio = self
+		class PWM(object):
+			def __init__(self, pin, frequency):
+				self.pin = pin
+				self.frequency = frequency
+			def start(self, duty):
+				gpio.setDuty(self.pin, duty)
+			def ChangeDutyCycle(self, duty):
+				gpio.setDuty(self.pin, duty)
+			def ChangeFrequency(self, frequency):
+				self.frequency = frequency
+			def stop(self):
+				gpio.setDuty(self.pin, 0)
+		mod.PWM = PWM
+		mod.RPI_INFO = {'P1_REVISION': 3, 'TYPE': 'Simulated'}
+		mod.VERSION = 'sim'
+		return mod
+
+	def setmode(self, mode):
+		pass
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, pin, mode, pull_up_down = PUD_OFF, initial = None):
+		self.modes[pin] = mode
+		if mode == OUT:
+			self.levels[pin] = initial or 0
+		elif pin not in self.levels:
+			self.levels[pin] = 1 if pull_up_down == PUD_UP else 0
+
+	def output(self, pin, value):
+		self.ops += 1
+		self.clock.spend()
+		value = 1 if value else 0
+		old = self.levels.get(pin, 0)
+		self.levels[pin] = value
+		for watcher in self.watchers.get(pin, ()):
+			watcher(pin, old, value)
+
+	def input(self, pin):
+		self.ops += 1
+		self.clock.spend()
+		provider = self.providers.get(pin)
+		if provider is not None:
+			return provider()
+		return self.levels.get(pin, 0)
+
+	def drive(self, pin, value):
+		"An external signal changes an input pin, firing edge callbacks"
+		value = 1 if value else 0
+		old = self.levels.get(pin, 0)
+		self.levels[pin] = value
+		detect = self.callbacks.get(pin)
+		if detect is None or old == value:
+			return
+		edge, callback = detect
+		if edge == BOTH or (edge == RISING and value) or (edge == FALLING and not value):
+			if callback is not None:
+				callback(pin)
+
+	def setDuty(self, pin, duty):
+		self.ops += 1
+		self.clock.spend()
+		for watcher in self.watchers.get(pin, ()):
+			watcher(pin, self.duty.get(pin, 0), duty)
+		self.duty[pin] = duty
+
+	def watch(self, pin, watcher):
+		self.watchers.setdefault(pin, []).append(watcher)
+
+	def add_event_detect(self, pin, edge, callback = None, bouncetime = None):
+		self.callbacks[pin] = (edge, callback)
+
+	def remove_event_detect(self, pin):
+		self.callbacks.pop(pin, None)
+
+	def event_detected(self, pin):
+		return False
+
+	def cleanup(self, pins = None):
+		self.callbacks.clear()
+
+# ============================================================================
+# Device models
+# ============================================================================
+class TLC1543Model(object):
+	"The ADC behind TRSensor: CS 5, Clock 25, Address 24, DataOut 23"
+
+	def __init__(self, gpio, robot, cs = 5, clock = 25, address = 24, dataout = 23):
+		self.gpio = gpio
+		self.robot = robot
+		self.ADDRESS = address
+		self.result = 0
+		self.shift = 0
+		self.count = 0
+		self.addr = 0
+		self.selected = False
+		self.conversions = 0
+		gpio.watch(cs, self._cs)
+		gpio.watch(clock, self._clock)
+		gpio.providers[dataout] = self._dataout
+
+	def _cs(self, pin, old, value):
+		if not value and old:
+			self.selected = True
+			self.shift = self.result
+			self.count = 0
+			self.addr = 0
+		elif value:
+			self.selected = False
+
+	def _clock(self, pin, old, value):
+		if not self.selected or old == value:
+			return
+		if value:
+			if self.count < 4:
+				self.addr = (self.addr << 1) | self.gpio.levels.get(self.ADDRESS, 0)
+		else:
+			self.count += 1
+			if self.count == 10:
+				self.conversions += 1
+				self.result = self.convert(self.addr)
+
+	def convert(self, channel):
+		robot = self.robot
+		robot.integrate(self.gpio.clock.now)
+		if channel < 5:
+			return robot.sensor(channel)
+		return 512
+
+	def _dataout(self):
+		if not self.selected:
+			return 1
+		if self.count >= 10:
+			return 0
+		return (self.shift >> (9 - self.count)) & 0x01
+
+class UltrasonicModel(object):
+	"HC-SR04 on TRIG 22 / ECHO 27, looking straight ahead"
+
+	def __init__(self, gpio, robot, trig = 22, echo = 27, maxRange = 400.0):
+		self.gpio = gpio
+		self.robot = robot
+		self.ECHO = echo
+		self.maxRange = maxRange
+		self.pings = 0
+		gpio.watch(trig, self._trig)
+
+	def _trig(self, pin, old, value):
+		if old and not value:
+			clock = self.gpio.clock
+			self.robot.integrate(clock.now)
+			self.pings += 1
+			distance = self.robot.ray(0.0, self.maxRange)
+			# the module answers after ~0.5ms, 38ms pulse when nothing is seen
+			width = 2*distance/SPEED_OF_SOUND if distance < self.maxRange else 0.038
+			rise = clock.now + 0.0005
+			clock.schedule(rise, lambda: self.gpio.drive(self.ECHO, 1))
+			clock.schedule(rise + width, lambda: self.gpio.drive(self.ECHO, 0))
+
+class ObstacleModel(object):
+	"IR obstacle sensors DR 16 / DL 19, active low, re-checked every period seconds"
+
+	def __init__(self, gpio, robot, dr = 16, dl = 19, reach = 15.0, angle = 0.2, period = 0.005):
+		self.gpio = gpio
+		self.robot = robot
+		self.sensors = ((dr, -angle), (dl, angle))
+		self.reach = reach
+		self.period = period
+		for pin, angle in self.sensors:
+			gpio.levels[pin] = 1
+		if robot.track.obstacles:
+			gpio.clock.schedule(period, self._check)
+
+	def _check(self):
+		clock = self.gpio.clock
+		self.robot.integrate(clock.now)
+		for pin, angle in self.sensors:
+			seen = self.robot.ray(angle, self.reach + 1) <= self.reach
+			self.gpio.drive(pin, 0 if seen else 1)
+		clock.schedule(clock.now + self.period, self._check)
+
+class MotorModel(object):
+	"Turns ENA/ENB duty cycles and direction pins into wheel speeds"
+
+	def __init__(self, gpio, robot, ain1 = 12, ain2 = 13, ena = 6, bin1 = 20, bin2 = 21, enb = 26):
+		self.gpio = gpio
+		self.robot = robot
+		self.pins = (ain1, ain2, ena, bin1, bin2, enb)
+		for pin in self.pins:
+			gpio.watch(pin, self._changed)
+
+	def _wheel(self, in1, in2, en):
+		levels = self.gpio.levels
+		direction = (1 if levels.get(in2, 0) else 0) - (1 if levels.get(in1, 0) else 0)
+		return direction * self.gpio.duty.get(en, 0) / 100.0
+
+	def _changed(self, pin, old, value):
+		if old == value:
+			return
+		# pin levels/duty are updated after the watchers run
+		gpio = self.gpio
+		if pin in (self.pins[2], self.pins[5]):
+			saved = gpio.duty.get(pin, 0)
+			gpio.duty[pin] = value
+		else:
+			saved = gpio.levels.get(pin, 0)
+			gpio.levels[pin] = value
+		ain1, ain2, ena, bin1, bin2, enb = self.pins
+		self.robot.setWheels(gpio.clock.now, self._wheel(ain1, ain2, ena), self._wheel(bin1, bin2, enb))
+		if pin in (ena, enb):
+			gpio.duty[pin] = saved
+		else:
+			gpio.levels[pin] = saved
+
+# ============================================================================
+# rpi_ws281x
+# ============================================================================
+def Color(red, green, blue, white = 0):
+	return (white << 24) | (red << 16) | (green << 8) | blue
+
+class SimNeoPixel(object):
+
+	def __init__(self, num, pin, freq_hz = 800000, dma = 10, invert = False, brightness = 255, channel = 0, strip_type = None, gamma = None):
+		self.pixels = [0]*num
+		self.brightness = brightness
+		self.shows = 0
+
+	def begin(self):
+		pass
+
+	def show(self):
+		self.shows += 1
+
+	def setPixelColor(self, n, color):
+		self.pixels[n] = color
+
+	def setPixelColorRGB(self, n, red, green, blue, white = 0):
+		self.pixels[n] = Color(red, green, blue, white)
+
+	def getPixelColor(self, n):
+		return self.pixels[n]
+
+	def getPixels(self):
+		return self.pixels
+
+	def setBrightness(self, brightness):
+		self.brightness = brightness
+
+	def getBrightness(self):
+		return self.brightness
+
+	def numPixels(self):
+		return len(self.pixels)
+
+# ============================================================================
+# Putting it together
+# ============================================================================
+"""
+One simulated robot: clock, track, GPIO with the device models behind it,
+an I2C bus for the PCA9685 and the LED strips the script creates.  Extra
+keyword arguments go to Robot (maxSpeed, wheelBase, noise, ...).
+"""
+class Simulation(object):
+
+	def __init__(self, track = None, opCost = 1e-6, grace = 0.002, seed = 1, **robot):
+		self.clock = VirtualClock(opCost, grace)
+		self.track = track if track is not None else Track.oval()
+		self.robot = Robot(self.track, seed = seed, **robot)
+		self.gpio = SimGPIO(self.clock)
+		self.adc = TLC1543Model(self.gpio, self.robot)
+		self.ultrasonic = UltrasonicModel(self.gpio, self.robot)
+		self.obstacles = ObstacleModel(self.gpio, self.robot)
+		self.motors = MotorModel(self.gpio, self.robot)
+		self.bus = FakeSMBus.SMBus(1)
+		# the IR receiver output idles high
+		self.gpio.levels[17] = 1
+		self.strips = []
+		self._saved = None
+
+	def install(self):
+		"Swaps the hardware modules and the time functions for the simulated ones"
+		clock = self.clock
+		bus = self.bus
+		gpio = self.gpio.module()
+		rpi = types.ModuleType('RPi')
+		rpi.GPIO = gpio
+		smbus = types.ModuleType('smbus')
+		smbus.SMBus = lambda number = 1: bus
+		ws = types.ModuleType('rpi_ws281x')
+		ws.Color = Color
+		strips = self.strips
+		def strip(*args, **kw):
+			strips.append(SimNeoPixel(*args, **kw))
+			return strips[-1]
+		ws.Adafruit_NeoPixel = strip
+		ws.PixelStrip = strip
+		names = ('time', 'monotonic', 'perf_counter', 'sleep', 'time_ns', 'monotonic_ns', 'perf_counter_ns')
+		self._saved = (dict((n, sys.modules.get(n)) for n in ('RPi', 'RPi.GPIO', 'smbus', 'rpi_ws281x')),
+			dict((n, getattr(time, n)) for n in names))
+		sys.modules.update({'RPi': rpi, 'RPi.GPIO': gpio, 'smbus': smbus, 'rpi_ws281x': ws})
+		epoch = clock.epoch
+		time.time = lambda: epoch + clock.read()
+		time.monotonic = clock.read
+		time.perf_counter = clock.read
+		time.sleep = clock.sleep
+		time.time_ns = lambda: int((epoch + clock.read())*1e9)
+		time.monotonic_ns = lambda: int(clock.read()*1e9)
+		time.perf_counter_ns = time.monotonic_ns
+		threading.Condition.wait = lambda cond, timeout = None: clock.wait(cond, timeout)
+		threading.Condition.notify = lambda cond, n = 1: clock.notify(cond, n)
+		# queue.Queue.get(timeout=) measures its deadline itself
+		queue.time = clock.read
+		clock.start()
+		return self
+
+	def uninstall(self):
+		if self._saved is None:
+			return
+		self.clock.stop()
+		modules, functions = self._saved
+		for name, module in modules.items():
+			if module is None:
+				sys.modules.pop(name, None)
+			else:
+				sys.modules[name] = module
+		for name, function in functions.items():
+			setattr(time, name, function)
+		threading.Condition.wait = _conditionWait
+		threading.Condition.notify = _conditionNotify
+		queue.time = functions['monotonic']
+		self._saved = None
+
+	def press(self, pin, at, duration = 0.5):
+		"Pulls an active-low input (button, joystick) low for duration seconds"
+		self.clock.schedule(at, lambda: self.gpio.drive(pin, 0))
+		self.clock.schedule(at + duration, lambda: self.gpio.drive(pin, 1))
+
+	def irKey(self, command, at, address = 0x00, repeats = 0):
+		"Sends an NEC frame (and repeat codes) on the IR receiver pin 17; needs install()"
+		from IRDecoder import necFrame
+		edges = necFrame(address, command, int(at*1e9))
+		for r in range(0, repeats):
+			edges += necFrame(address, command, int((at + 0.108*(r + 1))*1e9), True)
+		level = 0
+		for t in edges:
+			self.clock.schedule(t/1e9, (lambda v: lambda: self.gpio.drive(17, v))(level))
+			level ^= 1
+
+	def run(self, path, duration = None, args = ()):
+		"Runs a script as __main__ with args until it exits or duration virtual seconds pass"
+		if duration is not None:
+			self.clock.end = self.clock.now + duration
+		directory = os.path.dirname(os.path.abspath(path))
+		if directory not in sys.path:
+			sys.path.insert(0, directory)
+		argv = sys.argv
+		sys.argv = [path] + list(args)
+		try:
+			runpy.run_path(path, run_name = '__main__')
+		except (KeyboardInterrupt, SystemExit):
+			pass
+		finally:
+			sys.argv = argv
+		self.robot.integrate(self.clock.now)
+
+	def report(self):
+		robot = self.robot
+		distance, along = self.track.nearest(robot.x, robot.y)
+		return {
+			'time': round(self.clock.now, 3),
+			'pose': (round(robot.x, 1), round(robot.y, 1), round(math.degrees(robot.theta) % 360, 1)),
+			'travelled_cm': round(robot.travelled, 1),
+			'line_error_mean_cm': round(robot.meanError(), 2),
+			'line_error_max_cm': round(robot.errorMax, 2),
+			'gpio_ops': self.gpio.ops,
+			'adc_conversions': self.adc.conversions,
+			'pings': self.ultrasonic.pings,
+			'i2c_transactions': self.bus.transactions,
+			'led_shows': sum(s.shows for s in self.strips),
+		}
+
+def arguments(argv):
+	"The simulator's options and the script's own arguments, the ones after --"
+	import argparse
+	scriptArgs = []
+	if '--' in argv:
+		i = argv.index('--')
+		argv, scriptArgs = argv[:i], argv[i + 1:]
+	parser = argparse.ArgumentParser(description = 'Run an AlphaBot2 script against simulated hardware',
+		epilog = 'arguments after -- are passed on to the script')
+	parser.add_argument('script')
+	parser.add_argument('--duration', type = float, default = 20.0, help = 'virtual seconds')
+	parser.add_argument('--track', choices = sorted(TRACKS), default = 'oval')
+	parser.add_argument('--noise', type = float, default = 4.0, help = 'line sensor noise, LSB rms')
+	parser.add_argument('--obstacle', action = 'append', default = [], metavar = 'X,Y,R',
+		help = 'round obstacle in cm, can be repeated')
+	parser.add_argument('--press', action = 'append', default = [], metavar = 'PIN@T',
+		help = 'press an active-low input at virtual time T')
+	parser.add_argument('--ir', action = 'append', default = [], metavar = 'CODE@T',
+		help = 'send an NEC key (e.g. 0x18) at virtual time T')
+	return parser.parse_args(argv), scriptArgs
+
+if __name__ == '__main__':
+	# the command lines in the docstring mean what it says
+	args, scriptArgs = arguments(['Line_Follow.py', '--duration', '30', '--press', '7@3'])
+	assert (args.script, args.duration, args.press, scriptArgs) == ('Line_Follow.py', 30.0, ['7@3'], [])
+	args, scriptArgs = arguments(['Line_Follow.py', '--duration', '30', '--press', '7@3', '--', '--trace'])
+	assert (args.duration, args.press, scriptArgs) == (30.0, ['7@3'], ['--trace'])
+
+	args, scriptArgs = arguments(sys.argv[1:])
+	obstacles = [tuple(float(v) for v in o.split(',')) for o in args.obstacle]
+	sim = Simulation(TRACKS[args.track](obstacles = obstacles), noise = args.noise)
+	real = time.perf_counter
+	sim.install()
+	for press in args.press:
+		pin, at = press.split('@')
+		sim.press(int(pin), float(at))
+	for key in args.ir:
+		code, at = key.split('@')
+		sim.irKey(int(code, 0), float(at))
+	started = real()
+	sim.run(args.script, args.duration, scriptArgs)
+	elapsed = real() - started
+	sim.uninstall()
+	report = sim.report()
+	report['real_seconds'] = round(elapsed, 2)
+	for name in sorted(report):
+		print('%-20s %s' % (name, report[name]))
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import time
+import GPIOBackend
+from GPIOBackend import HIGH, LOW
+
+CS = 5
+Clock = 25
+Address = 24
+DataOut = 23
+
+# Worst case conversion time from the TLC1543 datasheet is 21us.
+CONVERSION_TIME = 0.000021
+
+# A queued conversion is used up to this many read periods old, so a late
+# wake-up of the reader does not cost the extra cycle the pipeline saves.
+MAX_AGE_PERIODS = 3
+# maxAge when the read period is not known: 3 periods of a 200Hz loop
+MAX_AGE = 0.015
+
+"""
+Pipelined read engine for the TLC1543 10-bit ADC used by the line sensors.
+
+The TLC1543 returns the result of the previous conversion while the address
+of the next one is being clocked in.  TRSensor.AnalogRead throws that away
+and pays for an extra I/O cycle on every call; these readers keep the
+pipeline full instead, so reading N channels costs N cycles, not N+1.
+
+Two backends share the same read() interface:
+  TLC1543     bit-banged over GPIOBackend.py, 10 clocks per cycle
+  TLC1543SPI  spidev, one 16-bit frame per transfer (needs the ADC on a
+              SPI controller, e.g. a spi-gpio overlay on the pins above)
+
+A reader must own the ADC: it trusts that the conversion it queued last
+is still the one waiting.  Anything else that clocks the chip, such as
+TRSensor.AnalogRead on a TRSensor built with adc=None or another reader
+on the same pins, silently turns the first value of the next read() into
+some other channel.  Call invalidate() after such an access.
+"""
+class TLC1543(object):
+
+	def __init__(self, cs=CS, clock=Clock, address=Address, dataout=DataOut, maxAge=MAX_AGE, gpio=None):
+		self.CS = cs
+		self.CLOCK = clock
+		self.ADDRESS = address
+		self.DATAOUT = dataout
+		# A queued conversion older than this is thrown away and redone,
+		# so the first channel of a read is never staler than maxAge.
+		# TRSensor.startSampler() sets it from its rate.
+		self.maxAge = maxAge
+		self.pending = None
+		self.pendingTime = 0.0
+		self.cycles = 0
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.gpio.setup((self.CS,self.CLOCK,self.ADDRESS),GPIOBackend.OUT)
+		self.gpio.setup(self.DATAOUT,GPIOBackend.IN,GPIOBackend.PUD_UP)
+
+	def cycle(self, channel):
+		"Clocks in the next channel address and returns the previous conversion"
+		output = self.gpio.output
+		input = self.gpio.input
+		clock = self.CLOCK
+		address = self.ADDRESS
+		dataout = self.DATAOUT
+		value = 0
+		output(self.CS, LOW)
+		# 4 address bits MSB first, the data MSB is already on DataOut
+		for i in range(3, -1, -1):
+			output(address, (channel >> i) & 0x01)
+			value = (value << 1) | input(dataout)
+			output(clock, HIGH)
+			output(clock, LOW)
+		output(address, LOW)
+		for i in range(0, 6):
+			value = (value << 1) | input(dataout)
+			output(clock, HIGH)
+			output(clock, LOW)
+		output(self.CS, HIGH)
+		# Conversion starts on the 10th falling edge; wait it out without
+		# relying on time.sleep(), which cannot sleep for 21us.
+		start = time.perf_counter()
+		while time.perf_counter() - start < CONVERSION_TIME:
+			pass
+		self.cycles += 1
+		return value
+
+	def read(self, channels):
+		"Reads the given channels, keeping the pipeline primed for the next call"
+		n = len(channels)
+		if (self.pending != channels[0]) or (time.perf_counter() - self.pendingTime > self.maxAge):
+			self.cycle(channels[0])
+		value = [0]*n
+		for i in range(0, n - 1):
+			value[i] = self.cycle(channels[i + 1])
+		# The last cycle queues the first channel of the next read.
+		value[n - 1] = self.cycle(channels[0])
+		self.pending = channels[0]
+		self.pendingTime = time.perf_counter()
+		return value
+
+	def invalidate(self):
+		"Forgets the queued conversion; the next read() primes the pipeline again"
+		self.pending = None
+
+class TLC1543SPI(object):
+
+	def __init__(self, bus=0, device=0, speed=2000000, maxAge=MAX_AGE):
+		import spidev
+		self.spi = spidev.SpiDev()
+		self.spi.open(bus, device)
+		self.spi.mode = 0
+		# The TLC1543 I/O clock is specified up to 2.1MHz.
+		self.spi.max_speed_hz = speed
+		self.maxAge = maxAge
+		self.pending = None
+		self.pendingTime = 0.0
+		self.cycles = 0
+
+	def cycle(self, channel):
+		"One 16-clock frame: address in the top nibble, 10-bit result in the top bits"
+		rx = self.spi.xfer2([channel << 4, 0])
+		start = time.perf_counter()
+		while time.perf_counter() - start < CONVERSION_TIME:
+			pass
+		self.cycles += 1
+		return ((rx[0] << 8) | rx[1]) >> 6
+
+	def read(self, channels):
+		n = len(channels)
+		if (self.pending != channels[0]) or (time.perf_counter() - self.pendingTime > self.maxAge):
+			self.cycle(channels[0])
+		value = [0]*n
+		for i in range(0, n - 1):
+			value[i] = self.cycle(channels[i + 1])
+		value[n - 1] = self.cycle(channels[0])
+		self.pending = channels[0]
+		self.pendingTime = time.perf_counter()
+		return value
+
+	def invalidate(self):
+		self.pending = None
+
+	def close(self):
+		self.spi.close()
+
+# Regression check against the original bit-banged TRSensor.AnalogRead,
+# which TLC1543.read must match exactly:
+#
+#	python3 Simulator.py TLC1543.py --noise 0
+#
+# On a robot kept still over a fixed surface, python3 TLC1543.py N allows N
+# LSB of sensor noise instead.
+if __name__ == '__main__':
+	import sys
+	from TRSensors import TRSensor
+	tolerance = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+	TR = TRSensor()
+	adc = TLC1543()
+	channels = list(range(0, TR.numSensors))
+	# CS comes out of setup low, so the chip misses the first select
+	TR.AnalogRead()
+	worst = 0
+	for n in range(0, 200):
+		legacy = TR.AnalogRead()
+		# AnalogRead clocked the ADC and left its own channel queued
+		adc.invalidate()
+		fast = adc.read(channels)
+		worst = max(worst, max([abs(a - b) for a, b in zip(legacy, fast)]))
+	print("TLC1543 max difference vs AnalogRead: %d LSB" % worst)
+	assert worst <= tolerance, "TLC1543.read disagrees with AnalogRead by %d LSB" % worst
+	start = time.perf_counter()
+	for n in range(0, 1000):
+		TR.AnalogRead()
+	legacyTime = (time.perf_counter() - start) / 1000
+	start = time.perf_counter()
+	for n in range(0, 1000):
+		adc.read(channels)
+	fastTime = (time.perf_counter() - start) / 1000
+	print("AnalogRead %.1fus, TLC1543.read %.1fus" % (legacyTime * 1e6, fastTime * 1e6))
+	adc.gpio.cleanup()
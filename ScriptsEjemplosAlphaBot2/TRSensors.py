@@ -1,7 +1,13 @@
 #!/usr/bin/python
 # -*- coding:utf-8 -*-
-import RPi.GPIO as GPIO
 import time
+import GPIOBackend
+from GPIOBackend import HIGH, LOW
+import threading
+from LineCalibration import LineCalibration
+from RingBuffer import FrameRing
+from CalibrationStore import CalibrationStore
+from TLC1543 import MAX_AGE_PERIODS
 
 CS = 5
 Clock = 25
@@ -10,18 +16,28 @@ DataOut = 23
 Button = 7
 
 class TRSensor(object):
-	def __init__(self,numSensors = 5):
+	def __init__(self,numSensors = 5,adc = None,gpio = None):
 		self.numSensors = numSensors
+		# Optional pipelined reader from TLC1543.py (TLC1543 or TLC1543SPI);
+		# None keeps the original bit-banged AnalogRead below.
+		self.adc = adc
+		self.channels = list(range(0,self.numSensors))
 		self.calibratedMin = [0] * self.numSensors
 		self.calibratedMax = [1023] * self.numSensors
 		self.last_value = 0
-		GPIO.setmode(GPIO.BCM)
-		GPIO.setwarnings(False)
-		GPIO.setup(Clock,GPIO.OUT)
-		GPIO.setup(Address,GPIO.OUT)
-		GPIO.setup(CS,GPIO.OUT)
-		GPIO.setup(DataOut,GPIO.IN,GPIO.PUD_UP)
-		GPIO.setup(Button,GPIO.IN,GPIO.PUD_UP)
+		self.last_raw = None
+		self.calibration = LineCalibration(self.numSensors,self.calibratedMin,self.calibratedMax)
+		self._rebuild = None
+		self._clock = time.perf_counter
+		self.samples = None
+		self._calibrations = []
+		self._sampler = None
+		self._sampling = False
+		# GPIOBackend.py, RPi.GPIO unless told otherwise
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.gpio.setup((CS,Clock,Address),GPIOBackend.OUT)
+		self.gpio.setup(DataOut,GPIOBackend.IN,GPIOBackend.PUD_UP)
+		self.gpio.setup(Button,GPIOBackend.IN,GPIOBackend.PUD_UP)
 		
 	"""
 	Reads the sensor values into an array. There *MUST* be space
@@ -34,38 +50,42 @@ class TRSensor(object):
 	surface or a void).
 	"""
 	def AnalogRead(self):
+		if self.adc is not None:
+			return self.adc.read(self.channels)
+		output = self.gpio.output
+		input = self.gpio.input
 		value = [0]*(self.numSensors+1)
 		#Read Channel0~channel6 AD value
 		for j in range(0,self.numSensors+1):
-			GPIO.output(CS, GPIO.LOW)
+			output(CS, LOW)
 			for i in range(0,8):
 				#sent 8-bit Address
 				if i<4:
 					if(((j) >> (3 - i)) & 0x01):
-						GPIO.output(Address,GPIO.HIGH)
+						output(Address,HIGH)
 					else:
-						GPIO.output(Address,GPIO.LOW)
+						output(Address,LOW)
 				else:
-					GPIO.output(Address,GPIO.LOW)		
+					output(Address,LOW)		
 				#read MSB 4-bit data
 				value[j] <<= 1
-				if(GPIO.input(DataOut)):
+				if(input(DataOut)):
 					value[j] |= 0x01
-				GPIO.output(Clock,GPIO.HIGH)
-				GPIO.output(Clock,GPIO.LOW)
+				output(Clock,HIGH)
+				output(Clock,LOW)
 			for i in range(0,4):
 				#read LSB 8-bit data
 				value[j] <<= 1
-				if(GPIO.input(DataOut)):
+				if(input(DataOut)):
 					value[j] |= 0x01
-				GPIO.output(Clock,GPIO.HIGH)
-				GPIO.output(Clock,GPIO.LOW)
+				output(Clock,HIGH)
+				output(Clock,LOW)
 			#no mean ,just delay
 #			for i in range(0,6):
 #				GPIO.output(Clock,GPIO.HIGH)
 #				GPIO.output(Clock,GPIO.LOW)
 			time.sleep(0.0001)
-			GPIO.output(CS,GPIO.HIGH)
+			output(CS,HIGH)
 		for i in range(0,6):
 			value[i] >>= 2	
 #		print (value[1:])
@@ -78,28 +98,64 @@ class TRSensor(object):
 	and used for the readCalibrated() method.
 	"""
 	def calibrate(self):
-		max_sensor_values = [0]*self.numSensors
-		min_sensor_values = [0]*self.numSensors
-		for j in range(0,10):
-		
-			sensor_values = self.AnalogRead()
-			
-			for i in range(0,self.numSensors):
-			
-				# set the max we found THIS time
-				if((j == 0) or max_sensor_values[i] < sensor_values[i]):
-					max_sensor_values[i] = sensor_values[i]
-
-				# set the min we found THIS time
-				if((j == 0) or min_sensor_values[i] > sensor_values[i]):
-					min_sensor_values[i] = sensor_values[i]
+		samples = [self.AnalogRead() for j in range(0,10)]
+		# min/max we found THIS time, per sensor
+		min_sensor_values = list(map(min,zip(*samples)))
+		max_sensor_values = list(map(max,zip(*samples)))
 
 		# record the min and max calibration values
-		for i in range(0,self.numSensors):
-			if(min_sensor_values[i] > self.calibratedMin[i]):
-				self.calibratedMin[i] = min_sensor_values[i]
-			if(max_sensor_values[i] < self.calibratedMax[i]):
-				self.calibratedMax[i] = max_sensor_values[i]
+		self.calibratedMin[:] = map(max,min_sensor_values,self.calibratedMin)
+		self.calibratedMax[:] = map(min,max_sensor_values,self.calibratedMax)
+		self._rebuild = None
+		self.calibration.update(self.calibratedMin,self.calibratedMax)
+
+	"""
+	Loads the saved calibration for surface (see CalibrationStore.py) in
+	place of calibrate(); returns False when there is none for this robot.
+	"""
+	def loadCalibration(self, surface = 'default', store = None):
+		profile = (store or CalibrationStore()).load(surface)
+		if profile is None or len(profile[0]) != self.numSensors:
+			return False
+		self.calibratedMin[:],self.calibratedMax[:] = profile
+		self._rebuild = None
+		self._checkCalibration()
+		return True
+
+	def saveCalibration(self, surface = 'default', store = None):
+		(store or CalibrationStore()).save(self.calibratedMin,self.calibratedMax,surface)
+
+	"""
+	Moves the calibration to new bounds without stalling the thread that
+	reads: every _checkCalibration() builds a piece of the new tables, and
+	calibratedMin/Max and the tables change together once they are done.
+	Used by OnlineCalibrator from the sampler thread.
+	"""
+	def stageCalibration(self, calibratedMin, calibratedMax):
+		self._rebuild = self.calibration.rebuilding(calibratedMin,calibratedMax)
+
+	def finishCalibration(self):
+		"Completes a staged calibration at once"
+		while self._rebuild is not None:
+			self._checkCalibration()
+
+	# Rebuilds the lookup tables if calibratedMin/Max were changed by hand,
+	# or takes the next step of a staged calibration.
+	def _checkCalibration(self):
+		if self._rebuild is not None:
+			try:
+				next(self._rebuild)
+			except StopIteration as done:
+				self._rebuild = None
+				calibration = done.value
+				self.calibratedMin[:] = calibration.calibratedMin
+				self.calibratedMax[:] = calibration.calibratedMax
+				self.calibration = calibration
+				return True
+		if not self.calibration.matches(self.calibratedMin,self.calibratedMax):
+			self.calibration.update(self.calibratedMin,self.calibratedMax)
+			return True
+		return False
 
 	"""
 	Returns values calibrated to a value between 0 and 1000, where
@@ -109,26 +165,8 @@ class TRSensor(object):
 	sensors are accounted for automatically.
 	"""
 	def	readCalibrated(self):
-		value = 0
-		#read the needed values
-		sensor_values = self.AnalogRead()
-
-		for i in range (0,self.numSensors):
-
-			denominator = self.calibratedMax[i] - self.calibratedMin[i]
-
-			if(denominator != 0):
-				value = (sensor_values[i] - self.calibratedMin[i])* 1000 / denominator
-				
-			if(value < 0):
-				value = 0
-			elif(value > 1000):
-				value = 1000
-				
-			sensor_values[i] = value
-		
-		#print("readCalibrated",sensor_values)
-		return sensor_values
+		self._checkCalibration()
+		return self.calibration.calibrated(self.AnalogRead())
 			
 	"""
 	Operates the same as read calibrated, but also returns an
@@ -152,41 +190,125 @@ class TRSensor(object):
 	before the averaging.
 	"""
 	def readLine(self, white_line = 0):
-
-		sensor_values = self.readCalibrated()
-		avg = 0
-		sum = 0
-		on_line = 0
-		for i in range(0,self.numSensors):
-			value = sensor_values[i]
-			if(white_line):
-				value = 1000-value
-			# keep track of whether we see the line at all
-			if(value > 200):
-				on_line = 1
-				
-			# only average in values that are above a noise threshold
-			if(value > 50):
-				avg += value * (i * 1000);  # this is for the weighted total,
-				sum += value;                  #this is for the denominator 
-
-		if(on_line != 1):
-			# If it last read to the left of center, return 0.
-			if(self.last_value < (self.numSensors - 1)*1000/2):
-				#print("left")
-				self.last_value = 0
-	
-			# If it last read to the right of center, return the max.
-			else:
-				#print("right")
-				self.last_value = (self.numSensors - 1)*1000
-		else:
-			self.last_value = avg/sum
-		
+		self._checkCalibration()
+		self.last_raw = self.AnalogRead()
+		self.last_value,sensor_values = self.calibration.line(self.last_raw,white_line,self.last_value)
 		return self.last_value,sensor_values
 	
 
 
+	"""
+	Starts acquiring at a fixed rate on a background thread.  Every frame
+	(position, calibrated values and raw values) goes into a preallocated
+	ring buffer, so latest(), since() and average() never touch the GPIO.
+	Do not call AnalogRead/readLine/calibrate from other threads while the
+	sampler is running.  With Instruments every AnalogRead is timed into
+	their adc histogram; with an OnlineCalibrator every sample also feeds it,
+	so calibratedMin/Max follow the light while the robot drives.
+	background=False only sets up the ring: whoever owns the acquisition
+	thread (SensorScheduler.py) calls sample() itself.  clock timestamps
+	the frames, time.perf_counter unless given (PIDTuner.py's virtual time).
+	"""
+	def startSampler(self, rate = 500, capacity = 1024, white_line = 0, instruments = None, online = None,
+			background = True, clock = None):
+		if self._sampling:
+			return
+		self._clock = clock if clock is not None else time.perf_counter
+		if hasattr(self.adc, 'maxAge'):
+			# the pipelined readers keep their queued conversion across a
+			# late frame or two
+			self.adc.maxAge = MAX_AGE_PERIODS / rate
+		self.samples = FrameRing(1 + 2*self.numSensors, capacity)
+		self._frameValues = [0]*(1 + 2*self.numSensors)
+		self._calibrations = []
+		if online is not None:
+			online.reset()
+		self._sampling = True
+		if background:
+			self._sampler = threading.Thread(target=self._sample, args=(1.0/rate, white_line, instruments, online))
+			self._sampler.daemon = True
+			self._sampler.start()
+
+	def stopSampler(self):
+		self._sampling = False
+		if self._sampler is not None:
+			self._sampler.join()
+			self._sampler = None
+		# what the online calibration staged last, e.g. for saveCalibration()
+		self.finishCalibration()
+
+	def sample(self, white_line = 0, inst = None, online = None):
+		"Takes one frame into the ring started by startSampler(); returns its seq"
+		n = self.numSensors
+		frame = self._frameValues
+		if self._checkCalibration() or not self._calibrations:
+			# frames from the next one on use these tables; replaced,
+			# not appended to, so calibrationFor() never sees it change
+			self._calibrations = self._calibrations[-3:] + [(self.samples.seq + 1,
+				self.calibration.calibratedMin,self.calibration.calibratedMax)]
+		if inst is not None:
+			start = time.perf_counter_ns()
+			raw = self.AnalogRead()
+			inst.adc.record(time.perf_counter_ns() - start)
+		else:
+			raw = self.AnalogRead()
+		now = self._clock()
+		if online is not None:
+			online.update(raw)
+		self.last_value,sensor_values = self.calibration.line(raw,white_line,self.last_value)
+		frame[0] = self.last_value
+		frame[1:n+1] = sensor_values
+		frame[n+1:] = raw
+		return self.samples.write(now,frame)
+
+	def _sample(self, period, white_line, inst = None, online = None):
+		deadline = time.perf_counter()
+		while self._sampling:
+			self.sample(white_line,inst,online)
+			deadline += period
+			delay = deadline - time.perf_counter()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				# fell behind: skip the missed slots instead of bursting
+				deadline = time.perf_counter()
+
+	def _frame(self, frame):
+		if frame is None:
+			return None
+		n = self.numSensors
+		seq,timestamp,values = frame
+		return seq,timestamp,values[0],values[1:n+1],[int(v) for v in values[n+1:]]
+
+	"""
+	Newest sample as (seq, timestamp, position, calibrated values, raw
+	values), or None before the first one.  timestamp is time.perf_counter().
+	"""
+	def latest(self):
+		return self._frame(self.samples.latest())
+
+	def calibrationFor(self, seq):
+		"(calibratedMin, calibratedMax) the sampler computed frame seq with"
+		for first,calibratedMin,calibratedMax in reversed(self._calibrations):
+			if first <= seq:
+				return calibratedMin,calibratedMax
+		return self.calibration.calibratedMin,self.calibration.calibratedMax
+
+	def since(self, seq):
+		return [self._frame(f) for f in self.samples.since(seq)]
+
+	"""
+	Mean (position, calibrated values, raw values) over the newest count
+	samples or over the last seconds of samples.
+	"""
+	def average(self, count = None, seconds = None):
+		values = self.samples.average(count,seconds)
+		if values is None:
+			return None
+		n = self.numSensors
+		return values[0],values[1:n+1],values[n+1:]
+
+
 # Simple example prints accel/mag data once per second:
 if __name__ == '__main__':
 	TR = TRSensor()
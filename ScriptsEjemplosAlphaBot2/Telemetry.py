@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import json
+import math
+import socket
+import select
+import threading
+import time
+from RingBuffer import FrameRing
+
+TELEMETRY_PORT = 5004
+
+# Record layout.  Control loops fill Telemetry.frame by index and commit().
+FIELDS = ['position',
+	'raw0', 'raw1', 'raw2', 'raw3', 'raw4',
+	'cal0', 'cal1', 'cal2', 'cal3', 'cal4',
+	'proportional', 'integral', 'derivative', 'output',
+	'dutyA', 'dutyB', 'distance']
+POSITION = 0
+RAW = 1
+CAL = 6
+PROPORTIONAL = 11
+INTEGRAL = 12
+DERIVATIVE = 13
+OUTPUT = 14
+DUTY_A = 15
+DUTY_B = 16
+DISTANCE = 17
+
+NAN = float('nan')
+
+"""
+Telemetry channel that keeps printing out of the control loops.
+
+The loop writes into a preallocated frame and commit() copies it into a
+FrameRing: no lock, no allocation, no I/O.  A publisher thread wakes rate
+times per second, takes the newest record (the rest are decimated away),
+and streams it as one JSON line to every TCP subscriber on port 5004.
+Fields that were never set are sent as null.  Subscribers that cannot keep
+up are dropped instead of slowing the publisher down.  If the port cannot
+be bound (another script has it) start() says so once and the channel
+stays off, commit() still works: diagnostics never stop the robot.
+
+	nc robot.local 5004
+"""
+class Telemetry(object):
+
+	def __init__(self, rate = 20, capacity = 256, port = TELEMETRY_PORT, host = '0.0.0.0'):
+		self.rate = rate
+		self.port = port
+		self.host = host
+		self.ring = FrameRing(len(FIELDS), capacity)
+		self.frame = [NAN] * len(FIELDS)
+		self.published = 0
+		self.dropped = 0
+		self.subscribers = []
+		self._server = None
+		self._running = False
+		self._thread = None
+
+	def commit(self, timestamp = None):
+		"Publishes the current frame; cheap enough for every control iteration"
+		self.ring.write(time.monotonic() if timestamp is None else timestamp, self.frame)
+
+	def record(self, **values):
+		"Convenience for code outside hot paths"
+		for name, value in values.items():
+			self.frame[FIELDS.index(name)] = value
+		self.commit()
+
+	def start(self):
+		server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		try:
+			server.bind((self.host, self.port))
+			server.listen(4)
+		except OSError as e:
+			server.close()
+			print('telemetry off, port %d: %s' % (self.port, e))
+			return self
+		self._server = server
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		for client in self.subscribers:
+			client.close()
+		self.subscribers = []
+		if self._server is not None:
+			self._server.close()
+			self._server = None
+
+	def encode(self, frame):
+		seq, timestamp, values = frame
+		record = {'seq': seq, 't': round(timestamp, 6)}
+		for name, value in zip(FIELDS, values):
+			record[name] = None if math.isnan(value) else value
+		return (json.dumps(record) + '\n').encode('utf-8')
+
+	def _accept(self):
+		client, address = self._server.accept()
+		client.setblocking(False)
+		client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.subscribers.append(client)
+
+	def _send(self, data):
+		for client in list(self.subscribers):
+			try:
+				sent = client.send(data)
+			except (BlockingIOError, OSError):
+				sent = -1
+			if sent != len(data):
+				# full send buffer or gone: drop it rather than block
+				self.dropped += 1
+				self.subscribers.remove(client)
+				client.close()
+
+	def _run(self):
+		period = 1.0 / self.rate
+		deadline = time.monotonic()
+		last = 0
+		while self._running:
+			deadline += period
+			timeout = max(deadline - time.monotonic(), 0)
+			readable = select.select([self._server], [], [], timeout)[0]
+			if readable:
+				self._accept()
+				continue
+			seq = self.ring.seq
+			if seq == last or not self.subscribers:
+				last = seq
+				continue
+			frame = self.ring.latest()
+			last = seq
+			if frame is not None:
+				self._send(self.encode(frame))
+				self.published += 1
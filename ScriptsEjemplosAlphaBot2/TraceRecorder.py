@@ -0,0 +1,319 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import glob
+import json
+import time
+import queue
+import struct
+import threading
+
+# time.strftime() pattern, so every run gets its own file
+TRACE = 'line_follow-%Y%m%d-%H%M%S.trace'
+MAGIC = b'ABTRACE1'
+HEADER = 512             # bytes: MAGIC, then the JSON header padded with spaces
+
+# flags
+FRESH = 1                # the step got a new sensor frame
+OFF_TRACK = 2            # the step stopped the motors: robot lifted or on black
+
+"""
+(name, struct code, count) of one record, one per control step:
+
+	t             time.perf_counter() of the step
+	sampled       time.perf_counter() of the sensor frame it used
+	seq           sampler frame number (0 without the sampler)
+	dt            dt the step was called with
+	raw           AnalogRead values
+	calMin/Max    the calibration in use, so replay follows online changes
+	position      readLine position, estimate what the PID was given
+	proportional, integral, derivative, output    the PID terms
+	dutyA/B       setPWMA/setPWMB, maximum the speed cap
+"""
+def fields(numSensors = 5):
+	return [('t', 'd', 1), ('sampled', 'd', 1), ('seq', 'I', 1), ('dt', 'd', 1),
+		('raw', 'H', numSensors), ('calMin', 'H', numSensors), ('calMax', 'H', numSensors),
+		('position', 'f', 1), ('estimate', 'f', 1),
+		('proportional', 'f', 1), ('integral', 'f', 1), ('derivative', 'f', 1), ('output', 'f', 1),
+		('dutyA', 'f', 1), ('dutyB', 'f', 1), ('maximum', 'f', 1), ('flags', 'H', 1)]
+
+def recordStruct(numSensors = 5):
+	return struct.Struct('<' + ''.join('%d%s' % (count, code) for name, code, count in fields(numSensors)))
+
+def dtype(numSensors = 5):
+	"NumPy structured dtype of a record, packed like recordStruct()"
+	import numpy as np
+	codes = {'d': '<f8', 'f': '<f4', 'I': '<u4', 'H': '<u2'}
+	return np.dtype([(name, codes[code]) if count == 1 else (name, codes[code], (count,))
+		for name, code, count in fields(numSensors)])
+
+"""
+Binary trace of a line follow run.
+
+write() packs one fixed-size record into a preallocated buffer with
+struct.pack_into, so a control step pays for one call and no allocation or
+I/O.  A full buffer is handed to a writer thread and the spare one takes
+its place; if the storage cannot keep up, records are dropped and counted
+instead of blocking the loop.  The file is a HEADER-byte JSON header
+(sensors, white_line, PID gains, estimator settings) followed by the
+records, which load() maps as a NumPy structured array.
+
+	recorder = TraceRecorder(tracePath(), follower)
+	follower.recorder = recorder
+	...
+	recorder.close()
+"""
+class TraceRecorder(object):
+
+	def __init__(self, path = TRACE, follower = None, capacity = 1024, numSensors = None, white_line = 0):
+		if numSensors is None:
+			numSensors = follower.TR.numSensors if follower is not None else 5
+		self.path = path
+		self.numSensors = numSensors
+		self.struct = recordStruct(numSensors)
+		self.size = self.struct.size
+		self.capacity = capacity
+		self.buffer = bytearray(capacity * self.size)
+		self.offset = 0
+		self.records = 0
+		self.dropped = 0
+		self._free = queue.Queue()
+		self._free.put(bytearray(capacity * self.size))
+		self._full = queue.Queue()
+		header = {'version': 1, 'numSensors': numSensors, 'white_line': white_line, 'created': time.time()}
+		if follower is not None:
+			pid = follower.pid
+			header.update(kp = pid.kp, ki = pid.ki, kd = pid.kd, limit = pid.limit,
+				integralLimit = pid.integralLimit, maximum = follower.maximum)
+			estimator = follower.estimator
+			if estimator is not None:
+				header['estimator'] = {'accel': estimator.accel, 'noise': estimator.noise,
+					'gain': estimator.gain, 'threshold': estimator.threshold,
+					'reach': estimator.high - (numSensors - 1)*1000, 'spread': estimator.spread}
+		text = json.dumps(header).encode('utf-8')
+		if len(text) > HEADER - len(MAGIC):
+			raise ValueError('trace header too long')
+		self.file = open(path, 'wb')
+		self.file.write(MAGIC + text.ljust(HEADER - len(MAGIC)))
+		self._writer = threading.Thread(target=self._write)
+		self._writer.daemon = True
+		self._writer.start()
+
+	def write(self, *values):
+		"One record, values in fields() order with the arrays flattened"
+		if self.offset == len(self.buffer):
+			self._swap()
+		self.struct.pack_into(self.buffer, self.offset, *values)
+		self.offset += self.size
+		self.records += 1
+
+	def step(self, follower, dt):
+		"Records the step LineFollower just took"
+		TR = follower.TR
+		if TR.samples is not None:
+			# the tables the frame was computed with, the online
+			# calibration may have replaced them since
+			calibratedMin, calibratedMax = TR.calibrationFor(follower.lastSeq)
+		else:
+			calibratedMin, calibratedMax = TR.calibration.calibratedMin, TR.calibration.calibratedMax
+		pid = follower.pid
+		flags = (FRESH if follower.fresh else 0) | (OFF_TRACK if follower.offTrack else 0)
+		raw = follower.raw
+		if raw is None:
+			raw = [0] * self.numSensors
+		if self.offset == len(self.buffer):
+			self._swap()
+		self.struct.pack_into(self.buffer, self.offset, follower.now, follower.timestamp,
+			follower.lastSeq, dt, *raw, *calibratedMin, *calibratedMax,
+			follower.position, follower.estimate, pid.proportional, pid.integral, pid.derivative,
+			pid.output, follower.Ab.PA, follower.Ab.PB, follower.maximum, flags)
+		self.offset += self.size
+		self.records += 1
+
+	def _swap(self):
+		try:
+			spare = self._free.get_nowait()
+		except queue.Empty:
+			# the writer is still busy with the other buffer: overwrite
+			self.dropped += self.offset // self.size
+			self.records -= self.offset // self.size
+			self.offset = 0
+			return
+		self._full.put((self.buffer, self.offset))
+		self.buffer = spare
+		self.offset = 0
+
+	def _write(self):
+		while True:
+			item = self._full.get()
+			if item is None:
+				return
+			buffer, length = item
+			self.file.write(memoryview(buffer)[:length])
+			self._free.put(buffer)
+
+	def close(self):
+		if self.file is None:
+			return
+		self._full.put((self.buffer, self.offset))
+		self._full.put(None)
+		self._writer.join()
+		self.file.close()
+		self.file = None
+
+def tracePath(path = None):
+	"Where to record: path (TRACE by default) with its strftime fields filled in"
+	return time.strftime(path or TRACE)
+
+def traceOption(argv):
+	"""
+	--trace [path] on a command line: None without it, else the path
+	pattern for tracePath().  Recording is opt in, it writes about 24KB/s.
+	"""
+	if '--trace' not in argv:
+		return None
+	i = argv.index('--trace')
+	if i + 1 < len(argv) and not argv[i + 1].startswith('-'):
+		return argv[i + 1]
+	return TRACE
+
+def newest(directory = '.'):
+	"The most recent trace recorded under the default name, or None"
+	paths = glob.glob(os.path.join(directory, 'line_follow-*.trace'))
+	return max(paths, key = os.path.getmtime) if paths else None
+
+def header(path):
+	with open(path, 'rb') as f:
+		data = f.read(HEADER)
+	if len(data) < HEADER or not data.startswith(MAGIC):
+		raise ValueError('%s is not a trace' % path)
+	return json.loads(data[len(MAGIC):].decode('utf-8'))
+
+def load(path):
+	"(header, records) with the records memory-mapped as a NumPy structured array"
+	import numpy as np
+	info = header(path)
+	kind = dtype(info['numSensors'])
+	count = (os.path.getsize(path) - HEADER) // kind.itemsize
+	if count == 0:
+		return info, np.zeros(0, dtype = kind)
+	# a run cut short leaves a partial last record, which is left out
+	return info, np.memmap(path, dtype = kind, mode = 'r', offset = HEADER, shape = (count,))
+
+class ReplaySensors(object):
+	"The TRSensor sampler interface LineFollower reads, fed from a trace"
+
+	def __init__(self, numSensors, white_line = 0):
+		self.numSensors = numSensors
+		self.white_line = white_line
+		self.samples = True
+		self.calibration = None
+		self.last_value = 0
+		self.frame = None
+
+	def latest(self):
+		return self.frame
+
+class ReplayMotors(object):
+
+	def __init__(self):
+		self.PA = 0
+		self.PB = 0
+
+	def setPWMA(self, value):
+		self.PA = value
+
+	def setPWMB(self, value):
+		self.PB = value
+
+"""
+Runs a trace back through LineCalibration and the LineFollower control law
+as fast as the CPU allows; no sleeping, the recorded times drive the
+estimator.  pid, maximum and estimator default to what the run used, pass
+others to see what they would have done with the same sensor data.
+Returns a copy of the records with position, estimate, the PID terms and
+the duties recomputed.
+"""
+def replay(info, trace, pid = None, maximum = None, estimator = None):
+	import numpy as np
+	from LineCalibration import LineCalibration
+	from ControlLoop import PID, LineFollower
+	n = info['numSensors']
+	if pid is None:
+		pid = PID(info['kp'], info['ki'], info['kd'], info['limit'], info.get('integralLimit'))
+	if estimator is None and info.get('estimator'):
+		from LineEstimator import LineEstimator
+		estimator = LineEstimator(n, white_line = info['white_line'], **info['estimator'])
+	TR = ReplaySensors(n, info['white_line'])
+	Ab = ReplayMotors()
+	now = [0.0]
+	follower = LineFollower(TR, Ab, maximum or info['maximum'], pid, estimator = estimator,
+		clock = lambda: now[0])
+	result = np.array(trace)
+	columns = dict((name, trace[name].tolist()) for name in ('t', 'sampled', 'dt', 'raw', 'calMin', 'calMax', 'maximum', 'flags'))
+	out = dict((name, [0.0] * len(trace)) for name in ('position', 'estimate', 'proportional',
+		'integral', 'derivative', 'output', 'dutyA', 'dutyB'))
+	calibration = None
+	seq = 0
+	white_line = info['white_line']
+	for i in range(0, len(trace)):
+		calMin = columns['calMin'][i]
+		calMax = columns['calMax'][i]
+		if calibration is None or not calibration.matches(calMin, calMax):
+			calibration = TR.calibration = LineCalibration(n, calMin, calMax)
+		if columns['flags'][i] & FRESH or TR.frame is None:
+			seq += 1
+			raw = columns['raw'][i]
+			TR.last_value, values = calibration.line(raw, white_line, TR.last_value)
+			TR.frame = (seq, columns['sampled'][i], TR.last_value, values, raw)
+		now[0] = columns['t'][i]
+		if maximum is None:
+			follower.maximum = columns['maximum'][i]
+		follower.step(columns['dt'][i])
+		p = follower.pid
+		row = (follower.position, follower.estimate, p.proportional, p.integral, p.derivative,
+			p.output, Ab.PA, Ab.PB)
+		for name, value in zip(('position', 'estimate', 'proportional', 'integral', 'derivative',
+				'output', 'dutyA', 'dutyB'), row):
+			out[name][i] = value
+	for name, values in out.items():
+		result[name] = values
+	return result
+
+if __name__ == '__main__':
+	import sys
+	import argparse
+	import numpy as np
+	parser = argparse.ArgumentParser(description = 'Summarise and replay a line follow trace')
+	parser.add_argument('trace', nargs = '?', help = 'the newest line_follow-*.trace by default')
+	parser.add_argument('--kp', type = float)
+	parser.add_argument('--ki', type = float)
+	parser.add_argument('--kd', type = float)
+	parser.add_argument('--maximum', type = float)
+	args = parser.parse_args()
+	if args.trace is None:
+		args.trace = newest()
+		if args.trace is None:
+			parser.error('no line_follow-*.trace here, name one')
+	info, trace = load(args.trace)
+	if len(trace) == 0:
+		print('%s: no records' % args.trace)
+		sys.exit(1)
+	span = trace['t'][-1] - trace['t'][0]
+	print('%s: %d records, %.1fs, %d fresh frames, %d off track' % (args.trace, len(trace), span,
+		np.count_nonzero(trace['flags'] & FRESH), np.count_nonzero(trace['flags'] & OFF_TRACK)))
+	started = time.perf_counter()
+	same = replay(info, trace)
+	elapsed = time.perf_counter() - started
+	print('replayed in %.2fs, %.0fx real time' % (elapsed, span / elapsed if elapsed else 0))
+	for name in ('position', 'estimate', 'output', 'dutyA', 'dutyB'):
+		print('  %-9s max |recorded - replayed| %g' % (name, np.max(np.abs(trace[name] - same[name]))))
+	if any(v is not None for v in (args.kp, args.ki, args.kd, args.maximum)):
+		from ControlLoop import PID
+		maximum = args.maximum or info['maximum']
+		pid = PID(info['kp'] if args.kp is None else args.kp, info['ki'] if args.ki is None else args.ki,
+			info['kd'] if args.kd is None else args.kd, maximum)
+		other = replay(info, trace, pid, args.maximum)
+		print('with kp=%g ki=%g kd=%g maximum=%g:' % (pid.kp, pid.ki, pid.kd, maximum))
+		for name in ('output', 'dutyA', 'dutyB'):
+			print('  %-9s mean |recorded - replayed| %g' % (name, np.mean(np.abs(trace[name] - other[name]))))
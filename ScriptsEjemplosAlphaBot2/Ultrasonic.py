@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import time
+import GPIOBackend
+from GPIOBackend import HIGH, LOW
+import threading
+
+TRIG = 22
+ECHO = 27
+
+SPEED_OF_SOUND = 34000   # cm/s, same constant the example scripts use
+
+"""
+Non-blocking HC-SR04 ranging service.
+
+A background thread fires TRIG at a fixed rate and the ECHO pulse is timed
+from GPIO edge callbacks with time.perf_counter_ns(), so nothing ever
+busy-waits on the pin.  Each ping is bounded by the max-range timeout; a
+median filter over the last readings rejects outliers.  distance() only
+returns the cached result and never blocks.
+"""
+class UltrasonicRanger(object):
+
+	def __init__(self, trig=TRIG, echo=ECHO, rate=20, maxRange=200, window=5, staleAfter=0.5, gpio=None):
+		self.TRIG = trig
+		self.ECHO = echo
+		self.period = 1.0/rate
+		self.maxRange = maxRange
+		self.window = window
+		self.staleAfter = staleAfter
+		# round trip to maxRange plus the ~0.5ms the module takes to start ECHO
+		self.timeout = 2.0*maxRange/SPEED_OF_SOUND + 0.001
+		self.readings = []
+		self._distance = None
+		self.timestamp = 0.0
+		self.raw = None
+		self.pings = 0
+		self.timeouts = 0
+		self.rejected = 0
+		self._armed = False
+		self._rise = None
+		self._width = None
+		self._echo = threading.Event()
+		self._running = False
+		self._thread = None
+		self.gpio = gpio if gpio is not None else GPIOBackend.default()
+		self.gpio.setup(self.TRIG,GPIOBackend.OUT,initial=LOW)
+		self.gpio.setup(self.ECHO,GPIOBackend.IN)
+		self.gpio.add_event_detect(self.ECHO,GPIOBackend.BOTH,callback=self._edge)
+
+	def _edge(self, channel):
+		# The first edge after trigger() is the start of the echo and the
+		# second its end.  Reading ECHO here instead would lose short
+		# echoes: a 3cm one is over in 175us, less than the callback
+		# latency can be.
+		now = time.perf_counter_ns()
+		if not self._armed:
+			return
+		if self._rise is None:
+			self._rise = now
+		else:
+			self._width = now - self._rise
+			self._rise = None
+			self._armed = False
+			self._echo.set()
+
+	def ping(self):
+		"One measurement in cm, maxRange when nothing is in range, None if the echo never came"
+		self.trigger()
+		time.sleep(0.000015)
+		self.release()
+		return self.result(self._echo.wait(self.timeout))
+
+	"""
+	ping() in three non-blocking steps for a caller that has other work to
+	do meanwhile (SensorScheduler.py): trigger(), release() at least 10us
+	later, then result() once echoed() or timeout seconds after release().
+	"""
+	def trigger(self):
+		self._echo.clear()
+		self._rise = None
+		self._width = None
+		self._armed = True
+		self.gpio.output(self.TRIG,HIGH)
+
+	def release(self):
+		self.gpio.output(self.TRIG,LOW)
+		self.pings += 1
+
+	def echoed(self):
+		return self._echo.is_set()
+
+	def result(self, echoed):
+		self._armed = False
+		if not echoed:
+			if self._rise is not None:
+				# echo started but is longer than maxRange: nothing in range
+				self._rise = None
+				return self.maxRange
+			self.timeouts += 1
+			return None
+		return min(self._width*1e-9*SPEED_OF_SOUND/2, self.maxRange)
+
+	def store(self, value):
+		"Keeps a ping() result as the latest reading"
+		self.raw = value
+		if value is not None:
+			self._distance = self._filter(value)
+			self.timestamp = time.monotonic()
+
+	def _filter(self, value):
+		readings = self.readings
+		if len(readings) >= 3:
+			ordered = sorted(readings)
+			median = ordered[len(ordered)//2]
+			spread = max(ordered[-1] - ordered[0], 5.0)
+			# a single reading far away from everything recent is noise
+			if abs(value - median) > 2*spread:
+				self.rejected += 1
+				readings.pop(0)
+				readings.append(value)
+				return median
+		readings.append(value)
+		if len(readings) > self.window:
+			readings.pop(0)
+		ordered = sorted(readings)
+		return ordered[len(ordered)//2]
+
+	def _run(self):
+		deadline = time.monotonic()
+		while self._running:
+			self.store(self.ping())
+			deadline += self.period
+			delay = deadline - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				deadline = time.monotonic()
+
+	def start(self):
+		if self._running:
+			return self
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def distance(self):
+		"Latest filtered distance in cm, or None if there is no recent reading"
+		if self._distance is None or time.monotonic() - self.timestamp > self.staleAfter:
+			return None
+		return self._distance
+
+	def close(self):
+		self.stop()
+		self.gpio.remove_event_detect(self.ECHO)
@@ -1,40 +1,47 @@
-import RPi.GPIO as GPIO
+import GPIOBackend
+import sys
 import time
 from AlphaBot2 import AlphaBot2
+from Ultrasonic import UltrasonicRanger
+from Watchdog import MotionWatchdog
+from Telemetry import Telemetry, DISTANCE, DUTY_A, DUTY_B, NAN
 
 TRIG = 22
 ECHO = 27
 
 Ab = AlphaBot2()
+Ranger = UltrasonicRanger(TRIG,ECHO,rate=25).start()
+# stops the motors if this loop stalls for more than 200ms
+Watchdog = MotionWatchdog(Ab).register('ultrasonic',200)
+# --telemetry streams the distance and duty cycles on port 5004
+Live = Telemetry()
+if '--telemetry' in sys.argv:
+	Live.start()
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(TRIG,GPIO.OUT,initial=GPIO.LOW)
-GPIO.setup(ECHO,GPIO.IN)
-
-def Distance():
-	GPIO.output(TRIG,GPIO.HIGH)
-	time.sleep(0.000015)
-	GPIO.output(TRIG,GPIO.LOW)
-	while not GPIO.input(ECHO):
-		pass
-	t1 = time.time()
-	while GPIO.input(ECHO):
-		pass
-	t2 = time.time()
-	return (t2-t1)*34000/2
-	
 print("Ultrasonic_Obstacle_Avoidance")
 try:
 	while True:
-		Dist = Distance()
-		print("Distance = %0.2f cm"%Dist)
-		if Dist <= 20:
-			Ab.right()
-#			Ab.left()
+		Dist = Ranger.distance()
+		if Dist is None:
+			# no recent reading from the sensor: do not drive blind
+			Ab.stop()
+			Watchdog.release('ultrasonic')
+			Live.frame[DISTANCE] = NAN
 		else:
-			Ab.forward()
+			Watchdog.refresh('ultrasonic')
+			Live.frame[DISTANCE] = Dist
+			if Dist <= 20:
+				Ab.right()
+#				Ab.left()
+			else:
+				Ab.forward()
+		Live.frame[DUTY_A] = Ab.duty[Ab.ENA]
+		Live.frame[DUTY_B] = Ab.duty[Ab.ENB]
+		Live.commit()
 		time.sleep(0.02)
 
 except KeyboardInterrupt:
-	GPIO.cleanup()
+	Watchdog.stop()
+	Live.stop()
+	Ranger.close()
+	GPIOBackend.default().cleanup()
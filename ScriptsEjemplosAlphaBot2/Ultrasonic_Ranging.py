@@ -1,31 +1,20 @@
-import RPi.GPIO as GPIO
+import GPIOBackend
 import time
+from Ultrasonic import UltrasonicRanger
 
 TRIG = 22
 ECHO = 27
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(TRIG,GPIO.OUT,initial=GPIO.LOW)
-GPIO.setup(ECHO,GPIO.IN)
-
-def dist():
-	GPIO.output(TRIG,GPIO.HIGH)
-	time.sleep(0.000015)
-	GPIO.output(TRIG,GPIO.LOW)
-	while not GPIO.input(ECHO):
-		pass
-	t1 = time.time()
-	while GPIO.input(ECHO):
-		pass
-	t2 = time.time()
-	return (t2-t1)*34000/2
-
-
+Ranger = UltrasonicRanger(TRIG,ECHO,rate=10).start()
 
 try:
 	while True:
-		print("Distance:%0.2f cm" % dist())
+		Dist = Ranger.distance()
+		if Dist is None:
+			print("Distance: no echo")
+		else:
+			print("Distance:%0.2f cm" % Dist)
 		time.sleep(1)
 except KeyboardInterrupt:
-	GPIO.cleanup()
+	Ranger.close()
+	GPIOBackend.default().cleanup()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import time
+import threading
+
+def now_ms():
+	return time.monotonic_ns() // 1000000
+
+"""
+Deadman watchdog for everything that can make AlphaBot2 move.
+
+Each motion source (IR remote, avoidance loop, network client, ...) holds a
+lease and has to refresh() it at least every timeout ms while it wants the
+motors running.  A timer thread, raised to real-time priority when allowed,
+sleeps until the earliest lease expires and calls bot.stop(force=True) when
+one does, so the stop latency is bounded by the timeout plus one wakeup,
+whatever the source is stuck on, and the stop is written out even if the
+bot believes its motors are already off.  release() ends a lease without
+tripping, e.g. after the source stopped the motors itself.
+
+owns(source), when given, is asked on the timer thread before stopping: a
+lease whose source no longer drives the motors (a joystick client after
+line following took over) just ends, counted in ignored.
+"""
+class MotionWatchdog(object):
+
+	def __init__(self, bot, onTrip = None, priority = 50, owns = None):
+		self.bot = bot
+		self.onTrip = onTrip
+		self.priority = priority
+		self.owns = owns
+		self.timeouts = {}
+		self.deadlines = {}
+		self.trips = {}
+		self.ignored = {}
+		self.lastTrip = None
+		self._cond = threading.Condition()
+		self._running = True
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def register(self, source, timeout):
+		"timeout in ms"
+		with self._cond:
+			self.timeouts[source] = timeout
+			self.trips.setdefault(source, 0)
+			self.ignored.setdefault(source, 0)
+		return self
+
+	def refresh(self, source):
+		deadline = now_ms() + self.timeouts[source]
+		with self._cond:
+			wake = source not in self.deadlines
+			self.deadlines[source] = deadline
+			if wake:
+				self._cond.notify()
+
+	def release(self, source):
+		with self._cond:
+			self.deadlines.pop(source, None)
+
+	def active(self):
+		with self._cond:
+			return list(self.deadlines)
+
+	def _realtime(self):
+		try:
+			os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+		except (AttributeError, OSError):
+			# not root or not Linux: run at normal priority
+			pass
+
+	def _run(self):
+		self._realtime()
+		with self._cond:
+			while self._running:
+				if not self.deadlines:
+					self._cond.wait()
+					continue
+				source = min(self.deadlines, key=self.deadlines.get)
+				delay = self.deadlines[source] - now_ms()
+				if delay > 0:
+					self._cond.wait(delay / 1000.0)
+					continue
+				del self.deadlines[source]
+				if self.owns is not None and not self.owns(source):
+					self.ignored[source] += 1
+					continue
+				self.trips[source] += 1
+				self.lastTrip = source
+				self.bot.stop(force = True)
+				if self.onTrip is not None:
+					self.onTrip(source)
+
+	def stop(self):
+		with self._cond:
+			self._running = False
+			self._cond.notify()
+		self._thread.join()